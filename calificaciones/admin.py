@@ -1,9 +1,14 @@
 from django.contrib import admin
 from django.contrib.auth.models import Group
+from django.core.exceptions import PermissionDenied
+from django.db.models import BooleanField, ExpressionWrapper, Q
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import User
 from django.utils.html import format_html
-from .models import Empresa, CalificacionTributaria, FactoresCalificacion, ArchivoCarga, Profile, PasswordResetToken
+from . import instrumentacion
+from .models import Empresa, CalificacionTributaria, FactoresCalificacion, ArchivoCarga, Profile, PasswordResetToken, CorreoSaliente, TokenAPI, SubidaCarga
 
 # ==========================================
 # CONFIGURACIÓN ADMINISTRATIVA PROFESIONAL
@@ -12,6 +17,7 @@ from .models import Empresa, CalificacionTributaria, FactoresCalificacion, Archi
 admin.site.site_header = "NUAM Capital - Sistema de Gestión Tributaria"
 admin.site.site_title = "Panel de Administración NUAM"
 admin.site.index_title = "Administración del Sistema"
+admin.site.index_template = 'admin/index_nuam.html'
 admin.site.unregister(Group)
 
 # ==========================================
@@ -190,6 +196,21 @@ class CalificacionTributariaAdmin(admin.ModelAdmin):
 # MODELADMIN PARA FACTORES
 # ==========================================
 
+class ValidezFactoresFilter(admin.SimpleListFilter):
+    """Filtra por la columna generada suma_8_16 (indexada), no fila por fila en Python"""
+    title = 'validación'
+    parameter_name = 'validez'
+
+    def lookups(self, request, model_admin):
+        return [('invalidos', '❌ Solo inválidos'), ('validos', '✅ Solo válidos')]
+
+    def queryset(self, request, queryset):
+        if self.value() == 'invalidos':
+            return queryset.filter(suma_8_16__gt=1)
+        if self.value() == 'validos':
+            return queryset.filter(suma_8_16__lte=1)
+        return queryset
+
 @admin.register(FactoresCalificacion)
 class FactoresCalificacionAdmin(admin.ModelAdmin):
     list_display = [
@@ -201,14 +222,21 @@ class FactoresCalificacionAdmin(admin.ModelAdmin):
         'validacion_badge'
     ]
     
-    list_filter = ['calificacion__ejercicio', 'calificacion__mercado', 'calificacion__usuario']
+    list_filter = [ValidezFactoresFilter, 'calificacion__ejercicio', 'calificacion__mercado', 'calificacion__usuario']
     search_fields = ['calificacion__instrumento', 'calificacion__empresa__nombre', 'calificacion__usuario__username']
     readonly_fields = ['suma_factores_8_16']
     list_per_page = 20
+    # Evita un COUNT(*) extra sobre la tabla completa cuando hay filtros activos
+    show_full_result_count = False
     
     # ✅ MOSTRAR TODOS LOS FACTORES DE TODOS LOS USUARIOS
     def get_queryset(self, request):
-        return super().get_queryset(request).select_related('calificacion__usuario', 'calificacion__empresa')
+        # Suma y validez vienen de la base de datos (columna generada suma_8_16)
+        return (
+            super().get_queryset(request)
+            .select_related('calificacion__usuario', 'calificacion__empresa')
+            .annotate(valido=ExpressionWrapper(Q(suma_8_16__lte=1), output_field=BooleanField()))
+        )
     
     fieldsets = (
         ('Relación', {
@@ -244,14 +272,18 @@ class FactoresCalificacionAdmin(admin.ModelAdmin):
     calificacion_link.short_description = 'Calificación'
     
     def suma_factores_8_16(self, obj):
-        return obj.validar_factores()
+        # La base de datos la calcula al guardar: un registro nuevo aún no la tiene
+        return obj.suma_8_16 if obj.pk else '-'
     suma_factores_8_16.short_description = 'Σ Factores 8-16'
+    suma_factores_8_16.admin_order_field = 'suma_8_16'
     
     def validacion_badge(self, obj):
-        if obj.validar_factores():
+        if obj.valido:
             return format_html('<span style="color: green;">✅ Válido</span>')
         return format_html('<span style="color: red;">❌ Inválido</span>')
     validacion_badge.short_description = 'Validación'
+    # Ordenar por la suma (indexada) agrupa válidos e inválidos
+    validacion_badge.admin_order_field = 'suma_8_16'
 
 # ==========================================
 # MODELADMIN PARA ARCHIVOS DE CARGA (MODIFICADO)
@@ -267,12 +299,20 @@ class ArchivoCargaAdmin(admin.ModelAdmin):
         'fecha_carga',
         'estado_badge',
         'registros_procesados',
+        'registros_insertados',
+        'registros_actualizados',
+        'registros_sin_cambios',
         'registros_error'
     ]
     
     list_filter = ['tipo_carga', 'estado', 'fecha_carga', 'empresa__usuario']
     search_fields = ['nombre_archivo', 'empresa__nombre', 'empresa__usuario__username']
-    readonly_fields = ['fecha_carga', 'registros_procesados', 'registros_error']
+    readonly_fields = [
+        'fecha_carga', 'registros_procesados', 'registros_insertados', 'registros_actualizados',
+        'registros_sin_cambios', 'registros_error', 'mensaje_error',
+        'intentos', 'proximo_intento', 'trabajador', 'latido', 'ultima_linea', 'ultimo_byte', 'errores_confirmados',
+        'tamano', 'sha256'
+    ]
     list_per_page = 15
     date_hierarchy = 'fecha_carga'
     
@@ -306,7 +346,8 @@ class ArchivoCargaAdmin(admin.ModelAdmin):
             'PENDIENTE': 'orange',
             'PROCESANDO': 'blue',
             'COMPLETADO': 'green',
-            'ERROR': 'red'
+            'ERROR': 'red',
+            'CANCELADO': 'gray'
         }
         return format_html(
             '<span style="background-color: {}; color: white; padding: 2px 8px; border-radius: 10px; font-size: 11px;">{}</span>',
@@ -315,6 +356,23 @@ class ArchivoCargaAdmin(admin.ModelAdmin):
         )
     estado_badge.short_description = 'Estado'
 
+# ==========================================
+# ADMIN PARA LAS SUBIDAS POR PARTES
+# ==========================================
+
+@admin.register(SubidaCarga)
+class SubidaCargaAdmin(admin.ModelAdmin):
+    list_display = ['nombre_archivo', 'usuario', 'empresa', 'estado', 'recibidos', 'tamano', 'fecha_actualizacion']
+    list_filter = ['estado', 'tipo_carga']
+    search_fields = ['nombre_archivo', 'usuario__username', 'empresa__nombre']
+    readonly_fields = [
+        'usuario', 'empresa', 'tipo_carga', 'nombre_archivo', 'tamano', 'recibidos', 'sha256',
+        'archivo_carga', 'fecha_creacion', 'fecha_actualizacion'
+    ]
+
+    def has_add_permission(self, request):
+        return False
+
 # ==========================================
 # ADMIN PARA TOKENS DE PASSWORD RESET
 # ==========================================
@@ -331,6 +389,61 @@ class PasswordResetTokenAdmin(admin.ModelAdmin):
     is_valid.boolean = True
     is_valid.short_description = 'Válido'
 
+# ==========================================
+# ADMIN PARA LA BANDEJA DE SALIDA DE CORREOS
+# ==========================================
+
+@admin.register(CorreoSaliente)
+class CorreoSalienteAdmin(admin.ModelAdmin):
+    list_display = ['asunto', 'destinatarios', 'estado', 'intentos', 'fecha_creacion', 'fecha_envio']
+    list_filter = ['estado', 'fecha_creacion']
+    search_fields = ['asunto', 'destinatarios']
+    # El cuerpo contiene códigos MFA y enlaces de recuperación: no se muestra
+    exclude = ['cuerpo', 'cuerpo_html']
+    readonly_fields = [
+        'asunto', 'remitente', 'destinatarios', 'estado', 'intentos', 'proximo_intento',
+        'trabajador', 'reclamado', 'ultimo_error', 'fecha_creacion', 'fecha_envio'
+    ]
+    date_hierarchy = 'fecha_creacion'
+
+    def has_add_permission(self, request):
+        return False
+
+# ==========================================
+# ADMIN PARA TOKENS DE LA API
+# ==========================================
+
+@admin.register(TokenAPI)
+class TokenAPIAdmin(admin.ModelAdmin):
+    list_display = ['nombre', 'usuario', 'activo', 'fecha_creacion', 'ultimo_uso']
+    list_filter = ['activo', 'fecha_creacion']
+    search_fields = ['nombre', 'usuario__username']
+    readonly_fields = ['usuario', 'nombre', 'fecha_creacion', 'ultimo_uso']
+
+    # Se crean con manage.py crear_token_api, que muestra el token una sola vez
+    def has_add_permission(self, request):
+        return False
+
+# ==========================================
+# INSTRUMENTACIÓN SQL POR VISTA
+# ==========================================
+
+def instrumentacion_sql_view(request):
+    """Histograma en memoria de InstrumentacionSQLMiddleware (solo de este proceso)"""
+    if not request.user.is_superuser:
+        raise PermissionDenied
+    if request.method == 'POST':
+        instrumentacion.reiniciar()
+        return redirect('instrumentacion_sql')
+
+    context = {
+        **admin.site.each_context(request),
+        'title': 'Instrumentación SQL por vista',
+        'filas': instrumentacion.estadisticas(),
+        'limites': [f'≤{limite}' for limite in instrumentacion.LIMITES_MS] + [f'>{instrumentacion.LIMITES_MS[-1]}'],
+    }
+    return TemplateResponse(request, 'admin/instrumentacion_sql.html', context)
+
 # ==========================================
 # REGISTRAR USER ADMIN PERSONALIZADO
 # ==========================================
@@ -346,4 +459,16 @@ def marcar_como_procesado(modeladmin, request, queryset):
     queryset.update(estado='COMPLETADO')
 marcar_como_procesado.short_description = "📋 Marcar como procesado"
 
-ArchivoCargaAdmin.actions = [marcar_como_procesado]
\ No newline at end of file
+def reencolar_cargas(modeladmin, request, queryset):
+    queryset.exclude(estado__in=['PROCESANDO', 'COMPLETADO']).update(
+        estado='PENDIENTE', intentos=0, proximo_intento=None, trabajador='', mensaje_error=''
+    )
+reencolar_cargas.short_description = "🔁 Volver a encolar para procesamiento"
+
+ArchivoCargaAdmin.actions = [marcar_como_procesado, reencolar_cargas]
+
+def reencolar_correos(modeladmin, request, queryset):
+    queryset.filter(estado='ERROR').update(estado='PENDIENTE', intentos=0, proximo_intento=None, ultimo_error='')
+reencolar_correos.short_description = "🔁 Reintentar envío de correos con error"
+
+CorreoSalienteAdmin.actions = [reencolar_correos]
\ No newline at end of file
@@ -0,0 +1,510 @@
+import copy
+import functools
+import json
+import time
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, transaction
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+
+from . import contadores, facetas, metricas
+from .factores import CAMPOS_FACTORES, desempaquetar, validos_empaquetados
+from .importacion import CLAVE_NATURAL
+from .models import CalificacionTributaria, Empresa, FactoresCalificacion, TokenAPI
+
+# ==========================================
+# API POR LOTES (v1)
+# ==========================================
+#
+# Para sistemas externos, autenticados con "Authorization: Bearer <token>"
+# (ver TokenAPI y manage.py crear_token_api):
+#
+#   GET  /api/v1/calificaciones/       NDJSON con las calificaciones del usuario y sus factores
+#   POST /api/v1/calificaciones/lote/  operaciones crear / actualizar / eliminar
+#
+# El cuerpo del POST es NDJSON (una operación por línea, leído en streaming)
+# o JSON (un arreglo, o {"operaciones": [...]}). Cada operación:
+#
+#   {"op": "crear", "ref": "opcional", "empresa": 3, "ejercicio": 2024, "mercado": "ACN",
+#    "instrumento": "...", "fecha_pago": "2024-05-10", "secuencia_evento": 1, "origen": "SISTEMA",
+#    "factores": {"factor_8": "0.1", ...}}
+#   {"op": "actualizar", "id": 10, "origen": "CORREDOR", "factores": {"factor_9": null}}
+#   {"op": "eliminar", "id": 10}
+#
+# Las operaciones se validan en Python y se aplican en lotes de
+# API_TAMANO_LOTE, cada lote en una transacción con operaciones de conjunto
+# (bulk_create, bulk_update, DELETE por ids). Dentro de un lote se aplican
+# primero las eliminaciones, luego las actualizaciones y al final las altas,
+# así un lote puede borrar una clave natural y volver a crearla. Si la base de
+# datos rechaza el lote, se reintenta operación por operación y falla solo
+# la que corresponde.
+# La respuesta trae un resultado por operación, en el formato del cuerpo.
+
+TIPOS_NDJSON = ('application/x-ndjson', 'application/jsonl', 'application/ndjson')
+OPERACIONES = ('crear', 'actualizar', 'eliminar')
+CAMPOS_ESCRITURA = [
+    'empresa', 'ejercicio', 'mercado', 'instrumento', 'fecha_pago', 'descripcion_dividendo',
+    'secuencia_evento', 'acogido_isfut', 'origen', 'tipo_sociedad', 'valor_historico',
+]
+CAMPOS_CONTROL = {'op', 'id', 'ref', 'factores'}
+CAMPOS_LECTURA = ['id', 'empresa_id', *CAMPOS_ESCRITURA[1:], 'fecha_modificacion']
+
+
+class ErrorOperacion(Exception):
+    """Una operación del lote no es válida (se informa en su resultado, no corta la llamada)"""
+
+
+def _serializar(valor):
+    # format(..., 'f') evita notación científica (1E-8) en los decimales
+    if isinstance(valor, Decimal):
+        return format(valor, 'f')
+    if isinstance(valor, (date, datetime)):
+        return valor.isoformat()
+    raise TypeError(f'{type(valor).__name__} no es serializable')
+
+
+def _linea(datos):
+    return json.dumps(datos, default=_serializar, ensure_ascii=False) + '\n'
+
+
+def _error(estado, mensaje):
+    return JsonResponse({'error': mensaje}, status=estado)
+
+
+def _mensajes(error):
+    if hasattr(error, 'message_dict'):
+        return [f'{campo}: {mensaje}' for campo, mensajes in error.message_dict.items() for mensaje in mensajes]
+    return list(error.messages)
+
+
+def token_requerido(vista):
+    """Autentica con TokenAPI y deja al dueño del token en request.user (sin sesión ni CSRF)"""
+    @functools.wraps(vista)
+    def envoltura(request, *args, **kwargs):
+        tipo, _, token = request.headers.get('Authorization', '').partition(' ')
+        if tipo.lower() != 'bearer' or not token.strip():
+            return _error(401, 'Falta el token (cabecera "Authorization: Bearer <token>")')
+        registro = (
+            TokenAPI.objects
+            .select_related('usuario__profile')
+            .filter(clave_hash=TokenAPI.calcular_hash(token.strip()), activo=True, usuario__is_active=True)
+            .first()
+        )
+        if registro is None:
+            return _error(401, 'Token inválido o desactivado')
+        TokenAPI.objects.filter(pk=registro.pk).update(ultimo_uso=timezone.now())
+        request.user = registro.usuario
+        return vista(request, *args, **kwargs)
+    return csrf_exempt(envoltura)
+
+
+# ==========================================
+# LECTURA (NDJSON EN STREAMING)
+# ==========================================
+
+@token_requerido
+@require_GET
+def listar_calificaciones(request):
+    """Calificaciones del usuario con sus factores, una por línea, ordenadas por id (?desde_id= para continuar)"""
+    calificaciones = CalificacionTributaria.objects.filter(usuario=request.user)
+    try:
+        if request.GET.get('ejercicio'):
+            calificaciones = calificaciones.filter(ejercicio=int(request.GET['ejercicio']))
+        if request.GET.get('desde_id'):
+            calificaciones = calificaciones.filter(id__gt=int(request.GET['desde_id']))
+    except ValueError:
+        return _error(400, 'ejercicio y desde_id deben ser números enteros')
+    if request.GET.get('mercado'):
+        calificaciones = calificaciones.filter(mercado=request.GET['mercado'])
+
+    # Los factores se leen de la copia empaquetada: 2 columnas en vez de 30 numeric
+    filas = (
+        calificaciones
+        .order_by('id')
+        .values_list(
+            *CAMPOS_LECTURA, 'factorescalificacion__empaquetado', 'factorescalificacion__nulos',
+        )
+        .iterator(chunk_size=2000)
+    )
+    nombres = ['id', 'empresa', *CAMPOS_LECTURA[2:]]
+
+    def generar():
+        for fila in filas:
+            datos = dict(zip(nombres, fila))
+            empaquetado, nulos = fila[len(nombres):]
+            datos['factores'] = (
+                None if empaquetado is None else dict(zip(CAMPOS_FACTORES, desempaquetar(empaquetado, nulos)))
+            )
+            yield _linea(datos)
+
+    return StreamingHttpResponse(generar(), content_type='application/x-ndjson; charset=utf-8')
+
+
+# ==========================================
+# ESCRITURA POR LOTES
+# ==========================================
+
+def _leer_operaciones(request):
+    """Genera (indice, operación) desde el cuerpo; la operación es un str con el error si la línea no es JSON"""
+    if request.content_type in TIPOS_NDJSON:
+        indice = 0
+        for linea in request:  # Lee el cuerpo línea por línea, sin cargarlo completo
+            if not linea.strip():
+                continue
+            indice += 1
+            try:
+                yield indice, json.loads(linea)
+            except ValueError as e:
+                yield indice, f'JSON inválido: {e}'
+        return
+
+    datos = json.load(request)
+    if isinstance(datos, dict):
+        datos = datos.get('operaciones')
+    if not isinstance(datos, list):
+        raise ValueError('se esperaba un arreglo de operaciones o {"operaciones": [...]}')
+    yield from enumerate(datos, 1)
+
+
+def _clave_natural(calificacion):
+    return tuple(getattr(calificacion, campo) for campo in CLAVE_NATURAL)
+
+
+def _asignar_campos(calificacion, operacion, crear):
+    """Copia y valida los campos de la operación en la instancia. Devuelve los nombres asignados"""
+    desconocidos = set(operacion) - set(CAMPOS_ESCRITURA) - CAMPOS_CONTROL
+    if desconocidos:
+        raise ErrorOperacion(f'campos desconocidos: {", ".join(sorted(desconocidos))}')
+
+    asignados = [nombre for nombre in CAMPOS_ESCRITURA if nombre in operacion]
+    for nombre in asignados:
+        setattr(calificacion, CalificacionTributaria._meta.get_field(nombre).attname, operacion[nombre])
+
+    if 'empresa' in asignados:
+        try:
+            calificacion.empresa_id = int(operacion['empresa'])
+        except (TypeError, ValueError):
+            raise ErrorOperacion('empresa debe ser el id de una empresa')
+    elif crear:
+        raise ErrorOperacion('empresa es obligatorio')
+
+    # Al crear se validan todos los campos (obligatorios incluidos); al actualizar, solo los enviados.
+    # clean_fields deja en la instancia los valores convertidos (fechas, decimales, booleanos)
+    validar = set(CAMPOS_ESCRITURA) if crear else set(asignados)
+    excluir = [f.name for f in CalificacionTributaria._meta.fields if f.name not in validar or f.name == 'empresa']
+    try:
+        calificacion.clean_fields(exclude=excluir)
+    except ValidationError as e:
+        raise ErrorOperacion('; '.join(_mensajes(e)))
+    return asignados
+
+
+def _asignar_factores(factores, valores):
+    if not isinstance(valores, dict):
+        raise ErrorOperacion('factores debe ser un objeto {"factor_8": ..., "factor_37": ...}')
+    desconocidos = set(valores) - set(CAMPOS_FACTORES)
+    if desconocidos:
+        raise ErrorOperacion(f'factores desconocidos: {", ".join(sorted(desconocidos))}')
+
+    for nombre, valor in valores.items():
+        setattr(factores, nombre, None if valor in (None, '') else str(valor))
+    excluir = [f.name for f in FactoresCalificacion._meta.fields if f.name not in valores]
+    try:
+        factores.clean_fields(exclude=excluir)
+    except ValidationError as e:
+        raise ErrorOperacion('; '.join(_mensajes(e)))
+    for nombre in valores:
+        valor = getattr(factores, nombre)
+        if valor is not None and not (0 <= valor <= 1):
+            raise ErrorOperacion(f'{nombre} debe estar entre 0 y 1')
+
+
+class Lote:
+    """Operaciones ya validadas de un lote, agrupadas por tipo"""
+
+    def __init__(self):
+        self.resultados = {}     # indice -> resultado
+        self.eliminar = []       # (indice, operacion, calificacion)
+        self.actualizar = []     # (indice, operacion, calificacion, original, campos, factores, factores_nuevos)
+        self.crear = []          # (indice, operacion, calificacion, factores)
+
+    def resultado(self, indice, operacion, estado, **extra):
+        datos = {'indice': indice, 'op': operacion.get('op') if isinstance(operacion, dict) else None}
+        if isinstance(operacion, dict) and 'ref' in operacion:
+            datos['ref'] = operacion['ref']
+        datos.update(estado=estado, **extra)
+        self.resultados[indice] = datos
+
+    def error(self, indice, operacion, mensaje):
+        self.resultado(indice, operacion, 'error', errores=[mensaje] if isinstance(mensaje, str) else mensaje)
+
+    def separar(self):
+        """Un Lote por operación, en el orden de _escribir, que escriben en los mismos resultados"""
+        for grupo in ('eliminar', 'actualizar', 'crear'):
+            for entrada in getattr(self, grupo):
+                if grupo == 'crear':
+                    # bulk_create ya les había asignado id en la transacción revertida
+                    entrada[2].pk = None
+                    entrada[2]._state.adding = True
+                    entrada[3].pk = None
+                    entrada[3]._state.adding = True
+                elif grupo == 'actualizar' and entrada[6] and entrada[5] is not None:
+                    entrada[5].pk = None
+                    entrada[5]._state.adding = True
+                individual = Lote()
+                individual.resultados = self.resultados
+                getattr(individual, grupo).append(entrada)
+                yield individual
+
+
+def _preparar(usuario, operaciones):
+    """Valida las operaciones de un lote sin escribir nada. Devuelve el Lote"""
+    lote = Lote()
+    ids = set()
+    empresas = set()
+    for indice, operacion in operaciones:
+        if isinstance(operacion, dict):
+            if operacion.get('op') in ('actualizar', 'eliminar') and isinstance(operacion.get('id'), int):
+                ids.add(operacion['id'])
+            if isinstance(operacion.get('empresa'), int):
+                empresas.add(operacion['empresa'])
+
+    # Dos consultas por lote: las calificaciones afectadas y las empresas del usuario
+    existentes = {
+        c.id: c for c in CalificacionTributaria.objects.filter(usuario=usuario, id__in=ids).select_related('factorescalificacion')
+    }
+    empresas_usuario = set(Empresa.objects.filter(usuario=usuario, id__in=empresas).values_list('id', flat=True))
+    vistos = set()
+
+    for indice, operacion in operaciones:
+        try:
+            if not isinstance(operacion, dict):
+                raise ErrorOperacion(operacion if isinstance(operacion, str) else 'cada operación debe ser un objeto JSON')
+            tipo = operacion.get('op')
+            if tipo not in OPERACIONES:
+                raise ErrorOperacion(f'op debe ser {", ".join(OPERACIONES)}')
+
+            if tipo == 'crear':
+                calificacion = CalificacionTributaria(usuario=usuario)
+                _asignar_campos(calificacion, operacion, crear=True)
+                if calificacion.empresa_id not in empresas_usuario:
+                    raise ErrorOperacion(f'la empresa {calificacion.empresa_id} no existe o no es del usuario')
+                factores = FactoresCalificacion()
+                _asignar_factores(factores, operacion.get('factores') or {})
+                lote.crear.append((indice, operacion, calificacion, factores))
+                continue
+
+            calificacion = existentes.get(operacion.get('id'))
+            if calificacion is None:
+                raise ErrorOperacion(f'la calificación {operacion.get("id")} no existe o no es del usuario')
+            if calificacion.id in vistos:
+                raise ErrorOperacion(f'la calificación {calificacion.id} aparece más de una vez en el lote')
+            vistos.add(calificacion.id)
+
+            if tipo == 'eliminar':
+                lote.eliminar.append((indice, operacion, calificacion))
+                continue
+
+            original = copy.copy(calificacion)
+            campos = _asignar_campos(calificacion, operacion, crear=False)
+            if 'empresa' in campos and calificacion.empresa_id not in empresas_usuario:
+                raise ErrorOperacion(f'la empresa {calificacion.empresa_id} no existe o no es del usuario')
+            factores = getattr(calificacion, 'factorescalificacion', None)
+            factores_nuevos = factores is None
+            if 'factores' in operacion:
+                factores = factores or FactoresCalificacion(calificacion=calificacion)
+                _asignar_factores(factores, operacion['factores'])
+            elif factores_nuevos:
+                factores = None
+            lote.actualizar.append((indice, operacion, calificacion, original, campos, factores, factores_nuevos))
+        except ErrorOperacion as e:
+            lote.error(indice, operacion, str(e))
+
+    # Regla de la suma 8-16 para todo el lote en una pasada vectorial (la base de datos la vuelve a exigir)
+    con_factores = [
+        (entrada, entrada[3]) for entrada in lote.crear
+    ] + [
+        (entrada, entrada[5]) for entrada in lote.actualizar if entrada[5] is not None and 'factores' in entrada[1]
+    ]
+    if con_factores:
+        validos = validos_empaquetados([factores.empaquetar()[0] for _, factores in con_factores])
+        invalidas = {id(entrada) for (entrada, _), valido in zip(con_factores, validos) if not valido}
+        for grupo in (lote.crear, lote.actualizar):
+            for entrada in [e for e in grupo if id(e) in invalidas]:
+                grupo.remove(entrada)
+                lote.error(entrada[0], entrada[1], 'la suma de los factores del 8 al 16 no puede ser mayor que 1')
+
+    # Clave natural de altas y actualizaciones contra la tabla y el resto del lote
+    _validar_claves(lote)
+    return lote
+
+
+def _validar_claves(lote):
+    """Saca del lote las altas y actualizaciones que chocarían con la clave natural de otra fila (una consulta)
+
+    Se sigue el orden de _escribir: las eliminaciones liberan su clave para todo
+    el lote y las actualizaciones que cambian de clave liberan la anterior para
+    las altas. Dos actualizaciones no pueden intercambiar claves en el mismo lote.
+    """
+    movidas = [e for e in lote.actualizar if _clave_natural(e[2]) != _clave_natural(e[3])]
+    nuevas = [_clave_natural(e[2]) for e in movidas + lote.crear]
+    if not nuevas:
+        return
+    eliminadas = {calificacion.id for _, _, calificacion in lote.eliminar}
+    filas = (
+        CalificacionTributaria.objects
+        .filter(empresa_id__in={c[0] for c in nuevas}, instrumento__in={c[3] for c in nuevas})
+        .values_list('id', *CLAVE_NATURAL)
+    )
+    ocupadas = {tuple(clave): pk for pk, *clave in filas if pk not in eliminadas}  # clave -> id que la tiene
+
+    for entrada in movidas:
+        clave = _clave_natural(entrada[2])
+        if clave in ocupadas:
+            lote.actualizar.remove(entrada)
+            lote.error(entrada[0], entrada[1], 'ya existe una calificación con esta empresa, ejercicio, '
+                                               'mercado, instrumento y secuencia')
+        else:
+            ocupadas[clave] = entrada[2].id
+    for entrada in movidas:
+        anterior = _clave_natural(entrada[3])
+        if entrada in lote.actualizar and ocupadas.get(anterior) == entrada[2].id:
+            del ocupadas[anterior]
+
+    for entrada in list(lote.crear):
+        clave = _clave_natural(entrada[2])
+        if clave in ocupadas:
+            lote.crear.remove(entrada)
+            lote.error(entrada[0], entrada[1], 'ya existe una calificación con esta empresa, ejercicio, '
+                                               'mercado, instrumento y secuencia (use "actualizar")')
+        else:
+            ocupadas[clave] = None
+
+
+def _escribir(usuario, lote):
+    """Aplica un lote validado en una transacción con operaciones de conjunto"""
+    with transaction.atomic():
+        if lote.eliminar:
+            eliminadas = [calificacion for _, _, calificacion in lote.eliminar]
+            ids = [calificacion.id for calificacion in eliminadas]
+            # DELETE directo: sin cargar ni recorrer objetos relacionados en Python
+            FactoresCalificacion.objects.filter(calificacion_id__in=ids)._raw_delete(FactoresCalificacion.objects.db)
+            CalificacionTributaria.objects.filter(id__in=ids)._raw_delete(CalificacionTributaria.objects.db)
+            contadores.sumar_calificaciones(usuario.id, -len(ids))
+            facetas.sumar_calificaciones(eliminadas, signo=-1)
+
+        if lote.actualizar:
+            ahora = timezone.now()
+            calificaciones = [entrada[2] for entrada in lote.actualizar]
+            for calificacion in calificaciones:
+                calificacion.fecha_modificacion = ahora  # bulk_update no aplica auto_now
+            campos = {campo for entrada in lote.actualizar for campo in entrada[4]} | {'fecha_modificacion'}
+            CalificacionTributaria.objects.bulk_update(calificaciones, sorted(campos), batch_size=500)
+
+            factores = [(e[5], e[6]) for e in lote.actualizar if e[5] is not None and 'factores' in e[1]]
+            existentes = [f for f, nuevos in factores if not nuevos]
+            if existentes:
+                campos_factores = {c for e in lote.actualizar if 'factores' in e[1] and not e[6] for c in e[1]['factores']}
+                FactoresCalificacion.objects.bulk_update(existentes, sorted(campos_factores), batch_size=500)
+            FactoresCalificacion.objects.bulk_create([f for f, nuevos in factores if nuevos])
+            facetas.sumar_calificaciones([entrada[3] for entrada in lote.actualizar], signo=-1)
+            facetas.sumar_calificaciones(calificaciones)
+
+        if lote.crear:
+            creadas = CalificacionTributaria.objects.bulk_create([entrada[2] for entrada in lote.crear])
+            for calificacion, entrada in zip(creadas, lote.crear):
+                entrada[3].calificacion = calificacion
+            FactoresCalificacion.objects.bulk_create([entrada[3] for entrada in lote.crear])
+            # bulk_create no dispara post_save: los contadores y las facetas se ajustan por lote
+            contadores.sumar_calificaciones(usuario.id, len(creadas))
+            facetas.sumar_calificaciones(creadas)
+
+    for operacion, cantidad in (('eliminada', len(lote.eliminar)), ('modificada', len(lote.actualizar)), ('creada', len(lote.crear))):
+        if cantidad:
+            metricas.CALIFICACIONES_ESCRITAS.inc(cantidad, operacion=operacion, via='api')
+    for indice, operacion, calificacion in lote.eliminar:
+        lote.resultado(indice, operacion, 'ok', id=calificacion.id)
+    for indice, operacion, calificacion, *_ in lote.actualizar:
+        lote.resultado(indice, operacion, 'ok', id=calificacion.id)
+    for indice, operacion, calificacion, _ in lote.crear:
+        lote.resultado(indice, operacion, 'ok', id=calificacion.id)
+
+
+def aplicar_lote(usuario, operaciones):
+    """Valida y aplica una lista de (indice, operación). Devuelve los resultados en orden"""
+    lote = _preparar(usuario, operaciones)
+    try:
+        _escribir(usuario, lote)
+    except DatabaseError:
+        # Algo que la validación no vio (p. ej. otro cliente escribió la misma clave): el lote se
+        # revirtió y se reintenta operación por operación, cada una en su transacción (o savepoint),
+        # para que falle solo la culpable
+        for individual in lote.separar():
+            try:
+                _escribir(usuario, individual)
+            except DatabaseError as e:
+                for indice, operacion, *_ in individual.eliminar + individual.actualizar + individual.crear:
+                    lote.error(indice, operacion, f'error de base de datos: {e}')
+    return [lote.resultados[indice] for indice, _ in operaciones]
+
+
+def _en_lotes(operaciones, tamano):
+    lote = []
+    for elemento in operaciones:
+        lote.append(elemento)
+        if len(lote) >= tamano:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+@token_requerido
+@require_POST
+def lote_calificaciones(request):
+    """Aplica un lote de operaciones crear/actualizar/eliminar (ver el encabezado del módulo)"""
+    perfil = getattr(request.user, 'profile', None)
+    if perfil is not None and perfil.es_solo_lectura():
+        return _error(403, 'El usuario del token es de solo lectura')
+
+    ndjson = request.content_type in TIPOS_NDJSON
+    maximo = settings.API_MAX_OPERACIONES
+    inicio = time.perf_counter()
+    resultados = []
+    try:
+        for lote in _en_lotes(_leer_operaciones(request), settings.API_TAMANO_LOTE):
+            aceptadas = [(i, op) for i, op in lote if i <= maximo]
+            resultados.extend(aplicar_lote(request.user, aceptadas) if aceptadas else [])
+            resultados.extend(
+                {'indice': i, 'estado': 'error', 'errores': [f'se superó el máximo de {maximo} operaciones por llamada']}
+                for i, _ in lote if i > maximo
+            )
+    except ValueError as e:
+        # Cuerpo ilegible. Los lotes anteriores al error ya quedaron confirmados
+        aplicadas = [r for r in resultados if r['estado'] == 'ok']
+        return JsonResponse({
+            'error': f'Cuerpo inválido: {e} (se aplicaron {len(aplicadas)} operaciones antes del error)',
+            'aplicadas': len(aplicadas),
+            'resultados': resultados,
+        }, status=400)
+
+    resumen = {
+        'operaciones': len(resultados),
+        'ok': sum(1 for r in resultados if r['estado'] == 'ok'),
+        'errores': sum(1 for r in resultados if r['estado'] == 'error'),
+        'duracion_ms': round((time.perf_counter() - inicio) * 1000, 1),
+    }
+    for resultado in resultados:
+        metricas.OPERACIONES_API.inc(op=resultado.get('op') or 'invalida', resultado=resultado['estado'])
+    metricas.DURACION_LOTE_API.observar(time.perf_counter() - inicio)
+
+    if ndjson:
+        cuerpo = ''.join(_linea(r) for r in resultados) + _linea({'resumen': resumen})
+        return HttpResponse(cuerpo, content_type='application/x-ndjson; charset=utf-8')
+    return JsonResponse({'resumen': resumen, 'resultados': resultados})
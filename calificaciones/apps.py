@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class CalificacionesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'calificaciones'
+
+    def ready(self):
+        # Registra las señales que mantienen los contadores de los paneles,
+        # las facetas de los filtros y las métricas de escritura de calificaciones
+        from . import contadores, facetas, metricas  # noqa: F401
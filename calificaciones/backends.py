@@ -0,0 +1,51 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.db.models import Case, Q, Value, When
+
+# ==========================================
+# AUTENTICACIÓN POR USUARIO O EMAIL
+# ==========================================
+#
+# Resuelve el usuario con una sola consulta (username exacto o email sin
+# distinguir mayúsculas, cubierto por el índice único de la migración 0014)
+# y ejecuta el hasher de contraseñas exactamente una vez por intento,
+# exista o no el usuario.
+
+
+class EmailOUsuarioBackend(ModelBackend):
+    """ModelBackend que acepta en `username` tanto el nombre de usuario como el email"""
+
+    def consulta_usuario(self, identificador):
+        UserModel = get_user_model()
+        condicion = Q(**{UserModel.USERNAME_FIELD: identificador})
+        if '@' in identificador:
+            # El índice es parcial (sin los emails vacíos): la condición debe repetirse
+            # en la consulta para que PostgreSQL pueda usarlo
+            condicion |= Q(email__iexact=identificador) & ~Q(email='')
+        # Si un username coincide con el email de otra cuenta, gana el username
+        return (
+            UserModel._default_manager
+            .filter(condicion)
+            .order_by(Case(When(Q(**{UserModel.USERNAME_FIELD: identificador}), then=Value(0)), default=Value(1)))
+        )
+
+    def buscar_usuario(self, identificador):
+        return self.consulta_usuario(identificador).first()
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        UserModel = get_user_model()
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if not username or password is None:
+            return None
+
+        usuario = self.buscar_usuario(username)
+        if usuario is None:
+            # Hash de una contraseña cualquiera para que un usuario inexistente
+            # tarde lo mismo que una contraseña incorrecta (igual que ModelBackend)
+            UserModel().set_password(password)
+            return None
+
+        if usuario.check_password(password) and self.user_can_authenticate(usuario):
+            return usuario
+        return None
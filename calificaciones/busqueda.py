@@ -0,0 +1,126 @@
+from django.db import connections
+from django.db.models import BooleanField, Case, Expression, FloatField, Func, Q, TextField, Value, When
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast
+
+# ==========================================
+# BÚSQUEDA DE TEXTO COMPLETO
+# ==========================================
+#
+# En PostgreSQL cada calificación tiene una columna tsvector "busqueda"
+# (migración 0017, fuera del modelo porque solo existe en ese motor) con la
+# configuración 'spanish' y estos pesos:
+#   A: instrumento y RUT de la empresa
+#   B: nombre de la empresa
+#   C: mercado y descripción del dividendo
+# La mantienen dos triggers (al escribir la calificación y al cambiar el
+# nombre o RUT de la empresa) y la consulta un índice GIN. Los resultados se
+# ordenan con ts_rank y se paginan por cursor (paginacion.paginar_por_relevancia).
+#
+# En otros motores (desarrollo con SQLite) se usa icontains por palabra sobre
+# los mismos campos y una relevancia con los mismos pesos que ts_rank.
+
+CONFIGURACION = 'spanish'
+COLUMNA = 'busqueda'
+MAX_PALABRAS = 8
+
+# Los términos muy frecuentes se ordenan solo entre las coincidencias más
+# recientes, para que el costo de ts_rank no crezca con el tamaño de la tabla.
+# Solo para los listados: exportar y las operaciones masivas usan limite=None
+# y los listados avisan cuando quedan recortados (ver supera_limite)
+LIMITE_CANDIDATOS = 10000
+
+# Pesos por defecto de ts_rank para A, B y C
+PESOS = {
+    'instrumento': 1.0,
+    'empresa__rut': 1.0,
+    'empresa__nombre': 0.4,
+    'mercado': 0.2,
+    'descripcion_dividendo': 0.2,
+}
+
+
+class DocumentoBusqueda(Expression):
+    """Columna tsvector "busqueda" de la tabla base de la consulta (se renombra con ella en subconsultas)"""
+    output_field = TextField()
+
+    def __init__(self):
+        super().__init__()
+        self.alias = None
+
+    def resolve_expression(self, query=None, allow_joins=True, reuse=None, summarize=False, for_save=False):
+        copia = super().resolve_expression(query, allow_joins, reuse, summarize, for_save)
+        copia.alias = query.get_initial_alias()
+        return copia
+
+    def relabeled_clone(self, change_map):
+        copia = self.copy()
+        copia.alias = change_map.get(self.alias, self.alias)
+        return copia
+
+    def as_sql(self, compiler, connection):
+        return f'{compiler.quote_name_unless_alias(self.alias)}.{connection.ops.quote_name(COLUMNA)}', []
+
+
+def _consulta(texto):
+    # websearch_to_tsquery acepta la sintaxis de los buscadores ("frase", -excluir, or)
+    return Func(RawSQL('%s::regconfig', [CONFIGURACION]), Value(texto), function='websearch_to_tsquery')
+
+
+def _buscar_postgresql(queryset, texto, limite):
+    coincide = Func(
+        DocumentoBusqueda(), _consulta(texto), arg_joiner=' @@ ', template='(%(expressions)s)',
+        output_field=BooleanField(),
+    )
+    if limite is None:
+        return queryset.filter(coincide)
+    candidatos = queryset.filter(coincide).order_by('-id').values('id')[:limite]
+    relevancia = Cast(
+        Func(DocumentoBusqueda(), _consulta(texto), function='ts_rank', output_field=FloatField()),
+        FloatField(),
+    )
+    return queryset.filter(id__in=candidatos).annotate(relevancia=relevancia)
+
+
+def _buscar_icontains(queryset, texto):
+    palabras = texto.split()[:MAX_PALABRAS]
+    for palabra in palabras:
+        queryset = queryset.filter(
+            Q(*[Q(**{f'{campo}__icontains': palabra}) for campo in PESOS], _connector=Q.OR)
+        )
+    relevancia = sum(
+        Case(When(Q(**{f'{campo}__icontains': palabra}), then=Value(peso)), default=Value(0.0))
+        for palabra in palabras
+        for campo, peso in PESOS.items()
+    )
+    return queryset.annotate(relevancia=Cast(relevancia, FloatField()))
+
+
+def buscar(queryset, texto, limite=LIMITE_CANDIDATOS):
+    """
+    Filtra un queryset de CalificacionTributaria por `texto` y lo anota con
+    `relevancia` (float, mayor es mejor). Sin texto devuelve el queryset igual.
+    Con limite=None se filtran todas las coincidencias, sin relevancia
+    (operaciones masivas, que deben alcanzar todo lo que coincide).
+    """
+    texto = (texto or '').strip()
+    if not texto:
+        return queryset
+    if connections[queryset.db].vendor == 'postgresql':
+        return _buscar_postgresql(queryset, texto, limite)
+    return _buscar_icontains(queryset, texto)
+
+
+def es_busqueda(queryset):
+    """El queryset viene de buscar() y debe paginarse por relevancia"""
+    return 'relevancia' in queryset.query.annotations
+
+
+def supera_limite(coincidencias):
+    """
+    La búsqueda sin límite (buscar con limite=None) tiene más coincidencias de
+    las que buscar() ordena por relevancia, así que el listado está recortado
+    """
+    if connections[coincidencias.db].vendor != 'postgresql':
+        return False  # icontains no recorta
+    return coincidencias.order_by().values('id')[LIMITE_CANDIDATOS:LIMITE_CANDIDATOS + 1].exists()
@@ -0,0 +1,264 @@
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import metricas, subidas
+from .importacion import procesar_archivo
+from .models import ArchivoCarga
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# COLA DE PROCESAMIENTO DE ARCHIVOS DE CARGA
+# ==========================================
+#
+# La cola es la propia tabla ArchivoCarga:
+#   PENDIENTE   -> esperando un trabajador (o un reintento en proximo_intento)
+#   PROCESANDO  -> reclamado por `trabajador`, que actualiza `latido` cada
+#                  CARGA_MASIVA_LATIDO_SEGUNDOS (ver latiendo) y en cada lote
+#   COMPLETADO / ERROR -> estados finales
+#   CANCELADO   -> detenido por el usuario; al reanudarlo vuelve a PENDIENTE
+#
+# Los trabajadores reclaman filas con SELECT ... FOR UPDATE SKIP LOCKED, por lo
+# que varios procesos (o servidores) pueden consumir la cola sin pisarse.
+# Cada lote confirmado deja en el registro la línea y el byte donde termina,
+# así un reintento (o una reanudación) continúa desde ahí. Las escrituras del
+# trabajador exigen que el archivo siga reclamado a su nombre: si se dio por
+# huérfano y lo tomó otro, el trabajador anterior se detiene sin confirmar nada.
+
+
+def identificador_trabajador():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def espera_reintento(intentos):
+    """Backoff exponencial: base, 2*base, 4*base... con un máximo de una hora"""
+    base = settings.CARGA_MASIVA_REINTENTO_SEGUNDOS
+    return timedelta(seconds=min(base * 2 ** max(intentos - 1, 0), 3600))
+
+
+def ruta_local(archivo):
+    """Ruta en disco del archivo, o None si el almacenamiento no es local"""
+    try:
+        return archivo.path
+    except NotImplementedError:
+        return None
+
+
+def encolar(empresa, archivo, tipo_carga):
+    """Registra un archivo subido para que lo procese un trabajador"""
+    return ArchivoCarga.objects.create(
+        empresa=empresa,
+        nombre_archivo=archivo.name,
+        archivo=archivo,
+        tipo_carga=tipo_carga,
+        estado='PENDIENTE',
+        tamano=archivo.size,
+    )
+
+
+def cancelar(archivo_carga):
+    """
+    Detiene un archivo pendiente o en proceso. El trabajador lo nota al
+    confirmar su siguiente lote, que se descarta; lo ya confirmado se conserva.
+    """
+    return ArchivoCarga.objects.filter(pk=archivo_carga.pk, estado__in=['PENDIENTE', 'PROCESANDO']).update(
+        estado='CANCELADO',
+        trabajador='',
+    )
+
+
+def reanudar(archivo_carga):
+    """Devuelve a la cola un archivo cancelado; continúa desde el último lote confirmado"""
+    return ArchivoCarga.objects.filter(pk=archivo_carga.pk, estado='CANCELADO').update(
+        estado='PENDIENTE',
+        intentos=0,
+        proximo_intento=timezone.now(),
+        mensaje_error='',
+    )
+
+
+def recuperar_huerfanos(trabajador=''):
+    """
+    Devuelve a la cola los archivos que quedaron en PROCESANDO porque su
+    trabajador murió (sin latido durante CARGA_MASIVA_TIMEOUT_SEGUNDOS).
+    Nunca los de `trabajador`, el que está recuperando.
+    """
+    limite = timezone.now() - timedelta(seconds=settings.CARGA_MASIVA_TIMEOUT_SEGUNDOS)
+    huerfanos = ArchivoCarga.objects.filter(estado='PROCESANDO', latido__lt=limite).exclude(trabajador=trabajador)
+
+    agotados = huerfanos.filter(intentos__gte=settings.CARGA_MASIVA_MAX_INTENTOS).update(
+        estado='ERROR',
+        trabajador='',
+        mensaje_error='El proceso se interrumpió y se agotaron los reintentos',
+    )
+    recuperados = huerfanos.filter(intentos__lt=settings.CARGA_MASIVA_MAX_INTENTOS).update(
+        estado='PENDIENTE',
+        trabajador='',
+        proximo_intento=timezone.now(),
+    )
+    if agotados or recuperados:
+        logger.warning('Cargas huérfanas: %s reencoladas, %s marcadas con error', recuperados, agotados)
+    return recuperados + agotados
+
+
+def reclamar_siguiente(trabajador):
+    """Toma el siguiente archivo pendiente y lo marca como PROCESANDO para `trabajador`"""
+    ahora = timezone.now()
+    with transaction.atomic():
+        archivo_carga = (
+            ArchivoCarga.objects
+            .select_for_update(skip_locked=True)
+            .filter(estado='PENDIENTE')
+            .filter(Q(proximo_intento__isnull=True) | Q(proximo_intento__lte=ahora))
+            .order_by('fecha_carga', 'id')
+            .first()
+        )
+        if archivo_carga is None:
+            return None
+
+        ArchivoCarga.objects.filter(pk=archivo_carga.pk).update(
+            estado='PROCESANDO',
+            trabajador=trabajador,
+            latido=ahora,
+            intentos=F('intentos') + 1,
+        )
+    archivo_carga.refresh_from_db()
+    return archivo_carga
+
+
+def registrar_fallo(archivo_carga, error):
+    """Programa un reintento con backoff o marca el archivo como ERROR si ya no quedan intentos"""
+    # Si el archivo ya pasó a otro trabajador (o se canceló) el fallo no le corresponde
+    propio = ArchivoCarga.objects.filter(
+        pk=archivo_carga.pk, estado='PROCESANDO', trabajador=archivo_carga.trabajador,
+    )
+    if archivo_carga.intentos < settings.CARGA_MASIVA_MAX_INTENTOS:
+        propio.update(
+            estado='PENDIENTE',
+            trabajador='',
+            proximo_intento=timezone.now() + espera_reintento(archivo_carga.intentos),
+            mensaje_error=str(error),
+        )
+    else:
+        propio.update(
+            estado='ERROR',
+            trabajador='',
+            mensaje_error=str(error),
+        )
+
+
+@contextmanager
+def latiendo(archivo_carga, intervalo=None):
+    """
+    Actualiza `latido` desde un hilo aparte (con su propia conexión) mientras
+    dura el bloque, también en las fases sin lotes confirmados: parsear,
+    saltar hasta el checkpoint o un COPY grande. Se detiene si el archivo deja
+    de pertenecer al trabajador.
+    """
+    intervalo = intervalo or settings.CARGA_MASIVA_LATIDO_SEGUNDOS
+    detener = threading.Event()
+
+    def latir():
+        propio = ArchivoCarga.objects.filter(
+            pk=archivo_carga.pk, estado='PROCESANDO', trabajador=archivo_carga.trabajador,
+        )
+        try:
+            while not detener.wait(intervalo):
+                try:
+                    if not propio.update(latido=timezone.now()):
+                        return
+                except DatabaseError:
+                    # Por ejemplo, la fila bloqueada por el lote en curso: se reintenta en el siguiente latido
+                    logger.warning('No se pudo registrar el latido de la carga %s', archivo_carga.pk, exc_info=True)
+        finally:
+            connection.close()  # La conexión de este hilo
+
+    hilo = threading.Thread(target=latir, name=f'latido-carga-{archivo_carga.pk}', daemon=True)
+    hilo.start()
+    try:
+        yield
+    finally:
+        detener.set()
+        hilo.join()
+
+
+def ejecutar(archivo_carga):
+    """Procesa un archivo ya reclamado"""
+    inicio = time.perf_counter()
+    try:
+        if not archivo_carga.archivo:
+            raise FileNotFoundError('El registro no tiene un archivo asociado')
+        with latiendo(archivo_carga), archivo_carga.archivo.open('rb') as archivo:
+            resultado = procesar_archivo(
+                archivo_carga, archivo, archivo_carga.empresa.usuario,
+                ruta=ruta_local(archivo_carga.archivo), procesos=settings.CARGA_MASIVA_PROCESOS_LECTURA,
+            )
+    except Exception as e:
+        logger.exception('Error procesando la carga %s', archivo_carga.pk)
+        registrar_fallo(archivo_carga, e)
+        metricas.DURACION_PROCESAMIENTO.observar(time.perf_counter() - inicio, resultado='fallo')
+        return None
+
+    if resultado.cancelada:
+        logger.info(
+            'Carga %s detenida (cancelada o tomada por otro trabajador) con %s registros procesados',
+            archivo_carga.pk, resultado.procesados,
+        )
+        return resultado
+
+    metricas.DURACION_PROCESAMIENTO.observar(time.perf_counter() - inicio, resultado='procesado')
+
+    logger.info(
+        'Carga %s terminada: %s procesados, %s con error',
+        archivo_carga.pk, resultado.procesados, resultado.errores,
+    )
+    return resultado
+
+
+# Espera máxima entre reintentos del trabajador cuando la base de datos no responde
+ESPERA_MAXIMA_BASE_DATOS = 60
+
+
+def ciclo_trabajador(una_vez=False, intervalo=5):
+    """
+    Bucle de un trabajador: recupera huérfanos, reclama y procesa archivos.
+    Con una_vez=True termina cuando la cola queda vacía. Un error de base de
+    datos (por ejemplo, un reinicio del servidor) no lo detiene: reconecta y
+    reintenta con backoff.
+    """
+    trabajador = identificador_trabajador()
+    procesados = 0
+    fallos = 0
+    while True:
+        try:
+            recuperar_huerfanos(trabajador)
+            subidas.limpiar_vencidas()
+            archivo_carga = reclamar_siguiente(trabajador)
+        except DatabaseError:
+            # Base de datos caída o reiniciada: se descarta la conexión rota y se reintenta con backoff
+            fallos += 1
+            espera = min(intervalo * 2 ** (fallos - 1), ESPERA_MAXIMA_BASE_DATOS)
+            logger.exception('Error de base de datos en el trabajador %s; reintento en %ss', trabajador, espera)
+            close_old_connections()
+            time.sleep(espera)
+            continue
+        fallos = 0
+
+        if archivo_carga is None:
+            if una_vez:
+                return procesados
+            time.sleep(intervalo)
+            continue
+
+        ejecutar(archivo_carga)
+        procesados += 1
@@ -0,0 +1,257 @@
+from functools import partial
+
+from django.apps import apps as registro_global
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import ArchivoCarga, CalificacionTributaria, Contador, Empresa, Profile
+
+# ==========================================
+# CONTADORES MATERIALIZADOS
+# ==========================================
+#
+# Los paneles leen totales desde la tabla Contador en vez de hacer COUNT(*)
+# sobre las tablas grandes en cada visita. Los contadores se mantienen con
+# señales (altas y bajas individuales) y con llamadas explícitas desde las
+# operaciones masivas que no disparan señales (bulk_create, SQL directo).
+# Si alguna vez quedan desfasados: python manage.py recalcular_contadores
+#
+# Las sumas de empresas y calificaciones se aplican al confirmar la transacción
+# (on_commit): la fila global es la misma para todos los workers y la web, y
+# actualizarla dentro de cada lote la dejaría bloqueada hasta el COMMIT,
+# serializando las cargas concurrentes. Si el proceso muere entre el COMMIT y
+# el ajuste, recalcular_contadores lo corrige.
+
+EMPRESAS = 'empresas'
+CALIFICACIONES = 'calificaciones'
+ARCHIVOS = 'archivos'
+USUARIOS = 'usuarios'
+PERFILES_MFA = 'perfiles_mfa'
+
+PREFIJO_EMPRESAS_USUARIO = 'empresas:usuario:'
+# Campos de las facetas de los filtros que se cuentan por valor (ver facetas.py)
+DIMENSIONES_FACETAS = ('ejercicio', 'mercado')
+
+
+def clave_rol(rol):
+    return f'usuarios:rol:{rol}'
+
+
+def clave_empresas_usuario(usuario_id):
+    return f'{PREFIJO_EMPRESAS_USUARIO}{usuario_id}'
+
+
+def clave_calificaciones_usuario(usuario_id):
+    return f'calificaciones:usuario:{usuario_id}'
+
+
+def clave_faceta(campo, valor):
+    return f'facetas:{campo}:{valor}'
+
+
+def incrementar(clave, delta=1):
+    """Suma `delta` al contador con un UPDATE atómico (lo crea si no existe)"""
+    if not delta:
+        return
+    if not Contador.objects.filter(clave=clave).update(valor=F('valor') + delta):
+        Contador.objects.get_or_create(clave=clave)
+        Contador.objects.filter(clave=clave).update(valor=F('valor') + delta)
+
+
+def valores(*claves):
+    """Lee varios contadores en una sola consulta; los inexistentes valen 0"""
+    encontrados = dict(Contador.objects.filter(clave__in=claves).values_list('clave', 'valor'))
+    return {clave: encontrados.get(clave, 0) for clave in claves}
+
+
+def usuarios_con_empresas():
+    """Usuarios con al menos una empresa (recorre solo la tabla de contadores)"""
+    return Contador.objects.filter(clave__startswith=PREFIJO_EMPRESAS_USUARIO, valor__gt=0).count()
+
+
+# ==========================================
+# GANCHOS PARA OPERACIONES MASIVAS
+# ==========================================
+
+def _al_confirmar(clave, delta):
+    # Cada ajuste corre en su propia transacción corta, después del COMMIT del lote
+    if delta:
+        transaction.on_commit(partial(incrementar, clave, delta))
+
+
+def sumar_calificaciones(usuario_id, cantidad):
+    """Llamar después de insertar o borrar calificaciones sin pasar por save()/delete()"""
+    _al_confirmar(CALIFICACIONES, cantidad)
+    if usuario_id:
+        _al_confirmar(clave_calificaciones_usuario(usuario_id), cantidad)
+
+
+def sumar_empresas(usuario_id, cantidad):
+    _al_confirmar(EMPRESAS, cantidad)
+    if usuario_id:
+        _al_confirmar(clave_empresas_usuario(usuario_id), cantidad)
+
+
+# ==========================================
+# RECONCILIACIÓN
+# ==========================================
+
+def calcular(apps=registro_global):
+    """Calcula todos los contadores desde cero. Acepta el registro de modelos históricos de una migración"""
+    modelo_usuario = apps.get_model('auth', 'User')
+    modelo_empresa = apps.get_model('calificaciones', 'Empresa')
+    modelo_calificacion = apps.get_model('calificaciones', 'CalificacionTributaria')
+    modelo_perfil = apps.get_model('calificaciones', 'Profile')
+
+    totales = {
+        USUARIOS: modelo_usuario.objects.count(),
+        EMPRESAS: modelo_empresa.objects.count(),
+        CALIFICACIONES: modelo_calificacion.objects.count(),
+        ARCHIVOS: apps.get_model('calificaciones', 'ArchivoCarga').objects.count(),
+        PERFILES_MFA: modelo_perfil.objects.filter(mfa_secret__isnull=False).count(),
+    }
+    for fila in modelo_perfil.objects.values('rol').annotate(total=Count('id')).order_by():
+        totales[clave_rol(fila['rol'])] = fila['total']
+    for campo in DIMENSIONES_FACETAS:
+        for fila in modelo_calificacion.objects.values(campo).annotate(total=Count('id')).order_by():
+            totales[clave_faceta(campo, fila[campo])] = fila['total']
+
+    por_usuario = [
+        (modelo_empresa, clave_empresas_usuario),
+        (modelo_calificacion, clave_calificaciones_usuario),
+    ]
+    for modelo, clave in por_usuario:
+        filas = modelo.objects.filter(usuario__isnull=False).values('usuario').annotate(total=Count('id')).order_by()
+        for fila in filas:
+            totales[clave(fila['usuario'])] = fila['total']
+
+    return totales
+
+
+def recalcular(apps=registro_global):
+    """Reemplaza la tabla de contadores por los valores reales. Devuelve el diccionario calculado"""
+    modelo_contador = apps.get_model('calificaciones', 'Contador')
+    with transaction.atomic():
+        totales = calcular(apps)
+        modelo_contador.objects.all().delete()
+        modelo_contador.objects.bulk_create(
+            [modelo_contador(clave=clave, valor=valor) for clave, valor in totales.items()],
+            batch_size=1000,
+        )
+    return totales
+
+
+# ==========================================
+# SEÑALES
+# ==========================================
+#
+# pre_save lee de la base de datos los valores que mueven contadores (dueño,
+# rol, MFA) antes de sobrescribirlos, así un save() que cambia de dueño o de
+# rol ajusta ambos lados aunque la instancia en memoria esté desactualizada.
+
+CAMPOS_RASTREADOS = {
+    Empresa: ['usuario_id'],
+    # ejercicio y mercado los usan las facetas de los filtros (facetas.py)
+    CalificacionTributaria: ['usuario_id', 'ejercicio', 'mercado'],
+    Profile: ['rol', 'mfa_secret'],
+}
+
+
+def _guardar_anteriores(sender, instance, update_fields=None, **kwargs):
+    campos = CAMPOS_RASTREADOS[sender]
+    instance._contador_anterior = None
+    if instance._state.adding or instance.pk is None:
+        return
+    nombres = set(campos) | {sender._meta.get_field(campo).name for campo in campos}
+    if update_fields is not None and not nombres & set(update_fields):
+        return
+    fila = sender._default_manager.filter(pk=instance.pk).values(*campos).first()
+    instance._contador_anterior = fila
+
+
+for _modelo in CAMPOS_RASTREADOS:
+    pre_save.connect(_guardar_anteriores, sender=_modelo, dispatch_uid=f'contadores_{_modelo.__name__}')
+
+
+def _mover(instance, campo, clave):
+    """Pasa una unidad del contador del valor anterior al actual (None = sin dueño)"""
+    anteriores = getattr(instance, '_contador_anterior', None)
+    if anteriores is None:
+        return
+    anterior, actual = anteriores[campo], getattr(instance, campo)
+    if anterior == actual:
+        return
+    if anterior is not None:
+        incrementar(clave(anterior), -1)
+    if actual is not None:
+        incrementar(clave(actual), 1)
+
+
+@receiver(post_save, sender=Empresa)
+def empresa_guardada(sender, instance, created, **kwargs):
+    if created:
+        sumar_empresas(instance.usuario_id, 1)
+    else:
+        _mover(instance, 'usuario_id', clave_empresas_usuario)
+
+
+@receiver(post_delete, sender=Empresa)
+def empresa_eliminada(sender, instance, **kwargs):
+    sumar_empresas(instance.usuario_id, -1)
+
+
+@receiver(post_save, sender=CalificacionTributaria)
+def calificacion_guardada(sender, instance, created, **kwargs):
+    if created:
+        sumar_calificaciones(instance.usuario_id, 1)
+    else:
+        _mover(instance, 'usuario_id', clave_calificaciones_usuario)
+
+
+@receiver(post_delete, sender=CalificacionTributaria)
+def calificacion_eliminada(sender, instance, **kwargs):
+    sumar_calificaciones(instance.usuario_id, -1)
+
+
+@receiver(post_save, sender=ArchivoCarga)
+def archivo_guardado(sender, instance, created, **kwargs):
+    if created:
+        incrementar(ARCHIVOS)
+
+
+@receiver(post_delete, sender=ArchivoCarga)
+def archivo_eliminado(sender, instance, **kwargs):
+    incrementar(ARCHIVOS, -1)
+
+
+@receiver(post_save, sender=User)
+def usuario_guardado(sender, instance, created, **kwargs):
+    if created:
+        incrementar(USUARIOS)
+
+
+@receiver(post_delete, sender=User)
+def usuario_eliminado(sender, instance, **kwargs):
+    incrementar(USUARIOS, -1)
+
+
+@receiver(post_save, sender=Profile)
+def perfil_guardado(sender, instance, created, **kwargs):
+    tiene_mfa = instance.mfa_secret is not None
+    if created:
+        incrementar(clave_rol(instance.rol))
+        incrementar(PERFILES_MFA, int(tiene_mfa))
+    else:
+        _mover(instance, 'rol', clave_rol)
+        anteriores = getattr(instance, '_contador_anterior', None)
+        if anteriores is not None:
+            incrementar(PERFILES_MFA, int(tiene_mfa) - int(anteriores['mfa_secret'] is not None))
+
+
+@receiver(post_delete, sender=Profile)
+def perfil_eliminado(sender, instance, **kwargs):
+    incrementar(clave_rol(instance.rol), -1)
+    incrementar(PERFILES_MFA, -int(instance.mfa_secret is not None))
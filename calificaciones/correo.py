@@ -0,0 +1,174 @@
+import logging
+import smtplib
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .cola import identificador_trabajador
+from .models import CorreoSaliente
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# BANDEJA DE SALIDA DE CORREOS
+# ==========================================
+#
+# Las vistas solo insertan el correo en CorreoSaliente; la respuesta HTTP ya
+# no espera el saludo SMTP. El envío lo hace `manage.py enviar_correos`:
+#   PENDIENTE -> ENVIANDO (reclamado en lote con SKIP LOCKED) -> ENVIADO
+#                         \-> PENDIENTE con backoff, o ERROR al agotar intentos
+#
+# Cada trabajador mantiene una sola conexión SMTP abierta mientras haya
+# correos en cola y la reutiliza para todos los mensajes del lote.
+
+# Rechazos que afectan solo a un mensaje; cualquier otro error se trata
+# como un problema de la conexión y se vuelve a abrir
+ERRORES_MENSAJE = (
+    smtplib.SMTPRecipientsRefused,
+    smtplib.SMTPSenderRefused,
+    smtplib.SMTPDataError,
+)
+
+
+def encolar_correo(asunto, cuerpo, remitente, destinatarios, cuerpo_html=''):
+    """Mismos argumentos que send_mail, pero deja el correo en la bandeja de salida"""
+    return CorreoSaliente.objects.create(
+        asunto=asunto,
+        cuerpo=cuerpo,
+        cuerpo_html=cuerpo_html or '',
+        remitente=remitente or settings.DEFAULT_FROM_EMAIL,
+        destinatarios=list(destinatarios),
+    )
+
+
+def espera_reintento(intentos):
+    """Backoff exponencial: base, 2*base, 4*base... con un máximo de una hora"""
+    base = settings.CORREO_REINTENTO_SEGUNDOS
+    return timedelta(seconds=min(base * 2 ** max(intentos - 1, 0), 3600))
+
+
+def recuperar_huerfanos():
+    """Devuelve a la cola los correos que quedaron en ENVIANDO porque su trabajador murió"""
+    limite = timezone.now() - timedelta(seconds=settings.CORREO_TIMEOUT_SEGUNDOS)
+    recuperados = CorreoSaliente.objects.filter(estado='ENVIANDO', reclamado__lt=limite).update(
+        estado='PENDIENTE',
+        trabajador='',
+    )
+    if recuperados:
+        logger.warning('Correos huérfanos reencolados: %s', recuperados)
+    return recuperados
+
+
+def reclamar_lote(trabajador, tamano):
+    """Toma hasta `tamano` correos pendientes y los marca como ENVIANDO para `trabajador`"""
+    ahora = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            CorreoSaliente.objects
+            .select_for_update(skip_locked=True)
+            .filter(estado='PENDIENTE')
+            .filter(Q(proximo_intento__isnull=True) | Q(proximo_intento__lte=ahora))
+            .order_by('fecha_creacion', 'id')
+            .values_list('id', flat=True)[:tamano]
+        )
+        if not ids:
+            return []
+        CorreoSaliente.objects.filter(id__in=ids).update(estado='ENVIANDO', trabajador=trabajador, reclamado=ahora)
+    return list(CorreoSaliente.objects.filter(id__in=ids).order_by('fecha_creacion', 'id'))
+
+
+def registrar_fallo(correo, error):
+    """Programa un reintento con backoff o marca el correo como ERROR si ya no quedan intentos"""
+    intentos = correo.intentos + 1
+    if intentos < settings.CORREO_MAX_INTENTOS:
+        cambios = {'estado': 'PENDIENTE', 'proximo_intento': timezone.now() + espera_reintento(intentos)}
+    else:
+        cambios = {'estado': 'ERROR'}
+    CorreoSaliente.objects.filter(pk=correo.pk).update(
+        intentos=F('intentos') + 1,
+        trabajador='',
+        ultimo_error=str(error),
+        **cambios,
+    )
+
+
+def _mensaje(correo, conexion):
+    mensaje = EmailMultiAlternatives(
+        correo.asunto, correo.cuerpo, correo.remitente, correo.destinatarios, connection=conexion,
+    )
+    if correo.cuerpo_html:
+        mensaje.attach_alternative(correo.cuerpo_html, 'text/html')
+    return mensaje
+
+
+def _enviar(conexion, mensaje):
+    # open() explícito: si send_messages abre la conexión por su cuenta, la cierra al terminar
+    conexion.open()
+    try:
+        conexion.send_messages([mensaje])
+    except smtplib.SMTPServerDisconnected:
+        # El servidor cerró la conexión inactiva: se reabre una vez antes de contarlo como fallo
+        conexion.close()
+        conexion.open()
+        conexion.send_messages([mensaje])
+
+
+def enviar_lote(correos, conexion):
+    """
+    Envía los correos reutilizando `conexion`. Devuelve la cantidad enviada.
+    Si la conexión falla, el resto del lote vuelve a la cola sin gastar intentos.
+    """
+    enviados = 0
+    for posicion, correo in enumerate(correos):
+        try:
+            _enviar(conexion, _mensaje(correo, conexion))
+        except ERRORES_MENSAJE as e:
+            logger.warning('Correo %s rechazado: %s', correo.pk, e)
+            registrar_fallo(correo, e)
+            continue
+        except Exception as e:
+            logger.exception('Error de conexión SMTP enviando el correo %s', correo.pk)
+            registrar_fallo(correo, e)
+            conexion.close()
+            pendientes = [c.pk for c in correos[posicion + 1:]]
+            CorreoSaliente.objects.filter(pk__in=pendientes).update(estado='PENDIENTE', trabajador='')
+            break
+
+        CorreoSaliente.objects.filter(pk=correo.pk).update(
+            estado='ENVIADO',
+            trabajador='',
+            fecha_envio=timezone.now(),
+            ultimo_error='',
+        )
+        enviados += 1
+    return enviados
+
+
+def ciclo_envio(una_vez=False, intervalo=1, tamano_lote=None):
+    """
+    Bucle del trabajador de correo. La conexión SMTP se abre con el primer lote
+    y se cierra cuando la cola queda vacía. Con una_vez=True termina al vaciarla.
+    """
+    trabajador = identificador_trabajador()
+    tamano_lote = tamano_lote or settings.CORREO_LOTE
+    conexion = get_connection(fail_silently=False)
+    enviados = 0
+    try:
+        while True:
+            recuperar_huerfanos()
+            correos = reclamar_lote(trabajador, tamano_lote)
+            if not correos:
+                conexion.close()
+                if una_vez:
+                    return enviados
+                time.sleep(intervalo)
+                continue
+
+            enviados += enviar_lote(correos, conexion)
+    finally:
+        conexion.close()
@@ -0,0 +1,125 @@
+from collections import Counter
+from functools import partial
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import contadores
+from .models import CalificacionTributaria, Contador
+
+# ==========================================
+# FACETAS DE LOS FILTROS DE CALIFICACIONES
+# ==========================================
+#
+# Valores distintos de ejercicio, mercado y usuario con la cantidad de
+# calificaciones de cada uno, para llenar los filtros sin recorrer la tabla
+# en cada visita. Cada valor es una fila de la tabla Contador
+# ("facetas:ejercicio:2024", "facetas:mercado:ACN") que se ajusta con
+# UPDATE ... SET valor = valor + delta, atómico aunque varios procesos
+# ajusten el mismo valor a la vez:
+#   - las altas, bajas y cambios individuales la ajustan con señales
+#     (solo los valores que cambiaron, al confirmar la transacción)
+#   - las cargas masivas llaman a sumar_calificaciones con las filas insertadas
+#   - las operaciones con SQL directo terminan con contadores.recalcular()
+# La faceta de usuarios es el contador de calificaciones por usuario que ya
+# mantiene contadores.py. Si alguna vez quedan desfasadas:
+# python manage.py recalcular_contadores
+
+DIMENSIONES = {
+    'ejercicio': 'ejercicio',
+    'mercado': 'mercado',
+    'usuario': 'usuario_id',
+}
+# Dimensiones que ajusta este módulo; la de usuarios la ajusta contadores.py
+AJUSTADAS = contadores.DIMENSIONES_FACETAS
+
+
+def _prefijo(dimension):
+    if dimension == 'usuario':
+        return contadores.clave_calificaciones_usuario('')
+    return contadores.clave_faceta(dimension, '')
+
+
+def conteos(dimension):
+    """{valor: cantidad} de una dimensión, desde la tabla de contadores (una consulta)"""
+    campo = CalificacionTributaria._meta.get_field(DIMENSIONES[dimension])
+    prefijo = _prefijo(dimension)
+    filas = Contador.objects.filter(clave__startswith=prefijo, valor__gt=0).values_list('clave', 'valor')
+    return {campo.to_python(clave[len(prefijo):]): valor for clave, valor in filas}
+
+
+def obtener():
+    """Listas para los filtros: ejercicios (desc), mercados y usuarios, cada valor con su total"""
+    usuarios = conteos('usuario')
+    nombres = dict(User.objects.filter(id__in=list(usuarios)).values_list('id', 'username'))
+    return {
+        'ejercicios': [
+            {'valor': valor, 'total': total}
+            for valor, total in sorted(conteos('ejercicio').items(), reverse=True)
+        ],
+        'mercados': [
+            {'valor': valor, 'total': total}
+            for valor, total in sorted(conteos('mercado').items())
+        ],
+        'usuarios': sorted(
+            (
+                {'id': pk, 'username': nombres[pk], 'total': total}
+                for pk, total in usuarios.items() if pk in nombres
+            ),
+            key=lambda usuario: usuario['username'],
+        ),
+    }
+
+
+# ==========================================
+# AJUSTES INCREMENTALES
+# ==========================================
+
+def _aplicar(deltas):
+    """Suma {dimension: {valor: delta}} a las filas de las facetas"""
+    for dimension, cambios in deltas.items():
+        for valor, delta in cambios.items():
+            if delta and valor is not None:
+                contadores.incrementar(contadores.clave_faceta(dimension, valor), delta)
+
+
+def _valor(instancia, campo):
+    # Las vistas asignan valores del POST (texto): se normalizan al tipo del campo
+    return CalificacionTributaria._meta.get_field(campo).to_python(getattr(instancia, campo))
+
+
+def _al_confirmar(deltas):
+    transaction.on_commit(partial(_aplicar, deltas))
+
+
+def sumar_calificaciones(calificaciones, signo=1):
+    """Llamar después de insertar (o borrar, con signo=-1) calificaciones sin pasar por save()/delete()"""
+    _al_confirmar({
+        dimension: {valor: signo * total for valor, total in Counter(_valor(c, dimension) for c in calificaciones).items()}
+        for dimension in AJUSTADAS
+    })
+
+
+@receiver(post_save, sender=CalificacionTributaria)
+def calificacion_guardada(sender, instance, created, **kwargs):
+    if created:
+        sumar_calificaciones([instance])
+        return
+    # Valores anteriores leídos por contadores._guardar_anteriores en pre_save
+    anteriores = getattr(instance, '_contador_anterior', None)
+    if anteriores is None:
+        return
+    deltas = {}
+    for dimension in AJUSTADAS:
+        anterior, actual = anteriores[dimension], _valor(instance, dimension)
+        if anterior != actual:
+            deltas[dimension] = {anterior: -1, actual: 1}
+    if deltas:
+        _al_confirmar(deltas)
+
+
+@receiver(post_delete, sender=CalificacionTributaria)
+def calificacion_eliminada(sender, instance, **kwargs):
+    sumar_calificaciones([instance], signo=-1)
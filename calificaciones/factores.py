@@ -0,0 +1,256 @@
+import operator
+import struct
+from dataclasses import dataclass
+from decimal import Decimal
+from functools import reduce
+from itertools import chain
+
+import numpy as np
+from django.db.backends.signals import connection_created
+from django.db.models import BigIntegerField, BinaryField, Case, DecimalField, F, Func, Value, When
+from django.db.models.functions import Cast, Coalesce, Round
+from django.dispatch import receiver
+
+# ==========================================
+# KERNEL VECTORIAL DE FACTORES (PUNTO FIJO)
+# ==========================================
+#
+# Los factores son DecimalField(max_digits=9, decimal_places=8), por lo que
+# cada valor se representa exactamente como un entero escalado por 1e8.
+# Sumar y comparar enteros int64 da el mismo resultado que el camino con
+# Decimal de FactoresCalificacion.validar_factores, pero para N filas a la vez.
+
+ESCALA = 10 ** 8
+NUMEROS_FACTORES = range(8, 38)
+CAMPOS_FACTORES = [f'factor_{i}' for i in NUMEROS_FACTORES]
+COLUMNAS_8_16 = slice(0, 9)  # factor_8 ... factor_16 dentro de la matriz
+RESTRICCION_SUMA_8_16 = 'factores_suma_8_16_max_1'  # CheckConstraint de FactoresCalificacion
+
+# Marca usada para transportar NULL dentro de un int64
+_NULO = np.iinfo(np.int64).min
+
+# ==========================================
+# FORMATO EMPAQUETADO
+# ==========================================
+#
+# FactoresCalificacion.empaquetado guarda los 30 factores como int32
+# big-endian escalados por 1e8 (120 bytes, NULL -> 0) y
+# FactoresCalificacion.nulos un mapa de bits donde el bit i indica que
+# factor_(8+i) es NULL. Un bloque de filas se convierte a NumPy con un
+# solo np.frombuffer, sin pasar por Decimal. Con max_digits=9 un factor
+# escalado cabe en int32 (|valor| <= 999_999_999); al leer se pasa a int64
+# para que las sumas no desborden.
+#
+# Las dos son columnas generadas: las calcula la base de datos desde
+# factor_8 ... factor_37 en cada INSERT/UPDATE, también en QuerySet.update(),
+# COPY o SQL directo, por lo que no pueden quedar desfasadas. En PostgreSQL
+# cada factor se escribe con int4send (de ahí el big-endian); SQLite no
+# tiene cómo armar bytes en SQL y usa una función registrada al conectar.
+
+_FORMATO = struct.Struct(f'>{len(CAMPOS_FACTORES)}i')
+TIPO_EMPAQUETADO = np.dtype('>i4')
+FUNCION_SQLITE = 'nuam_empaquetar_factores'
+_BITS = np.arange(len(CAMPOS_FACTORES), dtype=np.int64)
+
+
+@dataclass
+class MatrizFactores:
+    ids: np.ndarray      # (N,) id de FactoresCalificacion
+    valores: np.ndarray  # (N, 30) int64 escalado por 1e8, NULL -> 0
+    nulos: np.ndarray    # (N, 30) bool, True donde el factor es NULL
+
+    def __len__(self):
+        return len(self.ids)
+
+
+@dataclass
+class ResumenFactores:
+    ids: np.ndarray          # (N,)
+    sumas_8_16: np.ndarray   # (N,) suma escalada de los factores 8-16
+    validos: np.ndarray      # (N,) bool, suma 8-16 <= 1
+    cantidad: np.ndarray     # (30,) valores no nulos por factor
+    suma: np.ndarray         # (30,) suma escalada por factor
+    minimo: np.ndarray       # (30,) mínimo escalado por factor (0 si no hay valores)
+    maximo: np.ndarray       # (30,) máximo escalado por factor (0 si no hay valores)
+
+    @property
+    def ids_invalidos(self):
+        return self.ids[~self.validos]
+
+    def estadisticas(self):
+        """Estadísticas por factor como Decimal exactos, listas para mostrar o exportar"""
+        filas = []
+        for i, numero in enumerate(NUMEROS_FACTORES):
+            cantidad = int(self.cantidad[i])
+            suma = a_decimal(self.suma[i])
+            filas.append({
+                'factor': numero,
+                'cantidad': cantidad,
+                'suma': suma,
+                'promedio': (suma / cantidad).quantize(Decimal('0.00000001')) if cantidad else None,
+                'minimo': a_decimal(self.minimo[i]) if cantidad else None,
+                'maximo': a_decimal(self.maximo[i]) if cantidad else None,
+            })
+        return filas
+
+
+def a_decimal(valor_escalado):
+    """Entero escalado por 1e8 -> Decimal con 8 decimales"""
+    return Decimal(int(valor_escalado)).scaleb(-8)
+
+
+def empaquetar(valores):
+    """Lista de 30 Decimal/None -> (bytes, mapa de bits de nulos)"""
+    enteros = []
+    nulos = 0
+    for i, valor in enumerate(valores):
+        if valor is None:
+            nulos |= 1 << i
+            enteros.append(0)
+        else:
+            enteros.append(int(Decimal(valor).scaleb(8)))
+    return _FORMATO.pack(*enteros), nulos
+
+
+def _empaquetar_sqlite(*valores):
+    # SQLite entrega los numeric como float: se redondean a 8 decimales, igual que al leerlos con el ORM
+    return empaquetar([None if valor is None else round(Decimal(str(valor)), 8) for valor in valores])[0]
+
+
+@receiver(connection_created)
+def registrar_funciones_sqlite(sender, connection, **kwargs):
+    """Registra en cada conexión SQLite la función que usa la columna generada empaquetado"""
+    if connection.vendor == 'sqlite':
+        connection.connection.create_function(
+            FUNCION_SQLITE, len(CAMPOS_FACTORES), _empaquetar_sqlite, deterministic=True,
+        )
+
+
+class ExpresionEmpaquetado(Func):
+    """Copia empaquetada de factor_8 ... factor_37 en SQL, usada por la columna generada"""
+    function = FUNCION_SQLITE
+    output_field = BinaryField()
+
+    def __init__(self):
+        super().__init__(*(F(campo) for campo in CAMPOS_FACTORES))
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        partes, parametros = [], []
+        for expresion in self.get_source_expressions():
+            sql, params = compiler.compile(expresion)
+            partes.append(f'int4send(COALESCE(ROUND({sql} * {ESCALA})::integer, 0))')
+            parametros.extend(params)
+        return f'({" || ".join(partes)})', tuple(parametros)
+
+
+def expresion_nulos():
+    """Mapa de bits de factores NULL en SQL, usado por la columna generada nulos"""
+    return reduce(operator.add, [
+        Case(When(**{f'{campo}__isnull': True}, then=Value(1 << i)), default=Value(0))
+        for i, campo in enumerate(CAMPOS_FACTORES)
+    ])
+
+
+def validos_empaquetados(empaquetados):
+    """Validez 8-16 de una lista de factores empaquetados (bool por fila), sin pasar por Decimal"""
+    valores = np.frombuffer(b''.join(empaquetados), dtype=TIPO_EMPAQUETADO).reshape(-1, len(CAMPOS_FACTORES))
+    return valores[:, COLUMNAS_8_16].sum(axis=1, dtype=np.int64) <= ESCALA
+
+
+def desempaquetar(empaquetado, nulos):
+    """(bytes, mapa de bits de nulos) -> lista de 30 Decimal/None"""
+    return [
+        None if nulos >> i & 1 else a_decimal(entero)
+        for i, entero in enumerate(_FORMATO.unpack(bytes(empaquetado)))
+    ]
+
+
+def _escalado(campo):
+    # La multiplicación y el redondeo se hacen en la base de datos para que
+    # Python reciba enteros y no tenga que convertir millones de Decimal.
+    return Coalesce(
+        Cast(Round(F(campo) * ESCALA), BigIntegerField()),
+        Value(int(_NULO)),
+        output_field=BigIntegerField(),
+    )
+
+
+def expresion_suma_8_16():
+    """Suma de factor_8 ... factor_16 en SQL (NULL cuenta como 0), usada por la columna generada"""
+    campo = DecimalField(max_digits=10, decimal_places=8)
+    terminos = [Coalesce(F(nombre), Value(Decimal(0)), output_field=campo) for nombre in CAMPOS_FACTORES[COLUMNAS_8_16]]
+    # El redondeo a 8 decimales evita el ruido de punto flotante en SQLite
+    return Round(reduce(operator.add, terminos), 8, output_field=campo)
+
+
+def cargar_matriz(queryset, chunk_size=20000):
+    """
+    Carga los factores 8-37 de un queryset de FactoresCalificacion en una
+    matriz int64 (N, 30) escalada por 1e8, leyendo la base de datos por bloques.
+
+    Usa las columnas generadas empaquetado y nulos (2 columnas en vez de 30 numeric).
+    """
+    ids, bloques, mapas = [], [], []
+    filas = queryset.order_by().values_list('id', 'empaquetado', 'nulos').iterator(chunk_size=chunk_size)
+    for pk, empaquetado, nulos in filas:
+        ids.append(pk)
+        bloques.append(empaquetado)
+        mapas.append(nulos)
+
+    ancho = len(CAMPOS_FACTORES)
+    valores = np.frombuffer(b''.join(bloques), dtype=TIPO_EMPAQUETADO).reshape(-1, ancho).astype(np.int64)
+    nulos = (np.array(mapas, dtype=np.int64).reshape(-1, 1) >> _BITS & 1).astype(bool)
+    return MatrizFactores(ids=np.array(ids, dtype=np.int64), valores=valores, nulos=nulos)
+
+
+def cargar_matriz_columnas(queryset, chunk_size=20000):
+    """Igual que cargar_matriz, pero leyendo las 30 columnas numeric (escaladas en SQL)"""
+    anotaciones = {f'_e_{campo}': _escalado(campo) for campo in CAMPOS_FACTORES}
+    filas = (
+        queryset
+        .order_by()
+        .annotate(**anotaciones)
+        .values_list('id', *anotaciones)
+        .iterator(chunk_size=chunk_size)
+    )
+    plano = np.fromiter(chain.from_iterable(filas), dtype=np.int64)
+    plano = plano.reshape(-1, len(CAMPOS_FACTORES) + 1)
+
+    ids = plano[:, 0].copy()
+    valores = plano[:, 1:].copy()
+    nulos = valores == _NULO
+    valores[nulos] = 0
+    return MatrizFactores(ids=ids, valores=valores, nulos=nulos)
+
+
+def analizar(matriz):
+    """Calcula sumas 8-16, validez y estadísticas por factor en una pasada vectorizada"""
+    valores = matriz.valores
+    sumas_8_16 = valores[:, COLUMNAS_8_16].sum(axis=1)
+
+    presentes = ~matriz.nulos
+    cantidad = presentes.sum(axis=0)
+    tope = np.iinfo(np.int64).max
+    if len(matriz):
+        minimo = np.where(presentes, valores, tope).min(axis=0)
+        maximo = np.where(presentes, valores, -tope).max(axis=0)
+        minimo[cantidad == 0] = 0
+        maximo[cantidad == 0] = 0
+    else:
+        minimo = np.zeros(len(CAMPOS_FACTORES), dtype=np.int64)
+        maximo = np.zeros(len(CAMPOS_FACTORES), dtype=np.int64)
+
+    return ResumenFactores(
+        ids=matriz.ids,
+        sumas_8_16=sumas_8_16,
+        validos=sumas_8_16 <= ESCALA,
+        cantidad=cantidad,
+        suma=valores.sum(axis=0),
+        minimo=minimo,
+        maximo=maximo,
+    )
+
+
+def analizar_queryset(queryset, chunk_size=20000):
+    """Atajo: carga y analiza los factores de un queryset de FactoresCalificacion"""
+    return analizar(cargar_matriz(queryset, chunk_size=chunk_size))
@@ -2,6 +2,15 @@ from django import forms
 from django.contrib.auth.models import User
 from .models import Empresa, CalificacionTributaria, Profile
 
+def validar_email_unico(email, usuario=None):
+    """El email identifica al usuario en el login: no puede repetirse (sin distinguir mayúsculas)"""
+    duplicados = User.objects.filter(email__iexact=email)
+    if usuario is not None and usuario.pk:
+        duplicados = duplicados.exclude(pk=usuario.pk)
+    if duplicados.exists():
+        raise forms.ValidationError('Ya existe una cuenta con este correo electrónico')
+    return email
+
 class EmpresaForm(forms.ModelForm):
     class Meta:
         model = Empresa
@@ -48,6 +57,9 @@ class UserManagementForm(forms.ModelForm):
         if self.instance and hasattr(self.instance, 'profile'):
             self.fields['rol'].initial = self.instance.profile.rol
     
+    def clean_email(self):
+        return validar_email_unico(self.cleaned_data['email'], self.instance)
+    
     def save(self, commit=True):
         user = super().save(commit=False)
         if commit:
@@ -68,6 +80,9 @@ class UserCreateForm(forms.ModelForm):
         model = User
         fields = ['username', 'email', 'first_name', 'last_name', 'password']
     
+    def clean_email(self):
+        return validar_email_unico(self.cleaned_data['email'])
+    
     def save(self, commit=True):
         user = super().save(commit=False)
         user.set_password(self.cleaned_data['password'])
@@ -0,0 +1,878 @@
+import csv
+import io
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation, ROUND_FLOOR, ROUND_HALF_UP
+from functools import partial
+from xml.etree.ElementTree import ParseError
+from zipfile import BadZipFile
+
+import django
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from openpyxl import load_workbook
+from openpyxl.utils.exceptions import InvalidFileException
+from openpyxl.worksheet._reader import DATA_TAG, ROW_TAG, WorkSheetParser
+from openpyxl.xml.functions import iterparse
+
+from . import facetas, metricas, plantillas
+from .contadores import sumar_calificaciones
+from .factores import ESCALA, RESTRICCION_SUMA_8_16, empaquetar, validos_empaquetados
+from .models import ArchivoCarga, CalificacionTributaria, FactoresCalificacion
+
+# ==========================================
+# MOTOR DE CARGA MASIVA (CSV Y EXCEL)
+# ==========================================
+
+# Cantidad de filas que se escriben por lote (un bulk_create + una transacción)
+TAMANO_LOTE = 1000
+
+# Máximo de mensajes de error que se guardan para mostrar al usuario
+MAX_ERRORES_DETALLE = 20
+
+NUMEROS_FACTORES = range(8, 38)
+CAMPOS_FACTORES = [f'factor_{i}' for i in NUMEROS_FACTORES]
+
+# Columnas fijas de cada plantilla (ver descargar_plantilla_montos / descargar_plantilla_factores)
+COLUMNAS_FACTORES = [
+    'EJERCICIO_FISCAL',
+    'CODIGO_MERCADO',
+    'INSTRUMENTO_FINANCIERO',
+    'FECHA_PAGO',
+    'SECUENCIA_EVENTO',
+    'DESCRIPCION_EVENTO',
+]
+COLUMNAS_MONTOS = COLUMNAS_FACTORES + ['TIPO_SOCIEDAD', 'VALOR_HISTORICO']
+
+COLUMNAS_POR_TIPO = {
+    'MONTOS': COLUMNAS_MONTOS,
+    'FACTORES': COLUMNAS_FACTORES,
+}
+
+# Formatos aceptados; los .xlsx se leen con filas_xlsx
+EXTENSIONES_CARGA = ('.csv', '.xlsx')
+
+SIN_ENCABEZADO = 'No se encontró la fila de encabezados (EJERCICIO_FISCAL ...) de la plantilla'
+
+OCHO_DECIMALES = Decimal('0.00000001')
+DOS_DECIMALES = Decimal('0.01')
+
+
+class ErrorFormato(Exception):
+    """El archivo no tiene la estructura de ninguna plantilla oficial"""
+
+
+class ErrorFila(Exception):
+    """Una fila de datos no pasa las validaciones"""
+
+
+class CargaCancelada(Exception):
+    """
+    El archivo dejó de pertenecer a este proceso: el usuario lo canceló o se dio
+    por huérfano y lo reclamó otro trabajador
+    """
+
+
+@dataclass
+class ResultadoCarga:
+    procesados: int = 0
+    errores: int = 0
+    insertados: int = 0
+    actualizados: int = 0
+    sin_cambios: int = 0
+    cancelada: bool = False
+    detalle_errores: list = field(default_factory=list)
+
+    def registrar_error(self, numero_linea, mensaje):
+        self.errores += 1
+        if len(self.detalle_errores) < MAX_ERRORES_DETALLE:
+            self.detalle_errores.append(f'Línea {numero_linea}: {mensaje}')
+
+
+def normalizar_encabezado(valor):
+    """'EJERCICIO_FISCAL (*)' -> 'EJERCICIO_FISCAL'"""
+    return valor.replace('(*)', '').strip().upper()
+
+
+def es_encabezado(numero_linea, fila, tipo_carga):
+    """La fila es la de encabezados de la plantilla. Lanza ErrorFormato si no tiene sus columnas"""
+    columnas = COLUMNAS_POR_TIPO[tipo_carga]
+    total_columnas = len(columnas) + len(CAMPOS_FACTORES)
+    if not fila or normalizar_encabezado(fila[0]) != columnas[0]:
+        return False
+    nombres = [normalizar_encabezado(valor) for valor in fila if valor.strip()]
+    if nombres[:len(columnas)] != columnas or len(nombres) != total_columnas:
+        raise ErrorFormato(
+            f'Los encabezados de la línea {numero_linea} no corresponden a la plantilla de '
+            f'{tipo_carga.lower()} ({total_columnas} columnas esperadas)'
+        )
+    return True
+
+
+def _celdas(fila):
+    """Celdas con contenido de una fila, sin espacios alrededor"""
+    return tuple(valor.strip() for valor in fila if valor.strip())
+
+
+def _textos_plantillas():
+    """Filas de texto (títulos de sección, notas, instrucciones) de las plantillas que se descargan"""
+    textos = set()
+    for escribir in (plantillas.escribir_plantilla_montos, plantillas.escribir_plantilla_factores):
+        for fila in csv.reader(io.StringIO(plantillas.generar(escribir).decode('utf-8-sig'))):
+            celdas = _celdas(fila)
+            if celdas and not celdas[0].isdigit():  # Los ejemplos son filas de datos
+                textos.add(celdas)
+    return frozenset(textos)
+
+
+TEXTOS_PLANTILLA = _textos_plantillas()
+
+
+def leer_filas(filas, tipo_carga, encabezado_encontrado=False):
+    """
+    Recorre las filas (numero_linea, fila, posicion) de una plantilla y entrega
+    solo las filas de datos.
+
+    Se salta todo lo anterior a la fila de encabezados (encabezado corporativo
+    e instrucciones) y, después de ella, las filas vacías y los títulos de
+    sección y notas de la plantilla (textos idénticos a los de la plantilla
+    descargada). Cualquier otra fila se entrega para que la validación la
+    acepte o la informe como error. Al leer un archivo desde la mitad el
+    encabezado ya fue validado (encabezado_encontrado=True).
+    """
+    for numero_linea, fila, posicion in filas:
+        celdas = _celdas(fila)
+        if not celdas:
+            continue
+
+        if not encabezado_encontrado:
+            encabezado_encontrado = es_encabezado(numero_linea, fila, tipo_carga)
+            continue
+
+        if celdas in TEXTOS_PLANTILLA:
+            continue
+
+        yield numero_linea, fila, posicion
+
+    if not encabezado_encontrado:
+        raise ErrorFormato(SIN_ENCABEZADO)
+
+
+def localizar_encabezado(filas, tipo_carga):
+    """(numero_linea, posicion) del final de la fila de encabezados. Lanza ErrorFormato"""
+    for numero_linea, fila, posicion in filas:
+        if es_encabezado(numero_linea, fila, tipo_carga):
+            return numero_linea, posicion
+    raise ErrorFormato(SIN_ENCABEZADO)
+
+
+def filas_csv(archivo, desde_byte=0, desde_linea=0, hasta_byte=None):
+    """
+    Genera (numero_linea, fila, posicion) leyendo un CSV UTF-8 binario desde el
+    byte `desde_byte` (y hasta `hasta_byte`) sin cargarlo en memoria.
+    `posicion` es el byte donde termina la fila, desde el cual se puede
+    retomar la lectura; las líneas se numeran a continuación de `desde_linea`.
+    """
+    archivo.seek(desde_byte)
+    posicion = desde_byte
+
+    def lineas():
+        nonlocal posicion
+        for linea in iter(archivo.readline, b''):
+            if hasta_byte is not None and posicion >= hasta_byte:
+                return
+            # La marca BOM solo puede estar al comienzo del archivo
+            texto = linea.decode('utf-8-sig' if posicion == 0 else 'utf-8')
+            posicion += len(linea)
+            yield texto
+
+    # csv.reader pide las líneas de a una y entrega la fila en cuanto se completa,
+    # así que `posicion` corresponde siempre al final de la fila entregada
+    lector = csv.reader(lineas())
+    for fila in lector:
+        yield desde_linea + lector.line_num, fila, posicion
+
+
+def es_libro_excel(nombre_archivo):
+    return nombre_archivo.lower().endswith('.xlsx')
+
+
+def texto_celda(valor):
+    """Valor de una celda de Excel como el texto que tendría en el CSV de la plantilla"""
+    if valor is None:
+        return ''
+    if isinstance(valor, datetime):
+        return valor.date().isoformat()  # Excel guarda las fechas como fecha y hora
+    if isinstance(valor, date):
+        return valor.isoformat()
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))  # 2024.0 -> '2024'
+    return str(valor)
+
+
+class _LectorHoja(WorkSheetParser):
+    """
+    Parser de openpyxl (tipos de celda, textos compartidos, fechas) que solo
+    entrega las filas. El original vacía cada <row> leída pero la deja colgada
+    de <sheetData>, unos 80 bytes por fila: aquí se desprende del árbol para
+    que la memoria no crezca con el largo de la hoja.
+
+    Depende de la API interna de openpyxl (este parser y atributos privados
+    del libro en filas_xlsx): requirements.txt fija la versión y XlsxTests
+    compara el resultado con iter_rows. Al subir openpyxl, correr esas pruebas.
+    """
+
+    def parse(self):
+        datos = None
+        for evento, elemento in iterparse(self.source, events=('start', 'end')):
+            if evento == 'start':
+                if elemento.tag == DATA_TAG:
+                    datos = elemento
+            elif elemento.tag == ROW_TAG:
+                yield self.parse_row(elemento)
+                datos.remove(elemento)
+                self.row_dimensions.clear()  # Alto y estilo de la fila, que no se usan
+
+
+def filas_xlsx(archivo, ancho=0):
+    """
+    Genera (numero_linea, fila, posicion) de la primera hoja de un libro Excel
+    leyendo su XML en streaming, sin construir el libro en memoria.
+
+    Las celdas se convierten al texto que tendrían en el CSV y las filas se
+    completan hasta `ancho` columnas (Excel no guarda las celdas vacías).
+    `numero_linea` es el número de fila de la hoja. La hoja va comprimida y no
+    se puede retomar desde un byte, así que `posicion` es siempre 0: al
+    reanudar se relee desde el comienzo saltando las filas ya confirmadas.
+    """
+    try:
+        libro = load_workbook(archivo, read_only=True, data_only=True, keep_links=False)
+    except (BadZipFile, InvalidFileException, KeyError) as e:
+        raise ErrorFormato('El archivo no es un libro Excel (.xlsx) válido') from e
+
+    try:
+        hoja = libro.worksheets[0]
+        with libro._archive.open(hoja._worksheet_path) as fuente:
+            lector = _LectorHoja(
+                fuente, hoja._shared_strings, data_only=True, epoch=libro.epoch,
+                date_formats=libro._date_formats, timedelta_formats=libro._timedelta_formats,
+            )
+            for numero_linea, celdas in lector.parse():
+                fila = [''] * max(ancho, celdas[-1]['column'] if celdas else 0)
+                for celda in celdas:
+                    fila[celda['column'] - 1] = texto_celda(celda['value'])
+                yield numero_linea, fila, 0
+    except (BadZipFile, ParseError) as e:
+        raise ErrorFormato(f'No se pudo leer la hoja del libro Excel ({e})') from e
+    finally:
+        libro.close()
+
+
+def _entero(valor, campo, obligatorio=True):
+    valor = valor.strip()
+    if not valor:
+        if obligatorio:
+            raise ErrorFila(f'{campo} es obligatorio')
+        return None
+    try:
+        return int(valor)
+    except ValueError:
+        raise ErrorFila(f'{campo} debe ser un número entero ("{valor}")')
+
+
+def _decimal(valor, campo, exponente):
+    valor = valor.strip()
+    if not valor:
+        return None
+    try:
+        numero = Decimal(valor)
+    except InvalidOperation:
+        raise ErrorFila(f'{campo} no es un número válido ("{valor}")')
+    if not numero.is_finite():
+        raise ErrorFila(f'{campo} no es un número válido ("{valor}")')
+    return numero.quantize(exponente, rounding=ROUND_HALF_UP)
+
+
+def _fecha(valor, campo):
+    valor = valor.strip()
+    if not valor:
+        raise ErrorFila(f'{campo} es obligatorio')
+    try:
+        return date.fromisoformat(valor)
+    except ValueError:
+        raise ErrorFila(f'{campo} debe tener formato YYYY-MM-DD ("{valor}")')
+
+
+def _texto(valor, campo, max_length, obligatorio=True):
+    valor = valor.strip()
+    if not valor and obligatorio:
+        raise ErrorFila(f'{campo} es obligatorio')
+    if len(valor) > max_length:
+        raise ErrorFila(f'{campo} supera los {max_length} caracteres')
+    return valor
+
+
+def factores_desde_montos(montos):
+    """
+    Calcula cada factor como monto / total de montos, a 8 decimales.
+
+    Redondear cada factor por separado puede hacer que la suma pase de 1 (seis
+    montos iguales dan 0.16666667 cada uno): se usa el método del mayor resto,
+    que trunca todos y reparte las unidades faltantes entre los de mayor resto,
+    así los factores suman exactamente 1.
+    """
+    total = sum(monto for monto in montos if monto is not None)
+    if total <= 0:
+        raise ErrorFila('la suma de los montos debe ser mayor que cero')
+    cocientes = [(monto or Decimal(0)) * ESCALA / total for monto in montos]
+    unidades = [int(cociente.to_integral_value(rounding=ROUND_FLOOR)) for cociente in cocientes]
+    faltantes = ESCALA - sum(unidades)
+    restos = sorted(range(len(montos)), key=lambda i: cocientes[i] - unidades[i], reverse=True)
+    for i in restos[:faltantes]:
+        unidades[i] += 1
+    return [Decimal(unidad).scaleb(-8) for unidad in unidades]
+
+
+def parsear_fila(fila, tipo_carga):
+    """
+    Convierte una fila de la plantilla en (datos de CalificacionTributaria, lista de 30 factores).
+    Lanza ErrorFila si algún campo no es válido.
+    """
+    columnas = COLUMNAS_POR_TIPO[tipo_carga]
+    total_columnas = len(columnas) + len(CAMPOS_FACTORES)
+    if len(fila) < total_columnas:
+        raise ErrorFila(f'se esperaban {total_columnas} columnas y la fila tiene {len(fila)}')
+
+    datos = {
+        'ejercicio': _entero(fila[0], 'EJERCICIO_FISCAL'),
+        'mercado': _texto(fila[1], 'CODIGO_MERCADO', 10),
+        'instrumento': _texto(fila[2], 'INSTRUMENTO_FINANCIERO', 100),
+        'fecha_pago': _fecha(fila[3], 'FECHA_PAGO'),
+        'secuencia_evento': _entero(fila[4], 'SECUENCIA_EVENTO', obligatorio=False) or 0,
+        'descripcion_dividendo': fila[5].strip() or None,
+    }
+
+    valores = fila[len(columnas):total_columnas]
+
+    if tipo_carga == 'MONTOS':
+        tipo_sociedad = fila[6].strip().upper() or None
+        if tipo_sociedad not in (None, 'A', 'C'):
+            raise ErrorFila(f'TIPO_SOCIEDAD debe ser A o C ("{tipo_sociedad}")')
+        datos['tipo_sociedad'] = tipo_sociedad
+        datos['valor_historico'] = _decimal(fila[7], 'VALOR_HISTORICO', DOS_DECIMALES)
+
+        montos = [
+            _decimal(valor, f'MONTO_{numero}', DOS_DECIMALES)
+            for numero, valor in zip(NUMEROS_FACTORES, valores)
+        ]
+        if any(monto is not None and monto < 0 for monto in montos):
+            raise ErrorFila('los montos deben ser valores positivos')
+        factores = factores_desde_montos(montos)
+    else:
+        factores = [
+            _decimal(valor, f'FACTOR_{numero}', OCHO_DECIMALES)
+            for numero, valor in zip(NUMEROS_FACTORES, valores)
+        ]
+        for numero, factor in zip(NUMEROS_FACTORES, factores):
+            if factor is not None and not (0 <= factor <= 1):
+                raise ErrorFila(f'FACTOR_{numero} debe estar entre 0 y 1')
+
+    return datos, factores
+
+
+# Valores de la calificación en las filas preparadas, en este orden
+CAMPOS_REGISTRO = [
+    'ejercicio', 'mercado', 'instrumento', 'fecha_pago', 'descripcion_dividendo',
+    'secuencia_evento', 'tipo_sociedad', 'valor_historico',
+]
+
+
+def preparar_fila(fila, tipo_carga):
+    """
+    parsear_fila en tuplas listas para escribir: (valores de CAMPOS_REGISTRO,
+    valores de COLUMNAS_FACTORES_STAGING). Los factores van como texto, que
+    cuesta mucho menos que Decimal enviar entre procesos y es lo que recibe COPY.
+    """
+    datos, factores = parsear_fila(fila, tipo_carga)
+    return (
+        tuple(datos.get(campo) for campo in CAMPOS_REGISTRO),
+        tuple(None if factor is None else str(factor) for factor in factores),
+    )
+
+
+def filas_preparadas(filas, tipo_carga):
+    """
+    Convierte las filas de datos (numero_linea, fila, posicion) en
+    (numero_linea, posicion, error, registro, factores). Si la fila no es
+    válida, `error` es el mensaje y registro y factores son None.
+    """
+    for numero_linea, fila, posicion in filas:
+        try:
+            registro, factores = preparar_fila(fila, tipo_carga)
+        except ErrorFila as e:
+            yield numero_linea, posicion, str(e), None, None
+        else:
+            yield numero_linea, posicion, None, registro, factores
+
+
+def _es_suma_invalida(error):
+    """El IntegrityError viene de la restricción de la suma 8-16 (y no de otra)"""
+    return RESTRICCION_SUMA_8_16 in str(error)
+
+
+def copiar(cursor, tabla, columnas, filas):
+    """COPY ... FROM STDIN con psycopg 3, o copy_expert con psycopg2"""
+    sql = f'COPY {tabla} ({", ".join(columnas)}) FROM STDIN'
+    crudo = cursor.cursor
+    if hasattr(crudo, 'copy'):
+        with crudo.copy(sql) as copia:
+            for fila in filas:
+                copia.write_row(fila)
+        return
+
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    for fila in filas:
+        escritor.writerow([
+            '\\x' + bytes(v).hex() if isinstance(v, (bytes, memoryview))
+            else ('' if v is None else v)
+            for v in fila
+        ])
+    buffer.seek(0)
+    crudo.copy_expert(f"{sql} WITH (FORMAT csv, NULL '')", buffer)
+
+
+# ==========================================
+# LECTURA EN PARALELO POR TRAMOS
+# ==========================================
+#
+# Parsear y validar (30 decimales por fila, fechas, empaquetado) es lo que
+# limita la velocidad de un archivo grande en un solo núcleo. Con
+# CARGA_MASIVA_PROCESOS_LECTURA > 1 el archivo se divide en tramos de
+# CARGA_MASIVA_TAMANO_TRAMO bytes, cortados en finales de línea, que se
+# parsean en un ProcessPoolExecutor. Los resultados se consumen en el orden
+# del archivo y alimentan al mismo escritor por lotes que la lectura
+# secuencial: los lotes, los checkpoints y los errores (con su número de
+# línea original) son los mismos con cualquier cantidad de procesos.
+
+# Bytes que se leen de una vez al buscar los cortes
+TAMANO_LECTURA = 1024 * 1024
+
+
+def dividir_en_tramos(archivo, desde_byte, desde_linea, tamano_tramo):
+    """
+    Divide el archivo desde `desde_byte` (un comienzo de fila) en tramos de
+    al menos `tamano_tramo` bytes. Genera (inicio, fin, desde_linea) por tramo.
+
+    Los cortes se hacen en finales de línea que no estén dentro de un campo
+    entre comillas: cada " alterna entre dentro y fuera (las comillas
+    escapadas van dobles), así que basta la paridad de las comillas leídas.
+    """
+    archivo.seek(desde_byte)
+    inicio, linea_inicio = desde_byte, desde_linea
+    posicion, linea, comillas = desde_byte, desde_linea, 0  # Al comienzo de cada bloque
+    for bloque in iter(partial(archivo.read, TAMANO_LECTURA), b''):
+        buscar = max(inicio + tamano_tramo - posicion, 0)  # Índice dentro del bloque
+        while buscar < len(bloque):
+            salto = bloque.find(b'\n', buscar)
+            if salto < 0:
+                break
+            if (comillas + bloque.count(b'"', 0, salto)) % 2:
+                buscar = salto + 1  # Salto de línea dentro de un campo
+                continue
+            fin = posicion + salto + 1
+            yield inicio, fin, linea_inicio
+            inicio, linea_inicio = fin, linea + bloque.count(b'\n', 0, salto + 1)
+            buscar = fin + tamano_tramo - posicion
+        posicion += len(bloque)
+        linea += bloque.count(b'\n')
+        comillas += bloque.count(b'"')
+    if posicion > inicio:
+        yield inicio, posicion, linea_inicio
+
+
+def parsear_tramo(ruta, tipo_carga, inicio, fin, desde_linea):
+    """
+    Filas preparadas de un tramo (se ejecuta en los procesos de lectura).
+    Devuelve (filas, falla): si el tramo no se pudo leer hasta el final,
+    `falla` es el error y `filas` lo leído hasta ese punto.
+    """
+    filas = []
+    with open(ruta, 'rb') as archivo:
+        try:
+            lectura = leer_filas(filas_csv(archivo, inicio, desde_linea, fin), tipo_carga, encabezado_encontrado=True)
+            filas.extend(filas_preparadas(lectura, tipo_carga))
+        except (UnicodeDecodeError, csv.Error) as e:
+            return filas, e
+    return filas, None
+
+
+def _resultado_tramo(futuro):
+    filas, falla = futuro.result()
+    yield from filas
+    if falla is not None:
+        raise falla
+
+
+def filas_en_paralelo(archivo, ruta, tipo_carga, desde_byte, desde_linea, procesos, tamano_tramo):
+    """Lo mismo que filas_preparadas sobre la lectura secuencial, parseando los tramos en `procesos` procesos"""
+    if not desde_byte:
+        desde_linea, desde_byte = localizar_encabezado(filas_csv(archivo), tipo_carga)
+
+    # spawn: los procesos de lectura no heredan las conexiones ni los hilos del trabajador
+    contexto = multiprocessing.get_context('spawn')
+    pool = ProcessPoolExecutor(procesos, mp_context=contexto, initializer=django.setup)
+    pendientes = deque()
+    try:
+        for tramo in dividir_en_tramos(archivo, desde_byte, desde_linea, tamano_tramo):
+            pendientes.append(pool.submit(parsear_tramo, ruta, tipo_carga, *tramo))
+            # Dos tramos adelantados por proceso: el escritor marca el ritmo y la memoria queda acotada
+            if len(pendientes) >= 2 * procesos:
+                yield from _resultado_tramo(pendientes.popleft())
+        while pendientes:
+            yield from _resultado_tramo(pendientes.popleft())
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+
+# ==========================================
+# FUSIÓN CON LOS DATOS EXISTENTES
+# ==========================================
+#
+# Cada fila se identifica por la clave natural (empresa, ejercicio, mercado,
+# instrumento, secuencia): si ya existe se actualizan sus datos y factores en
+# el mismo lugar, si no se inserta. Volver a cargar un archivo corregido (o un
+# año completo) es una sola pasada, sin borrar ni duplicar. Las filas que no
+# cambian no se escriben y se cuentan aparte.
+#
+# En PostgreSQL el lote se copia con COPY a una tabla de paso UNLOGGED
+# (migración 0019) y se aplica con un INSERT ... ON CONFLICT DO UPDATE para
+# las calificaciones y otro para los factores. En otros motores se hace lo
+# mismo con el ORM (una consulta de las existentes, bulk_create y bulk_update).
+
+TABLA_STAGING = 'calificaciones_carga_staging'
+CLAVE_NATURAL = ['empresa_id', 'ejercicio', 'mercado', 'instrumento', 'secuencia_evento']
+RESTRICCION_CLAVE_NATURAL = 'calif_clave_natural'
+COLUMNAS_STAGING = ['usuario_id', 'empresa_id', *CAMPOS_REGISTRO]
+# empaquetado y nulos son columnas generadas: las calcula la base de datos
+COLUMNAS_FACTORES_STAGING = CAMPOS_FACTORES
+# La empresa es la misma para todo el archivo; el resto de la clave sale de cada registro
+CLAVE_REGISTRO = [campo for campo in CLAVE_NATURAL if campo != 'empresa_id']
+_INDICES_CLAVE = [CAMPOS_REGISTRO.index(campo) for campo in CLAVE_REGISTRO]
+_INSTRUMENTO = CAMPOS_REGISTRO.index('instrumento')
+
+# Columnas de cada plantilla que se actualizan en las calificaciones existentes
+CAMPOS_ACTUALIZABLES = {
+    'MONTOS': ['fecha_pago', 'descripcion_dividendo', 'tipo_sociedad', 'valor_historico'],
+    'FACTORES': ['fecha_pago', 'descripcion_dividendo'],
+}
+
+
+@dataclass
+class Fusion:
+    insertadas: list = field(default_factory=list)  # Calificaciones nuevas (con usuario, ejercicio y mercado)
+    actualizadas: int = 0
+    sin_cambios: int = 0
+
+
+def _clave(registro):
+    return tuple(registro[i] for i in _INDICES_CLAVE)
+
+
+def _ultimas_por_clave(lote):
+    """Una fila por clave natural: si el archivo la repite, gana la última línea"""
+    return {_clave(registro): (registro, factores) for _, registro, factores in lote}
+
+
+def _resumen(lote, unicas, insertadas, ids_actualizados):
+    # Las líneas repetidas dentro del lote cuentan como actualizaciones de la anterior
+    repetidas = len(lote) - len(unicas)
+    return Fusion(
+        insertadas=insertadas,
+        actualizadas=len(ids_actualizados) + repetidas,
+        sin_cambios=len(unicas) - len(insertadas) - len(ids_actualizados),
+    )
+
+
+def _fusionar_postgresql(archivo_carga, usuario_id, lote):
+    unicas = _ultimas_por_clave(lote)
+    calificaciones = connection.ops.quote_name(CalificacionTributaria._meta.db_table)
+    factores = connection.ops.quote_name(FactoresCalificacion._meta.db_table)
+    campos = CAMPOS_ACTUALIZABLES[archivo_carga.tipo_carga]
+    parametros = {'archivo': archivo_carga.pk, 'ahora': timezone.now(), 'origen': 'CARGA_MASIVA'}
+
+    with connection.cursor() as cursor:
+        copiar(
+            cursor, TABLA_STAGING, ['archivo_id', *COLUMNAS_STAGING, *COLUMNAS_FACTORES_STAGING],
+            (
+                (archivo_carga.pk, usuario_id, archivo_carga.empresa_id, *registro, *valores)
+                for registro, valores in unicas.values()
+            ),
+        )
+
+        # Solo se reescriben las existentes con algún dato distinto. xmax = 0 identifica las insertadas
+        cursor.execute(
+            f"""
+            INSERT INTO {calificaciones} AS c (
+                {', '.join(COLUMNAS_STAGING)}, acogido_isfut, origen, fecha_creacion, fecha_modificacion
+            )
+            SELECT {', '.join(COLUMNAS_STAGING)}, false, %(origen)s, %(ahora)s, %(ahora)s
+              FROM {TABLA_STAGING}
+             WHERE archivo_id = %(archivo)s
+            ON CONFLICT ON CONSTRAINT {RESTRICCION_CLAVE_NATURAL} DO UPDATE
+               SET {', '.join(f'{campo} = EXCLUDED.{campo}' for campo in campos)},
+                   origen = EXCLUDED.origen, fecha_modificacion = EXCLUDED.fecha_modificacion
+             WHERE ({', '.join(f'c.{campo}' for campo in campos)})
+                   IS DISTINCT FROM ({', '.join(f'EXCLUDED.{campo}' for campo in campos)})
+            RETURNING c.id, c.usuario_id, c.ejercicio, c.mercado, c.xmax = 0
+            """,
+            parametros,
+        )
+        escritas = cursor.fetchall()
+
+        # Los factores se comparan por sus columnas numeric (la copia empaquetada se regenera sola)
+        cursor.execute(
+            f"""
+            INSERT INTO {factores} AS f (calificacion_id, {', '.join(COLUMNAS_FACTORES_STAGING)})
+            SELECT c.id, {', '.join(f's.{columna}' for columna in COLUMNAS_FACTORES_STAGING)}
+              FROM {TABLA_STAGING} s
+              JOIN {calificaciones} c ON {' AND '.join(f'c.{campo} = s.{campo}' for campo in CLAVE_NATURAL)}
+             WHERE s.archivo_id = %(archivo)s
+            ON CONFLICT (calificacion_id) DO UPDATE
+               SET {', '.join(f'{columna} = EXCLUDED.{columna}' for columna in COLUMNAS_FACTORES_STAGING)}
+             WHERE ({', '.join(f'f.{columna}' for columna in COLUMNAS_FACTORES_STAGING)})
+                   IS DISTINCT FROM ({', '.join(f'EXCLUDED.{columna}' for columna in COLUMNAS_FACTORES_STAGING)})
+            RETURNING f.calificacion_id
+            """,
+            parametros,
+        )
+        factores_escritos = {fila[0] for fila in cursor.fetchall()}
+
+        cursor.execute(f'DELETE FROM {TABLA_STAGING} WHERE archivo_id = %(archivo)s', parametros)
+
+    insertadas = [
+        CalificacionTributaria(id=id_, usuario_id=dueno, ejercicio=ejercicio, mercado=mercado)
+        for id_, dueno, ejercicio, mercado, insertada in escritas if insertada
+    ]
+    ids_insertados = {calificacion.id for calificacion in insertadas}
+    ids_actualizados = ({fila[0] for fila in escritas} | factores_escritos) - ids_insertados
+    return _resumen(lote, unicas, insertadas, ids_actualizados)
+
+
+def _fusionar_orm(archivo_carga, usuario_id, lote):
+    unicas = _ultimas_por_clave(lote)
+    campos = CAMPOS_ACTUALIZABLES[archivo_carga.tipo_carga]
+    existentes = {
+        tuple(getattr(calificacion, campo) for campo in CLAVE_REGISTRO): calificacion
+        for calificacion in CalificacionTributaria.objects.filter(
+            empresa_id=archivo_carga.empresa_id,
+            instrumento__in={registro[_INSTRUMENTO] for registro, _ in unicas.values()},
+        ).select_related('factorescalificacion')
+    }
+
+    nuevas, modificadas, factores_nuevos, factores_modificados = [], [], [], []
+    ids_actualizados = set()
+    ahora = timezone.now()
+    for clave, (registro, valores) in unicas.items():
+        datos = dict(zip(CAMPOS_REGISTRO, registro))
+        factores = FactoresCalificacion(**dict(zip(COLUMNAS_FACTORES_STAGING, valores)))
+        existente = existentes.get(clave)
+        if existente is None:
+            calificacion = CalificacionTributaria(
+                usuario_id=usuario_id, empresa_id=archivo_carga.empresa_id, origen='CARGA_MASIVA', **datos,
+            )
+            nuevas.append((calificacion, factores))
+            continue
+
+        if any(getattr(existente, campo) != datos[campo] for campo in campos):
+            for campo in campos:
+                setattr(existente, campo, datos[campo])
+            existente.origen = 'CARGA_MASIVA'
+            existente.fecha_modificacion = ahora
+            modificadas.append(existente)
+            ids_actualizados.add(existente.id)
+
+        anteriores = getattr(existente, 'factorescalificacion', None)
+        factores.calificacion = existente
+        if anteriores is None:
+            factores_nuevos.append(factores)
+            ids_actualizados.add(existente.id)
+        elif [getattr(anteriores, campo) for campo in CAMPOS_FACTORES] != [
+            None if valor is None else Decimal(valor) for valor in valores
+        ]:
+            factores.pk = anteriores.pk
+            factores_modificados.append(factores)
+            ids_actualizados.add(existente.id)
+
+    insertadas = CalificacionTributaria.objects.bulk_create([calificacion for calificacion, _ in nuevas])
+    for calificacion, (_, factores) in zip(insertadas, nuevas):
+        factores.calificacion = calificacion
+    FactoresCalificacion.objects.bulk_create([factores for _, factores in nuevas] + factores_nuevos)
+    if modificadas:
+        CalificacionTributaria.objects.bulk_update(modificadas, [*campos, 'origen', 'fecha_modificacion'])
+    if factores_modificados:
+        FactoresCalificacion.objects.bulk_update(factores_modificados, COLUMNAS_FACTORES_STAGING)
+    return _resumen(lote, unicas, insertadas, ids_actualizados)
+
+
+def _guardar_lote(archivo_carga, usuario_id, lote, resultado, ultima_linea, ultimo_byte):
+    """
+    Fusiona un lote de (numero_linea, registro, factores) de filas preparadas
+    con los datos existentes y, en la misma transacción, deja registrados los
+    contadores y la última línea (y su byte final) confirmada.
+
+    La regla de la suma 8-16 la valida la base de datos (CheckConstraint). Si
+    el lote la viola, la transacción se revierte, se identifican las filas
+    culpables con el kernel vectorial sobre los factores empaquetados, se
+    registran con su número de línea y se reintenta el resto del lote.
+    """
+    try:
+        _fusionar_lote(archivo_carga, usuario_id, lote, resultado, ultima_linea, ultimo_byte)
+    except IntegrityError as e:
+        if not _es_suma_invalida(e):
+            raise
+        validos = validos_empaquetados([empaquetar(valores)[0] for _, _, valores in lote])
+        for (numero_linea, registro, _), valido in zip(lote, validos):
+            if not valido:
+                datos = dict(zip(CAMPOS_REGISTRO, registro))
+                resultado.registrar_error(
+                    numero_linea,
+                    f'la suma de los factores del 8 al 16 no puede ser mayor que 1 '
+                    f'({datos["ejercicio"]} {datos["mercado"]} {datos["instrumento"]}, '
+                    f'secuencia {datos["secuencia_evento"]})',
+                )
+        _fusionar_lote(
+            archivo_carga, usuario_id, [fila for fila, valido in zip(lote, validos) if valido],
+            resultado, ultima_linea, ultimo_byte,
+        )
+
+
+def _fusionar_lote(archivo_carga, usuario_id, lote, resultado, ultima_linea, ultimo_byte):
+    fusion = Fusion()
+    with metricas.DURACION_LOTE.cronometrar(), transaction.atomic():
+        if lote:
+            fusionar = _fusionar_postgresql if connection.vendor == 'postgresql' else _fusionar_orm
+            fusion = fusionar(archivo_carga, usuario_id, lote)
+            # Sin señales: los contadores y las facetas se ajustan al confirmar el lote. Solo cambian con
+            # las altas (una actualización no toca la clave natural ni el usuario)
+            if fusion.insertadas:
+                sumar_calificaciones(fusion.insertadas[0].usuario_id, len(fusion.insertadas))
+                facetas.sumar_calificaciones(fusion.insertadas)
+
+        # Si el archivo ya no está en proceso por este trabajador (el usuario lo canceló,
+        # o se dio por huérfano y lo tomó otro) el lote se revierte
+        confirmado = ArchivoCarga.objects.filter(
+            pk=archivo_carga.pk, estado='PROCESANDO', trabajador=archivo_carga.trabajador,
+        ).update(
+            registros_procesados=resultado.procesados + len(lote),
+            registros_error=resultado.errores,
+            registros_insertados=resultado.insertados + len(fusion.insertadas),
+            registros_actualizados=resultado.actualizados + fusion.actualizadas,
+            registros_sin_cambios=resultado.sin_cambios + fusion.sin_cambios,
+            ultima_linea=ultima_linea,
+            ultimo_byte=ultimo_byte,
+            # Los errores registrados hasta aquí son todos de líneas <= ultima_linea
+            errores_confirmados=resultado.detalle_errores,
+            latido=timezone.now(),
+        )
+        if not confirmado:
+            raise CargaCancelada()
+    metricas.CALIFICACIONES_ESCRITAS.inc(len(fusion.insertadas), operacion='creada', via='carga_masiva')
+    metricas.CALIFICACIONES_ESCRITAS.inc(fusion.actualizadas, operacion='modificada', via='carga_masiva')
+    resultado.procesados += len(lote)
+    resultado.insertados += len(fusion.insertadas)
+    resultado.actualizados += fusion.actualizadas
+    resultado.sin_cambios += fusion.sin_cambios
+
+
+def procesar_archivo(archivo_carga, archivo, usuario, tamano_lote=TAMANO_LOTE, ruta=None, procesos=1):
+    """
+    Procesa un archivo de carga masiva (CSV o libro Excel) fila por fila.
+
+    Las filas válidas se acumulan en lotes de tamaño fijo que se fusionan con
+    los datos existentes (por clave natural) dentro de una transacción por lote.
+    Cada lote deja registrada en ArchivoCarga la última línea confirmada y el
+    byte donde termina, de modo que si el proceso se interrumpe o se cancela,
+    el siguiente intento continúa leyendo desde esa posición (y repetir un
+    lote tampoco duplicaría filas).
+
+    Con `ruta` (el archivo en disco) y procesos > 1, los CSV de más de dos
+    tramos se parsean en paralelo (ver filas_en_paralelo). Los libros Excel
+    se leen en streaming con filas_xlsx y pasan por el mismo escritor.
+    """
+    resultado = ResultadoCarga(
+        procesados=archivo_carga.registros_procesados,
+        errores=archivo_carga.registros_error,
+        insertados=archivo_carga.registros_insertados,
+        actualizados=archivo_carga.registros_actualizados,
+        sin_cambios=archivo_carga.registros_sin_cambios,
+        detalle_errores=list(archivo_carga.errores_confirmados),
+    )
+    ya_confirmadas = archivo_carga.ultima_linea
+    # Los registros anteriores al checkpoint por byte se retoman releyendo desde el comienzo
+    desde_byte = archivo_carga.ultimo_byte if ya_confirmadas else 0
+    desde_linea = ya_confirmadas if desde_byte else 0
+    # Todas las escrituras exigen que el archivo siga reclamado por el mismo trabajador
+    propio = ArchivoCarga.objects.filter(pk=archivo_carga.pk, trabajador=archivo_carga.trabajador)
+    iniciado = propio.filter(estado__in=['PENDIENTE', 'PROCESANDO']).update(estado='PROCESANDO', latido=timezone.now())
+    if not iniciado:
+        resultado.cancelada = True
+        return resultado
+
+    def finalizar(estado):
+        resultado.cancelada = not propio.filter(estado='PROCESANDO').update(
+            estado=estado,
+            registros_procesados=resultado.procesados,
+            registros_error=resultado.errores,
+            registros_insertados=resultado.insertados,
+            registros_actualizados=resultado.actualizados,
+            registros_sin_cambios=resultado.sin_cambios,
+            mensaje_error='\n'.join(resultado.detalle_errores),
+        )
+        return resultado
+
+    usuario_id = usuario.pk if usuario else None
+    tipo_carga = archivo_carga.tipo_carga
+    tamano_tramo = settings.CARGA_MASIVA_TAMANO_TRAMO
+    if es_libro_excel(archivo_carga.nombre_archivo):
+        ancho = len(COLUMNAS_POR_TIPO[tipo_carga]) + len(CAMPOS_FACTORES)
+        filas = filas_preparadas(leer_filas(filas_xlsx(archivo, ancho), tipo_carga), tipo_carga)
+    elif procesos > 1 and ruta and os.path.getsize(ruta) - desde_byte > 2 * tamano_tramo:
+        filas = filas_en_paralelo(archivo, ruta, tipo_carga, desde_byte, desde_linea, procesos, tamano_tramo)
+    else:
+        lectura = leer_filas(filas_csv(archivo, desde_byte, desde_linea), tipo_carga, encabezado_encontrado=bool(desde_byte))
+        filas = filas_preparadas(lectura, tipo_carga)
+
+    lote = []
+    numero_linea, posicion = ya_confirmadas, desde_byte
+    try:
+        for numero_linea, posicion, error, registro, factores in filas:
+            if numero_linea <= ya_confirmadas:
+                continue
+            if error:
+                resultado.registrar_error(numero_linea, error)
+                continue
+
+            lote.append((numero_linea, registro, factores))
+            if len(lote) >= tamano_lote:
+                _guardar_lote(archivo_carga, usuario_id, lote, resultado, numero_linea, posicion)
+                lote = []
+
+        if lote:
+            _guardar_lote(archivo_carga, usuario_id, lote, resultado, numero_linea, posicion)
+    except CargaCancelada:
+        resultado.cancelada = True
+        return resultado
+    except (ErrorFormato, UnicodeDecodeError, csv.Error) as e:
+        resultado.errores += 1
+        resultado.detalle_errores.append(f'Formato de archivo inválido: {e}')
+        return finalizar('ERROR')
+    finally:
+        filas.close()  # Detiene los procesos de lectura si se sale antes de tiempo
+
+    return finalizar('COMPLETADO')
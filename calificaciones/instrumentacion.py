@@ -0,0 +1,187 @@
+import json
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger('calificaciones.sql')
+
+# ==========================================
+# INSTRUMENTACIÓN SQL POR PETICIÓN
+# ==========================================
+#
+# InstrumentacionSQLMiddleware envuelve todas las conexiones con
+# execute_wrapper mientras dura la petición y registra cantidad y tiempo de
+# las consultas, la más lenta y las "formas" de SQL que se repiten (N+1).
+# El resultado sale en la cabecera Server-Timing, en una línea JSON del
+# logger "calificaciones.sql" y en un histograma por vista que se ve en
+# /admin/instrumentacion-sql/. El histograma vive en memoria de cada proceso.
+#
+# Las consultas que se ejecutan mientras se consume una respuesta en
+# streaming (exportar, plantillas) ocurren después y no se cuentan.
+
+# Límites superiores (ms) de los tramos del histograma de duración
+LIMITES_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+LARGO_MAXIMO_SQL = 500
+
+_LISTA_PARAMETROS = re.compile(r'%s(?:\s*,\s*%s)+')
+_GRUPOS_VALORES = re.compile(r'\(%s\.\.\.\)(?:\s*,\s*\(%s\.\.\.\))+')
+_ESPACIOS = re.compile(r'\s+')
+
+
+def forma_sql(sql):
+    """Normaliza una consulta para agrupar las que solo difieren en la cantidad de parámetros"""
+    sql = _LISTA_PARAMETROS.sub('%s...', sql)
+    sql = _GRUPOS_VALORES.sub('(%s...)...', sql)
+    return _ESPACIOS.sub(' ', sql).strip()
+
+
+class RegistroConsultas:
+    """Se instala con connection.execute_wrapper y acumula las consultas de una petición"""
+
+    def __init__(self):
+        self.cantidad = 0
+        self.duracion = 0.0
+        self.mas_lenta = ('', 0.0)
+        self.formas = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duracion = time.perf_counter() - inicio
+            self.cantidad += 1
+            self.duracion += duracion
+            if duracion > self.mas_lenta[1]:
+                self.mas_lenta = (sql, duracion)
+            self.formas[forma_sql(sql)] += 1
+
+    def repetidas(self, umbral):
+        """Formas ejecutadas `umbral` o más veces en la misma petición (probable N+1)"""
+        return [(forma, veces) for forma, veces in self.formas.most_common() if veces >= umbral]
+
+
+# ==========================================
+# HISTOGRAMA POR VISTA
+# ==========================================
+
+class EstadisticaVista:
+    def __init__(self):
+        self.peticiones = 0
+        self.tramos = [0] * (len(LIMITES_MS) + 1)
+        self.duracion_ms = 0.0
+        self.consultas = 0
+        self.consultas_max = 0
+        self.duracion_sql_ms = 0.0
+        self.con_n_mas_1 = 0
+        self.mas_lenta = ('', 0.0)
+
+    def registrar(self, duracion_ms, registro, repetidas):
+        self.peticiones += 1
+        self.tramos[sum(1 for limite in LIMITES_MS if duracion_ms > limite)] += 1
+        self.duracion_ms += duracion_ms
+        self.consultas += registro.cantidad
+        self.consultas_max = max(self.consultas_max, registro.cantidad)
+        self.duracion_sql_ms += registro.duracion * 1000
+        if repetidas:
+            self.con_n_mas_1 += 1
+        sql, segundos = registro.mas_lenta
+        if segundos * 1000 > self.mas_lenta[1]:
+            self.mas_lenta = (sql[:LARGO_MAXIMO_SQL], segundos * 1000)
+
+    def resumen(self, vista):
+        return {
+            'vista': vista,
+            'peticiones': self.peticiones,
+            'tramos': list(self.tramos),
+            'duracion_media_ms': self.duracion_ms / self.peticiones,
+            'consultas_media': self.consultas / self.peticiones,
+            'consultas_max': self.consultas_max,
+            'sql_media_ms': self.duracion_sql_ms / self.peticiones,
+            'sql_total_ms': self.duracion_sql_ms,
+            'con_n_mas_1': self.con_n_mas_1,
+            'mas_lenta_sql': self.mas_lenta[0],
+            'mas_lenta_ms': self.mas_lenta[1],
+        }
+
+
+_estadisticas = {}
+_candado = threading.Lock()
+
+
+def registrar_peticion(vista, duracion_ms, registro, repetidas):
+    with _candado:
+        _estadisticas.setdefault(vista, EstadisticaVista()).registrar(duracion_ms, registro, repetidas)
+
+
+def estadisticas():
+    """Resumen por vista, ordenado por tiempo total en SQL"""
+    with _candado:
+        filas = [estadistica.resumen(vista) for vista, estadistica in _estadisticas.items()]
+    return sorted(filas, key=lambda fila: fila['sql_total_ms'], reverse=True)
+
+
+def reiniciar():
+    with _candado:
+        _estadisticas.clear()
+
+
+# ==========================================
+# MIDDLEWARE
+# ==========================================
+
+def _server_timing(duracion_ms, registro, repetidas):
+    partes = [
+        f'db;dur={registro.duracion * 1000:.2f};desc="{registro.cantidad} consultas"',
+        f'app;dur={duracion_ms:.2f}',
+    ]
+    if registro.cantidad:
+        partes.append(f'sql-lenta;dur={registro.mas_lenta[1] * 1000:.2f}')
+    if repetidas:
+        partes.append(f'n-mas-1;desc="{len(repetidas)} formas repetidas, max {repetidas[0][1]}"')
+    return ', '.join(partes)
+
+
+class InstrumentacionSQLMiddleware:
+    def __init__(self, get_response):
+        if not settings.INSTRUMENTACION_SQL:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.umbral = settings.INSTRUMENTACION_UMBRAL_N_MAS_1
+
+    def __call__(self, request):
+        registro = RegistroConsultas()
+        inicio = time.perf_counter()
+        with ExitStack() as pila:
+            for conexion in connections.all():
+                pila.enter_context(conexion.execute_wrapper(registro))
+            response = self.get_response(request)
+        duracion_ms = (time.perf_counter() - inicio) * 1000
+
+        repetidas = registro.repetidas(self.umbral)
+        coincidencia = getattr(request, 'resolver_match', None)
+        vista = coincidencia.view_name if coincidencia else 'sin_ruta'
+        registrar_peticion(vista, duracion_ms, registro, repetidas)
+
+        response['Server-Timing'] = _server_timing(duracion_ms, registro, repetidas)
+        datos = {
+            'metodo': request.method,
+            'ruta': request.path,
+            'vista': vista,
+            'estado': response.status_code,
+            'duracion_ms': round(duracion_ms, 2),
+            'consultas': registro.cantidad,
+            'sql_ms': round(registro.duracion * 1000, 2),
+            'sql_lenta_ms': round(registro.mas_lenta[1] * 1000, 2),
+            'sql_lenta': registro.mas_lenta[0][:LARGO_MAXIMO_SQL],
+            'n_mas_1': [{'sql': forma[:LARGO_MAXIMO_SQL], 'veces': veces} for forma, veces in repetidas],
+        }
+        logger.log(logging.WARNING if repetidas else logging.INFO, json.dumps(datos, ensure_ascii=False))
+        return response
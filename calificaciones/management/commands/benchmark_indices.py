@@ -0,0 +1,141 @@
+import json
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from calificaciones import contadores
+from calificaciones.models import CalificacionTributaria, Empresa
+
+RUT_BENCHMARK = 'BENCH-INDICES'
+USUARIOS_BENCHMARK = 20
+
+
+class Command(BaseCommand):
+    help = (
+        'Carga datos sintéticos (por defecto 10M calificaciones) y verifica con EXPLAIN ANALYZE '
+        'que los filtros del mantenedor y del panel admin usan índices (solo PostgreSQL)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--filas', type=int, default=10_000_000, help='Calificaciones sintéticas a generar')
+        parser.add_argument('--sin-datos', action='store_true', help='No generar datos, usar los existentes')
+        parser.add_argument('--limpiar', action='store_true', help='Eliminar los datos sintéticos al terminar')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Este benchmark requiere PostgreSQL (pg_trgm y EXPLAIN ANALYZE)')
+
+        usuarios = self._usuarios()
+        empresa, _ = Empresa.objects.get_or_create(rut=RUT_BENCHMARK, defaults={'nombre': 'Empresa Benchmark'})
+
+        if not options['sin_datos']:
+            self._generar(empresa, usuarios, options['filas'])
+
+        usuario = usuarios[0]
+        consultas = {
+            'mantenedor (usuario)':
+                CalificacionTributaria.objects.filter(usuario=usuario),
+            'mantenedor (usuario + ejercicio)':
+                CalificacionTributaria.objects.filter(usuario=usuario, ejercicio=2020),
+            'mantenedor (usuario + mercado icontains)':
+                CalificacionTributaria.objects.filter(usuario=usuario, mercado__icontains='DERIV'),
+            'mantenedor (usuario + instrumento icontains)':
+                CalificacionTributaria.objects.filter(usuario=usuario, instrumento__icontains='a1b2'),
+            'admin (todas)':
+                CalificacionTributaria.objects.all(),
+            'admin (ejercicio)':
+                CalificacionTributaria.objects.filter(ejercicio=2020),
+            'admin (usuario_id)':
+                CalificacionTributaria.objects.filter(usuario_id=usuarios[1].id),
+            'admin (mercado icontains)':
+                CalificacionTributaria.objects.filter(mercado__icontains='DERIV'),
+            'admin (instrumento icontains, sin orden)':
+                CalificacionTributaria.objects.filter(instrumento__icontains='a1b2c'),
+        }
+
+        tabla = CalificacionTributaria._meta.db_table
+        fallidas = []
+        for nombre, queryset in consultas.items():
+            if 'sin orden' not in nombre:
+                # Misma forma que la paginación por cursor del listado
+                queryset = queryset.order_by('-fecha_pago', '-id')[:51]
+            plan = json.loads(queryset.explain(format='json', analyze=True))
+            if isinstance(plan, list):
+                plan = plan[0]
+
+            nodos = list(self._nodos(plan['Plan']))
+            indices = sorted({n['Index Name'] for n in nodos if 'Index Name' in n})
+            secuencial = any(n['Node Type'] == 'Seq Scan' and n.get('Relation Name') == tabla for n in nodos)
+
+            estado = self.style.ERROR('SEQ SCAN') if secuencial else self.style.SUCCESS('OK')
+            self.stdout.write(
+                f"{estado} {nombre}: {plan['Execution Time']:.1f} ms - índices: {', '.join(indices) or '-'}"
+            )
+            if secuencial:
+                fallidas.append(nombre)
+
+        if options['limpiar']:
+            self.stdout.write('🧹 Eliminando datos sintéticos...')
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'DELETE FROM {CalificacionTributaria._meta.db_table} WHERE empresa_id = %s', [empresa.id]
+                )
+            empresa.delete()
+            User.objects.filter(username__startswith='benchmark_indices_').delete()
+            # Las filas se borraron con SQL directo, sin señales
+            contadores.recalcular()
+
+        if fallidas:
+            raise CommandError(f'Consultas con recorrido secuencial: {", ".join(fallidas)}')
+        self.stdout.write(self.style.SUCCESS('✅ Todas las consultas de filtro usan índices'))
+
+    def _usuarios(self):
+        usuarios = []
+        for i in range(USUARIOS_BENCHMARK):
+            usuario, _ = User.objects.get_or_create(username=f'benchmark_indices_{i}')
+            usuarios.append(usuario)
+        return usuarios
+
+    def _generar(self, empresa, usuarios, filas):
+        """Inserta las filas directamente en SQL con generate_series (mucho más rápido que el ORM)"""
+        self.stdout.write(f'⏳ Generando {filas} calificaciones sintéticas...')
+        inicio = time.perf_counter()
+        ids_usuarios = [u.id for u in usuarios]
+        tabla = CalificacionTributaria._meta.db_table
+        with connection.cursor() as cursor:
+            # Sin --limpiar quedan las filas de la corrida anterior: la secuencia continúa
+            # desde la última para no chocar con la clave natural (empresa, ..., secuencia_evento)
+            cursor.execute(f'SELECT COALESCE(MAX(secuencia_evento), 0) FROM {tabla} WHERE empresa_id = %s', [empresa.id])
+            desde, = cursor.fetchone()
+            cursor.execute(
+                f'''
+                INSERT INTO {tabla}
+                    (usuario_id, empresa_id, ejercicio, mercado, instrumento, fecha_pago,
+                     secuencia_evento, acogido_isfut, origen, fecha_creacion, fecha_modificacion)
+                SELECT
+                    (%s::bigint[])[1 + (i %% %s)],
+                    %s,
+                    2015 + (i %% 10),
+                    (ARRAY['ACN', 'CFI', 'FONDOS', 'DERIVADOS'])[1 + (i %% 4)],
+                    'INSTR_' || md5((%s + i)::text),
+                    DATE '2015-01-01' + (i %% 3650),
+                    %s + i,
+                    false,
+                    'SISTEMA',
+                    now(),
+                    now()
+                FROM generate_series(1, %s) AS i
+                ''',
+                [ids_usuarios, len(ids_usuarios), empresa.id, desde, desde, filas],
+            )
+            cursor.execute(f'ANALYZE {tabla}')
+        # El INSERT directo no pasa por las señales que mantienen los contadores
+        contadores.recalcular()
+        self.stdout.write(f'   listo en {time.perf_counter() - inicio:.1f}s')
+
+    def _nodos(self, nodo):
+        yield nodo
+        for hijo in nodo.get('Plans', []):
+            yield from self._nodos(hijo)
@@ -0,0 +1,103 @@
+import time
+from unittest import mock
+
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.hashers import get_hasher
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from calificaciones.backends import EmailOUsuarioBackend
+
+USUARIO_BENCHMARK = 'benchmark_login'
+EMAIL_BENCHMARK = 'Benchmark.Login@nuamcapital.cl'
+CLAVE_BENCHMARK = 'clave-benchmark-123'
+INDICE_EMAIL = 'auth_user_email_ci_uniq'  # Migración 0014
+
+
+def login_anterior(identificador, clave):
+    """Flujo previo de login_view: authenticate por username y, si falla, buscar por email y repetir"""
+    backend = ModelBackend()
+    usuario = backend.authenticate(None, username=identificador, password=clave)
+    if usuario is None:
+        try:
+            por_email = User.objects.get(email=identificador)
+            usuario = backend.authenticate(None, username=por_email.username, password=clave)
+        except User.DoesNotExist:
+            pass
+    return usuario
+
+
+def login_nuevo(identificador, clave):
+    return EmailOUsuarioBackend().authenticate(None, username=identificador, password=clave)
+
+
+class Command(BaseCommand):
+    help = 'Compara el CPU por intento de login entre el flujo anterior (dos hashes) y EmailOUsuarioBackend'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeticiones', type=int, default=20, help='Intentos por escenario')
+
+    def handle(self, *args, **options):
+        usuario, _ = User.objects.get_or_create(username=USUARIO_BENCHMARK, defaults={'email': EMAIL_BENCHMARK})
+        usuario.email = EMAIL_BENCHMARK
+        usuario.set_password(CLAVE_BENCHMARK)
+        usuario.save()
+
+        escenarios = {
+            'username correcto': (USUARIO_BENCHMARK, CLAVE_BENCHMARK),
+            'email correcto': (EMAIL_BENCHMARK, CLAVE_BENCHMARK),
+            'email con clave incorrecta': (EMAIL_BENCHMARK, 'incorrecta'),
+            'usuario inexistente': ('nadie@nuamcapital.cl', 'incorrecta'),
+        }
+
+        # Cuenta las ejecuciones del hasher (verificar y generar hashes pasan por encode)
+        hasher = type(get_hasher())
+        llamadas = []
+        encode_original = hasher.encode
+
+        def encode_contado(self, *a, **k):
+            llamadas.append(1)
+            return encode_original(self, *a, **k)
+
+        repeticiones = options['repeticiones']
+        self.stdout.write(f'🔐 Hasher: {hasher.algorithm} - {repeticiones} intentos por escenario')
+        try:
+            self.medir_busqueda(repeticiones)
+            with mock.patch.object(hasher, 'encode', encode_contado):
+                for nombre, (identificador, clave) in escenarios.items():
+                    resultados = {}
+                    for etiqueta, funcion in [('anterior', login_anterior), ('nuevo', login_nuevo)]:
+                        llamadas.clear()
+                        inicio = time.process_time()
+                        for _ in range(repeticiones):
+                            funcion(identificador, clave)
+                        cpu_ms = (time.process_time() - inicio) * 1000 / repeticiones
+                        resultados[etiqueta] = (cpu_ms, len(llamadas) / repeticiones)
+
+                    (cpu_antes, hashes_antes), (cpu_ahora, hashes_ahora) = resultados['anterior'], resultados['nuevo']
+                    self.stdout.write(
+                        f'   {nombre}: {cpu_antes:.1f} ms CPU ({hashes_antes:g} hash) → '
+                        f'{cpu_ahora:.1f} ms CPU ({hashes_ahora:g} hash)'
+                    )
+        finally:
+            usuario.delete()
+
+        self.stdout.write(self.style.SUCCESS('✅ Benchmark terminado'))
+
+    def medir_busqueda(self, repeticiones):
+        """Tiempo de la consulta que resuelve el usuario por email y si usa el índice de la migración 0014"""
+        backend = EmailOUsuarioBackend()
+        identificador = EMAIL_BENCHMARK.upper()
+        inicio = time.perf_counter()
+        for _ in range(repeticiones):
+            backend.buscar_usuario(identificador)
+        ms = (time.perf_counter() - inicio) * 1000 / repeticiones
+
+        detalle = ''
+        if connection.vendor == 'postgresql':
+            plan = backend.consulta_usuario(identificador).explain()
+            detalle = f' - índice {INDICE_EMAIL}: {"sí" if INDICE_EMAIL in plan else "no (recorrido secuencial)"}'
+        self.stdout.write(
+            f'🔎 Búsqueda por email entre {User.objects.count()} usuarios: {ms:.2f} ms por consulta{detalle}'
+        )
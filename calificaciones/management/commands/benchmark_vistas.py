@@ -0,0 +1,271 @@
+import json
+import platform
+import random
+import statistics
+import time
+import tracemalloc
+from datetime import date, timedelta
+from decimal import Decimal
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from calificaciones import contadores, facetas
+from calificaciones.factores import CAMPOS_FACTORES
+from calificaciones.models import CalificacionTributaria, Empresa, FactoresCalificacion
+
+PREFIJO_USUARIOS = 'benchmark_vistas_'
+RUT_BENCHMARK = 'BENCH-VISTAS'
+MERCADOS = ['ACN', 'CFI', 'FONDOS', 'DERIVADOS']
+TAMANO_LOTE = 2000
+
+# (nombre, url, parámetros GET, usa el usuario administrador)
+VISTAS = [
+    ('home', 'calificaciones:home', {}, False),
+    ('mantenedor', 'calificaciones:mantenedor', {}, False),
+    ('mantenedor_filtrado', 'calificaciones:mantenedor', {'ejercicio': 2020, 'mercado': 'ACN', 'instrumento': 'BENCH_1'}, False),
+    ('mantenedor_json', 'calificaciones:mantenedor', {'formato': 'json', 'tamano': 200}, False),
+    ('admin_calificaciones', 'calificaciones:admin_calificaciones', {}, True),
+    ('admin_calificaciones_filtrado', 'calificaciones:admin_calificaciones', {'ejercicio': 2020, 'mercado': 'ACN'}, True),
+    ('admin_users', 'calificaciones:admin_users', {}, True),
+    ('exportar', 'calificaciones:exportar', {}, False),
+    ('plantilla_montos', 'calificaciones:descargar_plantilla_montos', {}, False),
+    ('plantilla_factores', 'calificaciones:descargar_plantilla_factores', {}, False),
+]
+
+
+def percentil(valores, p):
+    """Percentil con interpolación lineal (valores ya medidos, en cualquier orden)"""
+    ordenados = sorted(valores)
+    if len(ordenados) == 1:
+        return ordenados[0]
+    posicion = (len(ordenados) - 1) * p / 100
+    inferior = int(posicion)
+    superior = min(inferior + 1, len(ordenados) - 1)
+    return ordenados[inferior] + (ordenados[superior] - ordenados[inferior]) * (posicion - inferior)
+
+
+class Command(BaseCommand):
+    help = (
+        'Siembra datos sintéticos y mide las vistas principales (latencia p50/p95, consultas SQL, '
+        'memoria pico). Guarda los resultados en JSON y puede compararlos con una ejecución anterior'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calificaciones', type=int, default=10000, help='Calificaciones sintéticas a sembrar')
+        parser.add_argument('--usuarios', type=int, default=5, help='Usuarios entre los que se reparten')
+        parser.add_argument('--repeticiones', type=int, default=20, help='Peticiones medidas por vista')
+        parser.add_argument('--semilla', type=int, default=1948, help='Semilla de los datos generados')
+        parser.add_argument('--salida', default='benchmark_vistas.json', help='Archivo JSON de resultados')
+        parser.add_argument('--comparar', help='JSON de una ejecución anterior para detectar regresiones')
+        parser.add_argument(
+            '--tolerancia', type=float, default=20,
+            help='Aumento porcentual de p95 aceptado antes de marcar una regresión',
+        )
+        parser.add_argument('--vistas', nargs='*', help='Medir solo estas vistas (por nombre)')
+        parser.add_argument('--limpiar', action='store_true', help='Eliminar los datos sintéticos y terminar')
+
+    def handle(self, *args, **options):
+        if options['limpiar']:
+            self._limpiar()
+            return
+
+        vistas = VISTAS
+        if options['vistas']:
+            desconocidas = set(options['vistas']) - {nombre for nombre, *_ in VISTAS}
+            if desconocidas:
+                raise CommandError(f'Vistas desconocidas: {", ".join(sorted(desconocidas))}')
+            vistas = [v for v in VISTAS if v[0] in options['vistas']]
+
+        usuarios = self._usuarios(options['usuarios'])
+        self._sembrar(usuarios, options['calificaciones'], options['semilla'])
+
+        clientes = {False: Client(), True: Client()}
+        clientes[False].force_login(usuarios[1])
+        clientes[True].force_login(usuarios[0])
+
+        resultados = {}
+        # El cliente de pruebas usa el host "testserver"
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for nombre, url, parametros, es_admin in vistas:
+                resultados[nombre] = self._medir(
+                    clientes[es_admin], reverse(url), parametros, options['repeticiones']
+                )
+                r = resultados[nombre]
+                self.stdout.write(
+                    f"   {nombre}: p50={r['p50_ms']:.1f} ms p95={r['p95_ms']:.1f} ms "
+                    f"consultas={r['consultas']} memoria={r['memoria_pico_kb']:.0f} KB"
+                    + ('' if r['estado'] == 200 else self.style.ERROR(f" HTTP {r['estado']}"))
+                )
+
+        informe = {
+            'fecha': timezone.now().isoformat(),
+            'motor': connection.vendor,
+            'django': django.get_version(),
+            'python': platform.python_version(),
+            'volumen': {
+                'calificaciones': options['calificaciones'],
+                'usuarios': options['usuarios'],
+                'repeticiones': options['repeticiones'],
+            },
+            'vistas': resultados,
+        }
+        with open(options['salida'], 'w', encoding='utf-8') as archivo:
+            json.dump(informe, archivo, indent=2, ensure_ascii=False)
+        self.stdout.write(self.style.SUCCESS(f"✅ Resultados guardados en {options['salida']}"))
+
+        if options['comparar']:
+            self._comparar(options['comparar'], informe, options['tolerancia'])
+
+    # ==========================================
+    # DATOS SINTÉTICOS
+    # ==========================================
+
+    def _usuarios(self, cantidad):
+        usuarios = []
+        for i in range(max(cantidad, 2)):
+            usuario, _ = User.objects.get_or_create(username=f'{PREFIJO_USUARIOS}{i}')
+            usuarios.append(usuario)
+        # El primero es administrador (paneles de gestión); el resto son usuarios normales.
+        # Se guarda por la instancia cacheada: save_user_profile la vuelve a guardar en cada login
+        perfil = usuarios[0].profile
+        if perfil.rol != 'ADMIN':
+            perfil.rol = 'ADMIN'
+            perfil.save()
+        return usuarios
+
+    def _sembrar(self, usuarios, total, semilla):
+        """Completa hasta `total` calificaciones sintéticas (no duplica si ya existen)"""
+        empresa, _ = Empresa.objects.get_or_create(rut=RUT_BENCHMARK, defaults={'nombre': 'Empresa Benchmark'})
+        existentes = CalificacionTributaria.objects.filter(empresa=empresa).count()
+        faltantes = total - existentes
+        if faltantes <= 0:
+            self.stdout.write(f'📦 Usando {existentes} calificaciones sintéticas existentes')
+            return
+
+        self.stdout.write(f'⏳ Sembrando {faltantes} calificaciones sintéticas...')
+        inicio = time.perf_counter()
+        azar = random.Random(semilla + existentes)
+        for desde in range(existentes, total, TAMANO_LOTE):
+            hasta = min(desde + TAMANO_LOTE, total)
+            calificaciones, factores = [], []
+            for n in range(desde, hasta):
+                usuario = usuarios[n % len(usuarios)]
+                calificaciones.append(CalificacionTributaria(
+                    usuario=usuario,
+                    empresa=empresa,
+                    ejercicio=2015 + n % 10,
+                    mercado=MERCADOS[n % len(MERCADOS)],
+                    instrumento=f'BENCH_{n}',
+                    fecha_pago=date(2015, 1, 1) + timedelta(days=azar.randrange(3650)),
+                    secuencia_evento=10000 + n,
+                    origen='SISTEMA',
+                ))
+                valores = [Decimal(azar.randrange(0, 11_000_000)).scaleb(-8) for _ in CAMPOS_FACTORES]
+                factores.append(FactoresCalificacion(**dict(zip(CAMPOS_FACTORES, valores))))
+
+            with transaction.atomic():
+                creadas = CalificacionTributaria.objects.bulk_create(calificaciones)
+                for calificacion, factor in zip(creadas, factores):
+                    factor.calificacion = calificacion
+                FactoresCalificacion.objects.bulk_create(factores)
+                # bulk_create no dispara las señales de los contadores ni de las facetas
+                for usuario in usuarios:
+                    contadores.sumar_calificaciones(
+                        usuario.id, sum(1 for c in creadas if c.usuario_id == usuario.id)
+                    )
+                facetas.sumar_calificaciones(creadas)
+        self.stdout.write(f'   listo en {time.perf_counter() - inicio:.1f}s')
+
+    def _limpiar(self):
+        empresa = Empresa.objects.filter(rut=RUT_BENCHMARK).first()
+        if empresa:
+            calificaciones = CalificacionTributaria.objects.filter(empresa=empresa)
+            # Borrado directo (sin cargar millones de objetos); los contadores se recalculan al final
+            FactoresCalificacion.objects.filter(calificacion__empresa=empresa)._raw_delete(connection.alias)
+            calificaciones._raw_delete(connection.alias)
+            empresa.delete()
+        User.objects.filter(username__startswith=PREFIJO_USUARIOS).delete()
+        contadores.recalcular()
+        self.stdout.write(self.style.SUCCESS('🧹 Datos sintéticos eliminados'))
+
+    # ==========================================
+    # MEDICIÓN
+    # ==========================================
+
+    def _pedir(self, cliente, url, parametros):
+        respuesta = cliente.get(url, parametros)
+        # Las respuestas en streaming se consumen completas para medir el costo real
+        if respuesta.streaming:
+            tamano = sum(len(parte) for parte in respuesta.streaming_content)
+        else:
+            tamano = len(respuesta.content)
+        return respuesta, tamano
+
+    def _medir(self, cliente, url, parametros, repeticiones):
+        respuesta, tamano = self._pedir(cliente, url, parametros)  # Calentamiento
+
+        with CaptureQueriesContext(connection) as capturadas:
+            self._pedir(cliente, url, parametros)
+        # Se cuenta ya: cada petición nueva limpia connection.queries (señal request_started)
+        consultas = len(capturadas)
+
+        tracemalloc.start()
+        try:
+            tracemalloc.reset_peak()
+            self._pedir(cliente, url, parametros)
+            _, memoria_pico = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        tiempos = []
+        for _ in range(max(repeticiones, 1)):
+            inicio = time.perf_counter()
+            self._pedir(cliente, url, parametros)
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+
+        return {
+            'url': url,
+            'parametros': parametros,
+            'estado': respuesta.status_code,
+            'bytes': tamano,
+            'consultas': consultas,
+            'p50_ms': round(percentil(tiempos, 50), 3),
+            'p95_ms': round(percentil(tiempos, 95), 3),
+            'media_ms': round(statistics.fmean(tiempos), 3),
+            'memoria_pico_kb': round(memoria_pico / 1024, 1),
+        }
+
+    def _comparar(self, ruta, informe, tolerancia):
+        with open(ruta, encoding='utf-8') as archivo:
+            anterior = json.load(archivo)
+
+        self.stdout.write(f'📊 Comparación con {ruta} ({anterior.get("fecha", "?")})')
+        if anterior.get('volumen') != informe['volumen'] or anterior.get('motor') != informe['motor']:
+            self.stdout.write(self.style.WARNING('⚠️ Volumen o motor distinto al de la ejecución anterior'))
+        regresiones = []
+        for nombre, actual in informe['vistas'].items():
+            previo = anterior.get('vistas', {}).get(nombre)
+            if not previo:
+                continue
+            cambio = (actual['p95_ms'] - previo['p95_ms']) / previo['p95_ms'] * 100 if previo['p95_ms'] else 0
+            mas_consultas = actual['consultas'] > previo['consultas']
+            regresion = cambio > tolerancia or mas_consultas
+            linea = (
+                f"   {nombre}: p95 {previo['p95_ms']:.1f} → {actual['p95_ms']:.1f} ms ({cambio:+.0f}%), "
+                f"consultas {previo['consultas']} → {actual['consultas']}"
+            )
+            self.stdout.write(self.style.ERROR(linea) if regresion else linea)
+            if regresion:
+                regresiones.append(nombre)
+
+        if regresiones:
+            raise CommandError(f'Regresiones detectadas en: {", ".join(regresiones)}')
+        self.stdout.write(self.style.SUCCESS('✅ Sin regresiones'))
@@ -0,0 +1,23 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from calificaciones.models import TokenAPI
+
+
+class Command(BaseCommand):
+    help = 'Crea un token para la API por lotes (/api/v1/) a nombre de un usuario'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usuario', help='Nombre de usuario dueño del token')
+        parser.add_argument('--nombre', default='API', help='Descripción del sistema que usará el token')
+
+    def handle(self, *args, **options):
+        try:
+            usuario = User.objects.get(username=options['usuario'])
+        except User.DoesNotExist:
+            raise CommandError(f"No existe el usuario {options['usuario']}")
+
+        registro, token = TokenAPI.crear(usuario, options['nombre'])
+        self.stdout.write(self.style.SUCCESS(f'✅ Token "{registro.nombre}" creado para {usuario.username}'))
+        self.stdout.write(f'   Token: {token}')
+        self.stdout.write(self.style.WARNING('⚠️ Guárdalo ahora: no se puede volver a mostrar'))
@@ -0,0 +1,44 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from calificaciones import correo
+from calificaciones.models import CorreoSaliente
+
+
+class Command(BaseCommand):
+    help = 'Entrega los correos de la bandeja de salida (MFA, recuperación de contraseña) por SMTP'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--intervalo', type=float, default=1,
+            help='Segundos de espera cuando la cola está vacía',
+        )
+        parser.add_argument(
+            '--lote', type=int, default=settings.CORREO_LOTE,
+            help='Correos reclamados por vuelta (se envían por la misma conexión SMTP)',
+        )
+        parser.add_argument(
+            '--una-vez', action='store_true',
+            help='Envía lo pendiente y termina',
+        )
+        parser.add_argument(
+            '--purgar-dias', type=int,
+            help='Antes de empezar, eliminar los correos ENVIADO con más de N días',
+        )
+
+    def handle(self, *args, **options):
+        if options['purgar_dias'] is not None:
+            limite = timezone.now() - timedelta(days=options['purgar_dias'])
+            eliminados, _ = CorreoSaliente.objects.filter(estado='ENVIADO', fecha_envio__lt=limite).delete()
+            self.stdout.write(f'🧹 {eliminados} correo(s) enviados eliminados')
+
+        self.stdout.write(f'📧 Enviando correos por {settings.EMAIL_HOST}:{settings.EMAIL_PORT}')
+        total = correo.ciclo_envio(
+            una_vez=options['una_vez'],
+            intervalo=options['intervalo'],
+            tamano_lote=options['lote'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'✅ {total} correo(s) enviado(s)'))
@@ -0,0 +1,86 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from calificaciones import sinteticos
+
+
+class Command(BaseCommand):
+    help = (
+        'Genera datos sintéticos a escala de producción (empresas, usuarios, calificaciones y factores) '
+        'con una semilla fija. En PostgreSQL inserta con COPY desde varios procesos en paralelo'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calificaciones', type=int, default=1_000_000, help='Calificaciones a generar')
+        parser.add_argument('--empresas', type=int, default=2000, help='Empresas a generar')
+        parser.add_argument('--usuarios', type=int, default=50, help='Usuarios dueños de las empresas')
+        parser.add_argument('--semilla', type=int, default=2024, help='Semilla (mismos datos en cada ejecución)')
+        parser.add_argument(
+            '--trabajadores', type=int, default=min(os.cpu_count() or 1, 8),
+            help='Procesos de inserción en paralelo (solo PostgreSQL; en otros motores se usa 1)',
+        )
+        parser.add_argument('--limpiar', action='store_true', help='Eliminar los datos sintéticos y terminar')
+
+    def handle(self, *args, **options):
+        if options['limpiar']:
+            sinteticos.limpiar()
+            self.stdout.write(self.style.SUCCESS('🧹 Datos sintéticos eliminados'))
+            return
+
+        if sinteticos.existen_datos():
+            raise CommandError('Ya existen datos sintéticos; ejecuta primero con --limpiar')
+        if options['empresas'] < 1 or options['usuarios'] < 1:
+            raise CommandError('Se necesita al menos una empresa y un usuario')
+
+        total = options['calificaciones']
+        trabajadores = options['trabajadores'] if connection.vendor == 'postgresql' else 1
+        inicio = time.perf_counter()
+
+        self.stdout.write(f"👥 Creando {options['usuarios']} usuarios y {options['empresas']} empresas...")
+        usuarios = sinteticos.crear_usuarios(options['usuarios'])
+        empresas, duenos = sinteticos.crear_empresas(options['empresas'], usuarios, options['semilla'])
+
+        plan = sinteticos.Plan(
+            semilla=options['semilla'],
+            total=total,
+            id_inicial=sinteticos.reservar_ids(total),
+            empresas=empresas,
+            duenos=duenos,
+            pesos_empresas=sinteticos.pesos_zipf(len(empresas)),
+        )
+        self.stdout.write(
+            f'⏳ Insertando {total} calificaciones en {len(plan.bloques)} bloques '
+            f'con {trabajadores} trabajador(es)...'
+        )
+
+        insertadas = 0
+        if trabajadores == 1:
+            for bloque in plan.bloques:
+                insertadas += sinteticos.insertar_bloque(plan, bloque)
+                self._progreso(insertadas, total, inicio)
+        else:
+            # Los hijos abren sus propias conexiones; no deben heredar las del padre
+            connections.close_all()
+            contexto = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(trabajadores, mp_context=contexto, initializer=django.setup) as pool:
+                pendientes = [pool.submit(sinteticos.insertar_bloque, plan, bloque) for bloque in plan.bloques]
+                for futuro in as_completed(pendientes):
+                    insertadas += futuro.result()
+                    self._progreso(insertadas, total, inicio)
+
+        self.stdout.write('📊 Recalculando contadores...')
+        sinteticos.finalizar()
+        duracion = time.perf_counter() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ {insertadas} calificaciones generadas en {duracion:.1f}s ({insertadas / duracion:,.0f} filas/s)'
+        ))
+
+    def _progreso(self, insertadas, total, inicio):
+        if insertadas % (sinteticos.TAMANO_BLOQUE * 10) == 0 or insertadas == total:
+            self.stdout.write(f'   {insertadas}/{total} ({time.perf_counter() - inicio:.0f}s)')
@@ -0,0 +1,51 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from calificaciones import cola
+
+
+def _proceso_trabajador(una_vez, intervalo):
+    # Cada proceso del pool necesita Django configurado y su propia conexión
+    import django
+    django.setup()
+    connections.close_all()
+    return cola.ciclo_trabajador(una_vez=una_vez, intervalo=intervalo)
+
+
+class Command(BaseCommand):
+    help = 'Procesa en segundo plano los archivos de carga masiva pendientes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--procesos', type=int, default=settings.CARGA_MASIVA_PROCESOS,
+            help='Cantidad de procesos trabajadores',
+        )
+        parser.add_argument(
+            '--intervalo', type=float, default=5,
+            help='Segundos de espera cuando la cola está vacía',
+        )
+        parser.add_argument(
+            '--una-vez', action='store_true',
+            help='Procesa lo pendiente y termina',
+        )
+
+    def handle(self, *args, **options):
+        procesos = max(options['procesos'], 1)
+        una_vez = options['una_vez']
+        intervalo = options['intervalo']
+
+        self.stdout.write(f'🚀 Iniciando {procesos} trabajador(es) de carga masiva')
+
+        if procesos == 1:
+            total = cola.ciclo_trabajador(una_vez=una_vez, intervalo=intervalo)
+        else:
+            # No compartir la conexión del proceso padre con los hijos
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=procesos) as pool:
+                tareas = [pool.submit(_proceso_trabajador, una_vez, intervalo) for _ in range(procesos)]
+                total = sum(tarea.result() for tarea in tareas)
+
+        self.stdout.write(self.style.SUCCESS(f'✅ {total} archivo(s) procesado(s)'))
@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from calificaciones import contadores
+from calificaciones.models import Contador
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye desde cero los contadores materializados de los paneles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verificar', action='store_true', help='Solo mostrar diferencias, sin corregir')
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        reales = contadores.calcular()
+        guardados = dict(Contador.objects.values_list('clave', 'valor'))
+        diferencias = {
+            clave: (guardados.get(clave, 0), reales.get(clave, 0))
+            for clave in guardados.keys() | reales.keys()
+            if guardados.get(clave, 0) != reales.get(clave, 0)
+        }
+
+        for clave, (guardado, real) in sorted(diferencias.items()):
+            self.stdout.write(f'   {clave}: {guardado} → {real}')
+
+        if options['verificar']:
+            if diferencias:
+                self.stdout.write(self.style.ERROR(f'❌ {len(diferencias)} contadores desfasados'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'✅ {len(reales)} contadores al día'))
+            return
+
+        contadores.recalcular()
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ {len(reales)} contadores recalculados ({len(diferencias)} corregidos) '
+            f'en {time.perf_counter() - inicio:.2f}s'
+        ))
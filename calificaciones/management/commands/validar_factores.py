@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from calificaciones.factores import a_decimal, analizar_queryset
+from calificaciones.models import FactoresCalificacion
+
+
+class Command(BaseCommand):
+    help = 'Valida en bloque la regla Σ(factores 8-16) ≤ 1 y muestra estadísticas por factor'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ejercicio', type=int, help='Filtrar por ejercicio fiscal')
+        parser.add_argument('--usuario', type=int, help='Filtrar por id de usuario')
+        parser.add_argument('--limite', type=int, default=20, help='Cantidad de filas inválidas a listar')
+
+    def handle(self, *args, **options):
+        factores = FactoresCalificacion.objects.all()
+        if options['ejercicio']:
+            factores = factores.filter(calificacion__ejercicio=options['ejercicio'])
+        if options['usuario']:
+            factores = factores.filter(calificacion__usuario_id=options['usuario'])
+
+        inicio = time.perf_counter()
+        resumen = analizar_queryset(factores)
+        duracion = time.perf_counter() - inicio
+
+        total = len(resumen.ids)
+        invalidos = resumen.ids_invalidos
+        self.stdout.write(f'📊 {total} registros analizados en {duracion:.2f}s')
+
+        for fila in resumen.estadisticas():
+            if fila['cantidad']:
+                # Formato 'f': Decimal muestra los valores pequeños en notación científica (6.7E-7)
+                self.stdout.write(
+                    f"   factor_{fila['factor']}: n={fila['cantidad']} "
+                    f"min={fila['minimo']:f} max={fila['maximo']:f} promedio={fila['promedio']:f}"
+                )
+
+        if not len(invalidos):
+            self.stdout.write(self.style.SUCCESS('✅ Todos los registros cumplen Σ(factores 8-16) ≤ 1'))
+            return
+
+        self.stdout.write(self.style.ERROR(f'❌ {len(invalidos)} registros con Σ(factores 8-16) > 1'))
+        sumas_invalidas = resumen.sumas_8_16[~resumen.validos]
+        for factor_id, suma in zip(invalidos[:options['limite']].tolist(), sumas_invalidas.tolist()):
+            self.stdout.write(f'   FactoresCalificacion #{factor_id}: suma = {a_decimal(suma):f}')
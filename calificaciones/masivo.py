@@ -0,0 +1,102 @@
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from . import contadores, facetas, metricas
+from .models import CalificacionTributaria, FactoresCalificacion
+
+# ==========================================
+# OPERACIONES MASIVAS DEL MANTENEDOR
+# ==========================================
+#
+# Eliminan o modifican todas las calificaciones de un queryset (el filtro
+# actual del mantenedor o las filas marcadas) con UPDATE/DELETE de conjunto,
+# por bloques de MASIVO_TAMANO_BLOQUE ids, cada bloque en su propia
+# transacción. Se recorre por id ascendente hasta el id máximo que había al
+# empezar, así las filas insertadas durante la operación no se alcanzan.
+#
+# Los factores se borran con un DELETE por bloque antes que sus calificaciones
+# (sin el recolector de cascadas de Django, que carga cada fila en Python), por
+# lo que no se disparan señales: contadores, facetas y métricas se ajustan aquí.
+#
+# Las funciones son generadores que entregan la cantidad de filas procesadas
+# después de cada bloque, para informar el avance mientras se ejecutan.
+
+# Campos que se pueden modificar en bloque (no afectan facetas, contadores ni la búsqueda)
+CAMPOS_EDITABLES = ['origen', 'acogido_isfut', 'tipo_sociedad']
+CAMPOS_BLOQUE = ['id', 'usuario_id', 'ejercicio', 'mercado']
+
+
+def preparar(queryset):
+    """Fija el alcance de la operación. Devuelve (queryset acotado por id, total de filas)"""
+    hasta_id = queryset.aggregate(maximo=Max('id'))['maximo']
+    if hasta_id is None:
+        return queryset.none(), 0
+    acotado = queryset.filter(id__lte=hasta_id)
+    return acotado, acotado.count()
+
+
+def _bloques(queryset):
+    """Bloques de calificaciones (solo los campos de CAMPOS_BLOQUE) en orden de id"""
+    tamano = settings.MASIVO_TAMANO_BLOQUE
+    desde_id = 0
+    while True:
+        bloque = list(queryset.filter(id__gt=desde_id).order_by('id').only(*CAMPOS_BLOQUE)[:tamano])
+        if not bloque:
+            return
+        yield bloque
+        desde_id = bloque[-1].id
+
+
+def limpiar_cambios(datos):
+    """
+    Valida los valores a asignar ({campo: valor en texto}) con las reglas del
+    modelo. Devuelve {campo: valor convertido}; lanza ValidationError.
+    """
+    cambios = {}
+    errores = {}
+    for nombre, valor in datos.items():
+        if nombre not in CAMPOS_EDITABLES:
+            errores[nombre] = ['No se puede modificar en bloque.']
+            continue
+        try:
+            cambios[nombre] = CalificacionTributaria._meta.get_field(nombre).clean(valor, None)
+        except ValidationError as e:
+            errores[nombre] = e.messages
+    if errores:
+        raise ValidationError(errores)
+    if not cambios:
+        raise ValidationError('Debe indicar al menos un campo a modificar.')
+    return cambios
+
+
+def eliminar(queryset):
+    """Elimina las calificaciones del queryset y sus factores. Genera las filas eliminadas acumuladas"""
+    procesadas = 0
+    for bloque in _bloques(queryset):
+        ids = [calificacion.id for calificacion in bloque]
+        with transaction.atomic():
+            FactoresCalificacion.objects.filter(calificacion_id__in=ids)._raw_delete(FactoresCalificacion.objects.db)
+            CalificacionTributaria.objects.filter(id__in=ids)._raw_delete(CalificacionTributaria.objects.db)
+            for usuario_id, cantidad in Counter(calificacion.usuario_id for calificacion in bloque).items():
+                contadores.sumar_calificaciones(usuario_id, -cantidad)
+            facetas.sumar_calificaciones(bloque, signo=-1)
+        metricas.CALIFICACIONES_ESCRITAS.inc(len(ids), operacion='eliminada', via='masiva')
+        procesadas += len(ids)
+        yield procesadas
+
+
+def actualizar(queryset, cambios):
+    """Asigna `cambios` (de limpiar_cambios) a las calificaciones del queryset. Genera las filas modificadas acumuladas"""
+    procesadas = 0
+    for bloque in _bloques(queryset):
+        ids = [calificacion.id for calificacion in bloque]
+        # update() no aplica auto_now
+        CalificacionTributaria.objects.filter(id__in=ids).update(**cambios, fecha_modificacion=timezone.now())
+        metricas.CALIFICACIONES_ESCRITAS.inc(len(ids), operacion='modificada', via='masiva')
+        procesadas += len(ids)
+        yield procesadas
@@ -0,0 +1,356 @@
+import atexit
+import functools
+import json
+import math
+import os
+import secrets
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import Count
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import ArchivoCarga, CalificacionTributaria, CorreoSaliente
+
+# ==========================================
+# REGISTRO DE MÉTRICAS (FORMATO PROMETHEUS)
+# ==========================================
+#
+# Contadores, medidores e histogramas en memoria de cada proceso. Para que
+# /metricas/ muestre el total de todos los workers (gunicorn, procesar_cargas,
+# enviar_correos), cada proceso vuelca sus valores a su propio archivo JSON en
+# METRICAS_DIR, como máximo cada METRICAS_INTERVALO_SEGUNDOS y al terminar.
+# El nombre lleva máquina, PID y una ficha al azar de cada arranque, así un
+# PID reutilizado no pisa el archivo de un proceso terminado.
+# La vista suma los archivos de todos los procesos:
+#   - contadores e histogramas: todos los archivos. Antes de sumar, el proceso
+#     que exporta hereda los de procesos terminados de esta máquina (los suma
+#     a los suyos y borra el archivo), así los totales no retroceden y el
+#     directorio no crece con cada reinicio
+#   - medidores: solo procesos vivos de esta máquina
+# Los medidores calculados (colas) se consultan en la base de datos al exportar.
+
+LIMITES_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LIMITES_BYTES = (1e3, 1e4, 1e5, 1e6, 1e7, 5e7, 1e8)
+
+_registro = {}
+_valores = {}
+_candado = threading.Lock()
+_candado_archivo = threading.Lock()  # Ordena los volcados de los distintos hilos
+_ultimo_volcado = 0.0
+_arranque = None            # (pid, ficha) de este proceso; cambia tras un fork
+
+
+def _directorio():
+    return Path(settings.METRICAS_DIR)
+
+
+def _archivo_proceso():
+    global _arranque
+    if _arranque is None or _arranque[0] != os.getpid():
+        _arranque = (os.getpid(), secrets.token_hex(4))
+    return _directorio() / f'{socket.gethostname()}_{_arranque[0]}_{_arranque[1]}.json'
+
+
+def _sumar(anterior, valor):
+    if isinstance(valor, list):
+        return [a + b for a, b in zip(anterior or [0] * len(valor), valor)]
+    return (anterior or 0) + valor
+
+
+class _Metrica:
+    tipo = ''
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        _registro[nombre] = self
+
+    def _clave(self, etiquetas):
+        if set(etiquetas) != set(self.etiquetas):
+            raise ValueError(f'{self.nombre} espera las etiquetas {self.etiquetas}')
+        return (self.nombre, tuple(str(etiquetas[e]) for e in self.etiquetas))
+
+    def _actualizar(self, etiquetas, funcion):
+        clave = self._clave(etiquetas)
+        with _candado:
+            _valores[clave] = funcion(_valores.get(clave))
+        _volcar_si_corresponde()
+
+
+class Contador(_Metrica):
+    tipo = 'counter'
+
+    def inc(self, cantidad=1, **etiquetas):
+        self._actualizar(etiquetas, lambda actual: (actual or 0) + cantidad)
+
+
+class Medidor(_Metrica):
+    tipo = 'gauge'
+
+    def inc(self, cantidad=1, **etiquetas):
+        self._actualizar(etiquetas, lambda actual: (actual or 0) + cantidad)
+
+    def dec(self, cantidad=1, **etiquetas):
+        self.inc(-cantidad, **etiquetas)
+
+    def set(self, valor, **etiquetas):
+        self._actualizar(etiquetas, lambda actual: valor)
+
+
+class MedidorCalculado(_Metrica):
+    """Medidor cuyo valor se calcula al exportar. `funcion` devuelve {(etiquetas...): valor}"""
+    tipo = 'gauge'
+
+    def __init__(self, nombre, ayuda, etiquetas, funcion):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.funcion = funcion
+
+
+class Histograma(_Metrica):
+    tipo = 'histogram'
+
+    def __init__(self, nombre, ayuda, etiquetas=(), limites=LIMITES_SEGUNDOS):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.limites = tuple(limites)
+
+    def observar(self, valor, **etiquetas):
+        def sumar(actual):
+            # [conteo por tramo..., conteo fuera de tramos, suma]
+            actual = list(actual or [0] * (len(self.limites) + 2))
+            actual[next((i for i, limite in enumerate(self.limites) if valor <= limite), len(self.limites))] += 1
+            actual[-1] += valor
+            return actual
+        self._actualizar(etiquetas, sumar)
+
+    @contextmanager
+    def cronometrar(self, **etiquetas):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(time.perf_counter() - inicio, **etiquetas)
+
+
+def medir_post(histograma):
+    """Decorador de vistas: observa en `histograma` la duración de las peticiones POST"""
+    def decorador(vista):
+        @functools.wraps(vista)
+        def envoltura(request, *args, **kwargs):
+            if request.method != 'POST':
+                return vista(request, *args, **kwargs)
+            with histograma.cronometrar():
+                return vista(request, *args, **kwargs)
+        return envoltura
+    return decorador
+
+
+# ==========================================
+# BACKEND DE ARCHIVOS COMPARTIDOS
+# ==========================================
+
+def volcar():
+    """Escribe los valores de este proceso en su archivo (reemplazo atómico)"""
+    global _ultimo_volcado
+    with _candado_archivo:
+        with _candado:
+            datos = [[nombre, list(etiquetas), valor] for (nombre, etiquetas), valor in _valores.items()]
+            _ultimo_volcado = time.monotonic()
+        if not datos:
+            return
+        destino = _archivo_proceso()
+        destino.parent.mkdir(parents=True, exist_ok=True)
+        temporal = destino.with_suffix('.tmp')
+        contenido = {'host': socket.gethostname(), 'pid': os.getpid(), 'valores': datos}
+        temporal.write_text(json.dumps(contenido), encoding='utf-8')
+        os.replace(temporal, destino)
+
+
+def _volcar_si_corresponde():
+    if time.monotonic() - _ultimo_volcado >= settings.METRICAS_INTERVALO_SEGUNDOS:
+        try:
+            volcar()
+        except OSError:
+            pass  # Las métricas nunca deben romper una petición
+
+
+atexit.register(volcar)
+
+
+def _proceso_vivo(contenido):
+    if contenido.get('host') != socket.gethostname():
+        return False
+    try:
+        os.kill(contenido['pid'], 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass  # Sin permiso para señalarlo (u otro sistema): existe
+    return True
+
+
+def _leer(archivo):
+    try:
+        return json.loads(archivo.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return None
+
+
+def _heredar(archivo):
+    """Pasa a este proceso los contadores e histogramas del archivo de un proceso terminado"""
+    reclamado = archivo.with_suffix('.heredado')
+    try:
+        os.rename(archivo, reclamado)  # Atómico: si dos procesos lo intentan, solo uno lo hereda
+    except OSError:
+        return
+    contenido = _leer(reclamado) or {'valores': []}
+    with _candado:
+        for nombre, etiquetas, valor in contenido['valores']:
+            metrica = _registro.get(nombre)
+            if metrica is not None and metrica.tipo != 'gauge':
+                clave = (nombre, tuple(etiquetas))
+                _valores[clave] = _sumar(_valores.get(clave), valor)
+    volcar()
+    reclamado.unlink(missing_ok=True)
+
+
+def valores_agregados():
+    """Suma los archivos de todos los procesos. Devuelve {(nombre, etiquetas): valor}"""
+    volcar()
+    propio = _archivo_proceso()
+    for archivo in _directorio().glob('*.json'):
+        if archivo == propio:
+            continue
+        contenido = _leer(archivo)
+        # Solo se sabe si terminó un proceso de esta misma máquina
+        if contenido and contenido.get('host') == socket.gethostname() and not _proceso_vivo(contenido):
+            _heredar(archivo)
+
+    total = {}
+    for archivo in _directorio().glob('*.json'):
+        contenido = _leer(archivo)
+        if contenido is None:
+            continue
+        vivo = None
+        for nombre, etiquetas, valor in contenido['valores']:
+            metrica = _registro.get(nombre)
+            if metrica is None:
+                continue
+            if metrica.tipo == 'gauge':
+                if vivo is None:
+                    vivo = _proceso_vivo(contenido)
+                if not vivo:
+                    continue
+            clave = (nombre, tuple(etiquetas))
+            total[clave] = _sumar(total.get(clave), valor)
+    return total
+
+
+# ==========================================
+# FORMATO DE TEXTO DE PROMETHEUS
+# ==========================================
+
+def _escapar(valor):
+    return valor.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _etiquetas(nombres, valores, extra=()):
+    pares = [*zip(nombres, valores), *extra]
+    if not pares:
+        return ''
+    return '{' + ','.join(f'{n}="{_escapar(str(v))}"' for n, v in pares) + '}'
+
+
+def _numero(valor):
+    if valor == math.inf:
+        return '+Inf'
+    return repr(float(valor)) if isinstance(valor, float) and not valor.is_integer() else str(int(valor))
+
+
+def exportar():
+    """Todas las métricas registradas en formato de texto de Prometheus 0.0.4"""
+    agregados = valores_agregados()
+    lineas = []
+    for nombre, metrica in sorted(_registro.items()):
+        lineas.append(f'# HELP {nombre} {metrica.ayuda}')
+        lineas.append(f'# TYPE {nombre} {metrica.tipo}')
+
+        if isinstance(metrica, MedidorCalculado):
+            series = metrica.funcion().items()
+        else:
+            series = sorted((etq, valor) for (n, etq), valor in agregados.items() if n == nombre)
+
+        for etiquetas, valor in series:
+            if isinstance(metrica, Histograma):
+                acumulado = 0
+                for limite, cantidad in zip((*metrica.limites, math.inf), valor[:-1]):
+                    acumulado += cantidad
+                    extra = [('le', _numero(limite))]
+                    lineas.append(f'{nombre}_bucket{_etiquetas(metrica.etiquetas, etiquetas, extra)} {acumulado}')
+                lineas.append(f'{nombre}_sum{_etiquetas(metrica.etiquetas, etiquetas)} {_numero(valor[-1])}')
+                lineas.append(f'{nombre}_count{_etiquetas(metrica.etiquetas, etiquetas)} {acumulado}')
+            else:
+                lineas.append(f'{nombre}{_etiquetas(metrica.etiquetas, etiquetas)} {_numero(valor)}')
+    return '\n'.join(lineas) + '\n'
+
+
+# ==========================================
+# MÉTRICAS DE LA APLICACIÓN
+# ==========================================
+
+LOGINS = Contador('nuam_logins_total', 'Intentos de login por resultado', ['resultado'])
+DURACION_LOGIN = Histograma('nuam_login_duracion_segundos', 'Duración de los POST de login')
+VERIFICACIONES_MFA = Contador('nuam_verificaciones_mfa_total', 'Verificaciones de código MFA', ['resultado'])
+DURACION_MFA = Histograma('nuam_verificacion_mfa_duracion_segundos', 'Duración de los POST de verificación MFA')
+
+CARGAS_RECIBIDAS = Contador('nuam_cargas_recibidas_total', 'Archivos de carga masiva encolados', ['tipo'])
+BYTES_CARGA = Histograma('nuam_carga_bytes', 'Tamaño de los archivos de carga masiva', ['tipo'], LIMITES_BYTES)
+DURACION_PROCESAMIENTO = Histograma(
+    'nuam_carga_procesamiento_segundos', 'Duración del procesamiento de un archivo de carga', ['resultado'],
+)
+DURACION_LOTE = Histograma('nuam_carga_lote_segundos', 'Duración de la inserción de un lote de carga masiva')
+
+EXPORTACIONES = Contador('nuam_exportaciones_total', 'Exportaciones CSV iniciadas')
+FILAS_EXPORTADAS = Contador('nuam_filas_exportadas_total', 'Filas escritas en exportaciones CSV')
+DURACION_EXPORTACION = Histograma(
+    'nuam_exportacion_duracion_segundos', 'Duración de una exportación CSV (hasta enviar la última fila)',
+)
+EXPORTACIONES_EN_CURSO = Medidor('nuam_exportaciones_en_curso', 'Exportaciones CSV transmitiéndose ahora')
+
+CALIFICACIONES_ESCRITAS = Contador(
+    'nuam_calificaciones_escritas_total', 'Calificaciones creadas, modificadas o eliminadas', ['operacion', 'via'],
+)
+
+OPERACIONES_API = Contador('nuam_api_operaciones_total', 'Operaciones recibidas por la API por lotes', ['op', 'resultado'])
+DURACION_LOTE_API = Histograma('nuam_api_lote_duracion_segundos', 'Duración de una llamada a la API por lotes')
+
+
+def _por_estado(modelo, estados):
+    conteos = dict(modelo.objects.filter(estado__in=estados).values_list('estado').annotate(Count('id')))
+    return {(estado,): conteos.get(estado, 0) for estado in estados}
+
+
+MedidorCalculado(
+    'nuam_cargas_en_cola', 'Archivos de carga por estado', ['estado'],
+    lambda: _por_estado(ArchivoCarga, ['PENDIENTE', 'PROCESANDO']),
+)
+MedidorCalculado(
+    'nuam_correos_en_cola', 'Correos de la bandeja de salida por estado', ['estado'],
+    lambda: _por_estado(CorreoSaliente, ['PENDIENTE', 'ENVIANDO', 'ERROR']),
+)
+
+
+@receiver(post_save, sender=CalificacionTributaria)
+def calificacion_guardada(sender, instance, created, **kwargs):
+    CALIFICACIONES_ESCRITAS.inc(operacion='creada' if created else 'modificada', via='individual')
+
+
+@receiver(post_delete, sender=CalificacionTributaria)
+def calificacion_eliminada(sender, instance, **kwargs):
+    CALIFICACIONES_ESCRITAS.inc(operacion='eliminada', via='individual')
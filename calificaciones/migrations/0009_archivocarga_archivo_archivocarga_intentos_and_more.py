@@ -0,0 +1,52 @@
+# Generated by Django 5.2.8 on 2026-10-18 02:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calificaciones', '0008_calificaciontributaria_usuario_empresa_usuario'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivocarga',
+            name='archivo',
+            field=models.FileField(blank=True, null=True, upload_to='cargas/%Y/%m/'),
+        ),
+        migrations.AddField(
+            model_name='archivocarga',
+            name='intentos',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='archivocarga',
+            name='latido',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='archivocarga',
+            name='mensaje_error',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='archivocarga',
+            name='proximo_intento',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='archivocarga',
+            name='trabajador',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='archivocarga',
+            name='ultima_linea',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='archivocarga',
+            index=models.Index(fields=['estado', 'fecha_carga'], name='calificacio_estado_d4ccfe_idx'),
+        ),
+    ]
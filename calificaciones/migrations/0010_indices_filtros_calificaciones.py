@@ -0,0 +1,75 @@
+# Generated by Django 5.2.8 on 2026-10-18 02:52
+
+from django.conf import settings
+from django.db import migrations, models
+
+INDICES = [
+    models.Index(fields=['usuario', 'ejercicio', 'fecha_pago', 'id'], name='calif_usr_ejer_fecha_idx'),
+    models.Index(fields=['usuario', 'fecha_pago', 'id'], name='calif_usr_fecha_idx'),
+    models.Index(fields=['ejercicio', 'fecha_pago', 'id'], name='calif_ejer_fecha_idx'),
+    models.Index(fields=['fecha_pago', 'id'], name='calif_fecha_idx'),
+]
+
+# Índices GIN de trigramas (solo PostgreSQL). La expresión coincide con la que
+# Django genera para icontains: UPPER("columna"::text) LIKE UPPER('%valor%')
+INDICES_TRIGRAMA = [
+    ('calif_mercado_trgm_idx', 'mercado'),
+    ('calif_instrumento_trgm_idx', 'instrumento'),
+]
+
+
+def crear_indices(apps, schema_editor):
+    modelo = apps.get_model('calificaciones', 'CalificacionTributaria')
+
+    if schema_editor.connection.vendor != 'postgresql':
+        for indice in INDICES:
+            schema_editor.add_index(modelo, indice)
+        return
+
+    # CONCURRENTLY evita bloquear las escrituras sobre la tabla mientras se construyen
+    tabla = schema_editor.quote_name(modelo._meta.db_table)
+    for indice in INDICES:
+        schema_editor.execute(indice.create_sql(modelo, schema_editor, concurrently=True))
+
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for nombre, columna in INDICES_TRIGRAMA:
+        schema_editor.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {schema_editor.quote_name(nombre)} '
+            f'ON {tabla} USING gin (UPPER({schema_editor.quote_name(columna)}::text) gin_trgm_ops)'
+        )
+
+
+def eliminar_indices(apps, schema_editor):
+    modelo = apps.get_model('calificaciones', 'CalificacionTributaria')
+
+    if schema_editor.connection.vendor != 'postgresql':
+        for indice in INDICES:
+            schema_editor.remove_index(modelo, indice)
+        return
+
+    nombres = [indice.name for indice in INDICES] + [nombre for nombre, _ in INDICES_TRIGRAMA]
+    for nombre in nombres:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {schema_editor.quote_name(nombre)}')
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY no puede ejecutarse dentro de una transacción
+    atomic = False
+
+    dependencies = [
+        ('calificaciones', '0009_archivocarga_archivo_archivocarga_intentos_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(model_name='calificaciontributaria', index=indice)
+                for indice in INDICES
+            ],
+            database_operations=[
+                migrations.RunPython(crear_indices, eliminar_indices),
+            ],
+        ),
+    ]
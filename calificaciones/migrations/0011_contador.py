@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-18 02:56
+
+from django.db import migrations, models
+
+
+def poblar_contadores(apps, schema_editor):
+    # Los contadores parten con los totales reales de las tablas existentes
+    from calificaciones.contadores import recalcular
+    recalcular(apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calificaciones', '0010_indices_filtros_calificaciones'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Contador',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('clave', models.CharField(max_length=100, unique=True)),
+                ('valor', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(poblar_contadores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.8 on 2026-10-18 02:58
+
+from django.db import migrations, models, transaction
+
+from calificaciones.factores import CAMPOS_FACTORES, empaquetar
+
+TAMANO_LOTE = 5000
+
+
+def convertir_factores(apps, schema_editor):
+    # Recorre la tabla por rangos de id; cada lote se confirma por separado para
+    # no mantener una transacción abierta sobre millones de filas
+    modelo = apps.get_model('calificaciones', 'FactoresCalificacion')
+    quote = schema_editor.quote_name
+    sql = (
+        f'UPDATE {quote(modelo._meta.db_table)} '
+        f'SET {quote("empaquetado")} = %s, {quote("nulos")} = %s WHERE {quote("id")} = %s'
+    )
+    ultimo_id = 0
+    while True:
+        filas = list(
+            modelo.objects
+            .filter(id__gt=ultimo_id, empaquetado__isnull=True)
+            .order_by('id')
+            .values_list('id', *CAMPOS_FACTORES)[:TAMANO_LOTE]
+        )
+        if not filas:
+            break
+        parametros = [(*empaquetar(valores), pk) for pk, *valores in filas]
+        with transaction.atomic(), schema_editor.connection.cursor() as cursor:
+            cursor.executemany(sql, parametros)
+        ultimo_id = filas[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('calificaciones', '0011_contador'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='factorescalificacion',
+            name='empaquetado',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.AddField(
+            model_name='factorescalificacion',
+            name='nulos',
+            field=models.IntegerField(editable=False, null=True),
+        ),
+        migrations.RunPython(convertir_factores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:20
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q
+from django.db.models.functions import Upper
+
+# Índice único sobre UPPER(email) en la tabla de usuarios: cubre la búsqueda
+# email__iexact de EmailOUsuarioBackend y evita cuentas con el mismo email.
+# Los usuarios sin email ('') quedan fuera del índice.
+EMAIL_UNICO = models.UniqueConstraint(Upper('email'), name='auth_user_email_ci_uniq', condition=~Q(email=''))
+
+
+def _modelo_usuario(apps):
+    return apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+
+
+def crear_indice(apps, schema_editor):
+    modelo = _modelo_usuario(apps)
+    duplicados = list(
+        modelo.objects
+        .exclude(email='')
+        .values(email_normalizado=Upper('email'))
+        .annotate(total=Count('id'))
+        .filter(total__gt=1)
+        .values_list('email_normalizado', flat=True)
+    )
+    if duplicados:
+        raise ValueError(
+            'Hay usuarios que comparten email (sin distinguir mayúsculas); '
+            f'corríjalos antes de migrar: {", ".join(duplicados)}'
+        )
+    schema_editor.add_constraint(modelo, EMAIL_UNICO)
+
+
+def eliminar_indice(apps, schema_editor):
+    schema_editor.remove_constraint(_modelo_usuario(apps), EMAIL_UNICO)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calificaciones', '0013_correosaliente'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indice, eliminar_indice),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:16
+
+import django.db.models.expressions
+import django.db.models.functions.comparison
+import django.db.models.functions.math
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calificaciones', '0014_email_unico_usuarios'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='factorescalificacion',
+            name='suma_8_16',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.functions.math.Round(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.functions.comparison.Coalesce(models.F('factor_8'), models.Value(Decimal('0')), output_field=models.DecimalField(decimal_places=8, max_digits=10)), '+', django.db.models.functions.comparison.Coalesce(models.F('factor_9'), models.Value(Decimal('0')), output_field=models.DecimalField(decimal_places=8, max_digits=10))), '+', django.db.models.functions.comparison.Coalesce(models.F('factor_10'), models.Value(Decimal('0')), output_field=models.DecimalField(decimal_places=8, max_digits=10))), '+', django.db.models.functions.comparison.Coalesce(models.F('factor_11'), models.Value(Decimal('0')), output_field=models.DecimalField(decimal_places=8, max_digits=10))), '+', django.db.models.functions.comparison.Coalesce(models.F('factor_12'), models.Value(Decimal('0')), output_field=models.DecimalField(decimal_places=8, max_digits=10))), '+', django.db.models.functions.comparison.Coalesce(models.F('factor_13'), models.Value(Decimal('0')), output_field=models.DecimalField(decimal_places=8, max_digits=10))), '+', django.db.models.functions.comparison.Coalesce(models.F('factor_14'), models.Value(Decimal('0')), output_field=models.DecimalField(decimal_places=8, max_digits=10))), '+', django.db.models.functions.comparison.Coalesce(models.F('factor_15'), models.Value(Decimal('0')), output_field=models.DecimalField(decimal_places=8, max_digits=10))), '+', django.db.models.functions.comparison.Coalesce(models.F('factor_16'), models.Value(Decimal('0')), output_field=models.DecimalField(decimal_places=8, max_digits=10))), 8, output_field=models.DecimalField(decimal_places=8, max_digits=10)), output_field=models.DecimalField(decimal_places=8, max_digits=10)),
+        ),
+        migrations.AddIndex(
+            model_name='factorescalificacion',
+            index=models.Index(fields=['suma_8_16', 'id'], name='factores_suma_8_16_idx'),
+        ),
+    ]
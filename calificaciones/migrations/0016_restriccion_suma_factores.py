@@ -0,0 +1,43 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:18
+
+from django.db import migrations, models
+
+# Máximo de filas inválidas que se listan en el mensaje de error
+MAX_LISTADAS = 50
+
+
+def verificar_factores(apps, schema_editor):
+    # La restricción no se puede crear si ya hay filas que no la cumplen:
+    # se listan para corregirlas (o eliminarlas) antes de migrar
+    factores = apps.get_model('calificaciones', 'FactoresCalificacion')
+    invalidos = factores.objects.filter(suma_8_16__gt=1).order_by('id')
+    total = invalidos.count()
+    if total:
+        detalle = [
+            f'calificación {calificacion_id} ({ejercicio} {mercado} {instrumento}, '
+            f'secuencia {secuencia}): suma {suma}'
+            for calificacion_id, ejercicio, mercado, instrumento, secuencia, suma in invalidos.values_list(
+                'calificacion_id', 'calificacion__ejercicio', 'calificacion__mercado',
+                'calificacion__instrumento', 'calificacion__secuencia_evento', 'suma_8_16',
+            )[:MAX_LISTADAS]
+        ]
+        raise ValueError(
+            f'Hay {total} factores con suma 8-16 mayor que 1; corríjalos antes de migrar:\n'
+            + '\n'.join(detalle)
+            + (f'\n... y {total - MAX_LISTADAS} más' if total > MAX_LISTADAS else '')
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calificaciones', '0015_suma_factores_generada'),
+    ]
+
+    operations = [
+        migrations.RunPython(verificar_factores, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='factorescalificacion',
+            constraint=models.CheckConstraint(condition=models.Q(('suma_8_16__lte', 1)), name='factores_suma_8_16_max_1', violation_error_message='La suma de los factores del 8 al 16 no puede ser mayor que 1.'),
+        ),
+    ]
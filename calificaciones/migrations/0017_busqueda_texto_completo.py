@@ -0,0 +1,124 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:40
+
+from django.db import migrations
+
+# Columna tsvector, triggers e índice GIN de la búsqueda de texto completo
+# (ver calificaciones/busqueda.py). Solo PostgreSQL: en otros motores la
+# búsqueda usa icontains y esta migración no hace nada.
+
+COLUMNA = 'busqueda'
+INDICE = 'calif_busqueda_gin_idx'
+FUNCION_DOCUMENTO = 'calificaciones_documento_busqueda'
+FUNCION_CALIFICACION = 'calificaciones_calificacion_busqueda'
+FUNCION_EMPRESA = 'calificaciones_empresa_busqueda'
+TAMANO_LOTE = 50000
+
+
+def _tablas(apps, schema_editor):
+    calificacion = apps.get_model('calificaciones', 'CalificacionTributaria')._meta.db_table
+    empresa = apps.get_model('calificaciones', 'Empresa')._meta.db_table
+    return schema_editor.quote_name(calificacion), schema_editor.quote_name(empresa)
+
+
+def crear_busqueda(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    calificacion, empresa = _tablas(apps, schema_editor)
+
+    schema_editor.execute(f'ALTER TABLE {calificacion} ADD COLUMN IF NOT EXISTS {COLUMNA} tsvector')
+
+    # Documento de búsqueda con pesos: A instrumento y RUT, B nombre de la empresa, C mercado y descripción
+    schema_editor.execute(f"""
+        CREATE OR REPLACE FUNCTION {FUNCION_DOCUMENTO}(
+            instrumento text, mercado text, descripcion text, nombre text, rut text
+        ) RETURNS tsvector LANGUAGE sql IMMUTABLE AS $$
+            SELECT setweight(to_tsvector('spanish', coalesce(instrumento, '') || ' ' || coalesce(rut, '')), 'A')
+                || setweight(to_tsvector('spanish', coalesce(nombre, '')), 'B')
+                || setweight(to_tsvector('spanish', coalesce(mercado, '') || ' ' || coalesce(descripcion, '')), 'C')
+        $$
+    """)
+
+    # Al insertar o modificar una calificación (también con COPY y bulk_create)
+    schema_editor.execute(f"""
+        CREATE OR REPLACE FUNCTION {FUNCION_CALIFICACION}() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            -- LEFT JOIN: la FK es diferida y la empresa podría insertarse después en la misma transacción
+            SELECT {FUNCION_DOCUMENTO}(NEW.instrumento, NEW.mercado, NEW.descripcion_dividendo, e.nombre, e.rut)
+              INTO NEW.{COLUMNA}
+              FROM (SELECT 1) AS uno LEFT JOIN {empresa} e ON e.id = NEW.empresa_id;
+            RETURN NEW;
+        END
+        $$
+    """)
+    schema_editor.execute(f'DROP TRIGGER IF EXISTS {FUNCION_CALIFICACION} ON {calificacion}')
+    schema_editor.execute(f"""
+        CREATE TRIGGER {FUNCION_CALIFICACION}
+        BEFORE INSERT OR UPDATE OF instrumento, mercado, descripcion_dividendo, empresa_id ON {calificacion}
+        FOR EACH ROW EXECUTE FUNCTION {FUNCION_CALIFICACION}()
+    """)
+
+    # Al cambiar el nombre o el RUT de una empresa se rehacen sus calificaciones
+    schema_editor.execute(f"""
+        CREATE OR REPLACE FUNCTION {FUNCION_EMPRESA}() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF NEW.nombre IS DISTINCT FROM OLD.nombre OR NEW.rut IS DISTINCT FROM OLD.rut THEN
+                UPDATE {calificacion}
+                   SET {COLUMNA} = {FUNCION_DOCUMENTO}(instrumento, mercado, descripcion_dividendo, NEW.nombre, NEW.rut)
+                 WHERE empresa_id = NEW.id;
+            END IF;
+            RETURN NULL;
+        END
+        $$
+    """)
+    schema_editor.execute(f'DROP TRIGGER IF EXISTS {FUNCION_EMPRESA} ON {empresa}')
+    schema_editor.execute(f"""
+        CREATE TRIGGER {FUNCION_EMPRESA}
+        AFTER UPDATE OF nombre, rut ON {empresa}
+        FOR EACH ROW EXECUTE FUNCTION {FUNCION_EMPRESA}()
+    """)
+
+    # Filas existentes, por rangos de id (cada UPDATE se confirma por separado)
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'SELECT COALESCE(MIN(id), 0), COALESCE(MAX(id), -1) FROM {calificacion}')
+        minimo, maximo = cursor.fetchone()
+        for desde in range(minimo, maximo + 1, TAMANO_LOTE):
+            cursor.execute(
+                f"""
+                UPDATE {calificacion} c
+                   SET {COLUMNA} = {FUNCION_DOCUMENTO}(c.instrumento, c.mercado, c.descripcion_dividendo, e.nombre, e.rut)
+                  FROM {empresa} e
+                 WHERE e.id = c.empresa_id AND c.id >= %s AND c.id < %s
+                """,
+                [desde, desde + TAMANO_LOTE],
+            )
+
+    schema_editor.execute(
+        f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {INDICE} ON {calificacion} USING gin ({COLUMNA})'
+    )
+
+
+def eliminar_busqueda(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    calificacion, empresa = _tablas(apps, schema_editor)
+    schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {INDICE}')
+    schema_editor.execute(f'DROP TRIGGER IF EXISTS {FUNCION_EMPRESA} ON {empresa}')
+    schema_editor.execute(f'DROP TRIGGER IF EXISTS {FUNCION_CALIFICACION} ON {calificacion}')
+    schema_editor.execute(f'DROP FUNCTION IF EXISTS {FUNCION_EMPRESA}()')
+    schema_editor.execute(f'DROP FUNCTION IF EXISTS {FUNCION_CALIFICACION}()')
+    schema_editor.execute(f'DROP FUNCTION IF EXISTS {FUNCION_DOCUMENTO}(text, text, text, text, text)')
+    schema_editor.execute(f'ALTER TABLE {calificacion} DROP COLUMN IF EXISTS {COLUMNA}')
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY no puede ejecutarse dentro de una transacción
+    atomic = False
+
+    dependencies = [
+        ('calificaciones', '0016_restriccion_suma_factores'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_busqueda, eliminar_busqueda),
+    ]
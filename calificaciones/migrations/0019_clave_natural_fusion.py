@@ -0,0 +1,104 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:31
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+# Máximo de grupos duplicados que se listan en el mensaje de error
+MAX_LISTADOS = 50
+
+CLAVE_NATURAL = ['empresa_id', 'ejercicio', 'mercado', 'instrumento', 'secuencia_evento']
+
+# Tabla de paso de la fusión de cargas masivas (ver importacion._fusionar_postgresql).
+# UNLOGGED: no escribe WAL; su contenido solo vive dentro de la transacción de cada lote
+TABLA_STAGING = 'calificaciones_carga_staging'
+COLUMNAS_STAGING = [
+    'empresa_id', 'ejercicio', 'mercado', 'instrumento', 'fecha_pago', 'descripcion_dividendo',
+    'secuencia_evento', 'tipo_sociedad', 'valor_historico',
+]
+COLUMNAS_FACTORES = [f'factor_{i}' for i in range(8, 38)] + ['empaquetado', 'nulos']
+
+
+def verificar_duplicados(apps, schema_editor):
+    # La restricción no se puede crear si ya hay calificaciones repetidas:
+    # se listan para eliminarlas (o corregirlas) antes de migrar
+    calificaciones = apps.get_model('calificaciones', 'CalificacionTributaria')
+    duplicados = (
+        calificaciones.objects
+        .values(*CLAVE_NATURAL)
+        .annotate(cantidad=Count('id'))
+        .filter(cantidad__gt=1)
+        .order_by(*CLAVE_NATURAL)
+    )
+    total = duplicados.count()
+    if total:
+        detalle = [
+            f"empresa {d['empresa_id']}, {d['ejercicio']} {d['mercado']} {d['instrumento']}, "
+            f"secuencia {d['secuencia_evento']}: {d['cantidad']} calificaciones"
+            for d in duplicados[:MAX_LISTADOS]
+        ]
+        raise ValueError(
+            f'Hay {total} claves (empresa, ejercicio, mercado, instrumento, secuencia) repetidas; '
+            'deje una calificación por clave antes de migrar:\n'
+            + '\n'.join(detalle)
+            + (f'\n... y {total - MAX_LISTADOS} más' if total > MAX_LISTADOS else '')
+        )
+
+
+def crear_staging(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    calificacion = apps.get_model('calificaciones', 'CalificacionTributaria')
+    factores = apps.get_model('calificaciones', 'FactoresCalificacion')
+    conexion = schema_editor.connection
+    columnas = [
+        f'{campo.column} {campo.db_type(conexion)}'
+        for modelo, nombres in ((calificacion, COLUMNAS_STAGING), (factores, COLUMNAS_FACTORES))
+        for campo in (modelo._meta.get_field(nombre.removesuffix('_id')) for nombre in nombres)
+    ]
+    schema_editor.execute(f"""
+        CREATE UNLOGGED TABLE IF NOT EXISTS {TABLA_STAGING} (
+            archivo_id bigint NOT NULL,
+            usuario_id integer,
+            {', '.join(columnas)}
+        )
+    """)
+    schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {TABLA_STAGING}_archivo_idx ON {TABLA_STAGING} (archivo_id)')
+
+
+def eliminar_staging(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f'DROP TABLE IF EXISTS {TABLA_STAGING}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calificaciones', '0018_token_api'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivocarga',
+            name='registros_actualizados',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='archivocarga',
+            name='registros_insertados',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='archivocarga',
+            name='registros_sin_cambios',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(verificar_duplicados, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='calificaciontributaria',
+            constraint=models.UniqueConstraint(fields=('empresa', 'ejercicio', 'mercado', 'instrumento', 'secuencia_evento'), name='calif_clave_natural', violation_error_message='Ya existe una calificación con esta empresa, ejercicio, mercado, instrumento y secuencia.'),
+        ),
+        migrations.RunPython(crear_staging, eliminar_staging),
+    ]
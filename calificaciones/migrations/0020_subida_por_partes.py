@@ -0,0 +1,51 @@
+# Generated by Django 5.2.8 on 2026-10-18 03:39
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calificaciones', '0019_clave_natural_fusion'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivocarga',
+            name='sha256',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='archivocarga',
+            name='tamano',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='archivocarga',
+            name='ultimo_byte',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='SubidaCarga',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo_carga', models.CharField(choices=[('MONTOS', 'Montos'), ('FACTORES', 'Factores')], max_length=20)),
+                ('nombre_archivo', models.CharField(max_length=255)),
+                ('tamano', models.BigIntegerField()),
+                ('recibidos', models.BigIntegerField(default=0)),
+                ('sha256', models.CharField(blank=True, default='', max_length=64)),
+                ('estado', models.CharField(choices=[('RECIBIENDO', 'Recibiendo'), ('COMPLETA', 'Completa'), ('CANCELADA', 'Cancelada')], default='RECIBIENDO', max_length=20)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('fecha_actualizacion', models.DateTimeField(auto_now=True)),
+                ('archivo_carga', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='calificaciones.archivocarga')),
+                ('empresa', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='calificaciones.empresa')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['estado', 'fecha_actualizacion'], name='calificacio_estado_a7392b_idx')],
+            },
+        ),
+    ]
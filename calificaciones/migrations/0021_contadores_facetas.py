@@ -0,0 +1,20 @@
+# Generated by Django 5.2.8 on 2026-10-18 06:12
+
+from django.db import migrations
+
+
+def poblar_facetas(apps, schema_editor):
+    # Las facetas de los filtros pasan a la tabla de contadores: se cargan con los totales reales
+    from calificaciones.contadores import recalcular
+    recalcular(apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calificaciones', '0020_subida_por_partes'),
+    ]
+
+    operations = [
+        migrations.RunPython(poblar_facetas, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.8 on 2026-10-18 06:40
+
+import numpy as np
+from django.db import migrations, transaction
+
+TAMANO_LOTE = 5000
+ANCHO_INT64 = 30 * 8
+
+
+def reempaquetar(apps, schema_editor):
+    # Las copias empaquetadas pasan de int64 (240 bytes) a int32 (120 bytes).
+    # Mismo recorrido por rangos de id que la migración 0012, un lote por transacción
+    modelo = apps.get_model('calificaciones', 'FactoresCalificacion')
+    quote = schema_editor.quote_name
+    sql = f'UPDATE {quote(modelo._meta.db_table)} SET {quote("empaquetado")} = %s WHERE {quote("id")} = %s'
+    ultimo_id = 0
+    while True:
+        filas = list(
+            modelo.objects
+            .filter(id__gt=ultimo_id, empaquetado__isnull=False)
+            .order_by('id')
+            .values_list('id', 'empaquetado')[:TAMANO_LOTE]
+        )
+        if not filas:
+            break
+        parametros = [
+            (np.frombuffer(bytes(empaquetado), dtype='<i8').astype('<i4').tobytes(), pk)
+            for pk, empaquetado in filas if len(empaquetado) == ANCHO_INT64
+        ]
+        if parametros:
+            with transaction.atomic(), schema_editor.connection.cursor() as cursor:
+                cursor.executemany(sql, parametros)
+        ultimo_id = filas[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('calificaciones', '0021_contadores_facetas'),
+    ]
+
+    operations = [
+        migrations.RunPython(reempaquetar, migrations.RunPython.noop),
+    ]
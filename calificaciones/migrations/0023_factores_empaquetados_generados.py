@@ -0,0 +1,55 @@
+# Generated by Django 5.2.8 on 2026-10-18 12:10
+
+import calificaciones.factores
+from django.db import migrations, models
+
+TABLA_STAGING = 'calificaciones_carga_staging'
+
+
+def quitar_empaquetado_staging(apps, schema_editor):
+    # La carga masiva ya no envía la copia empaquetada: la calcula la base de datos
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        f'ALTER TABLE IF EXISTS {TABLA_STAGING} DROP COLUMN IF EXISTS empaquetado, DROP COLUMN IF EXISTS nulos'
+    )
+
+
+def restaurar_empaquetado_staging(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        f'ALTER TABLE IF EXISTS {TABLA_STAGING} '
+        'ADD COLUMN IF NOT EXISTS empaquetado bytea, ADD COLUMN IF NOT EXISTS nulos integer'
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calificaciones', '0022_factores_empaquetados_int32'),
+    ]
+
+    # Las columnas pasan a ser generadas (big-endian, ver calificaciones/factores.py):
+    # la base de datos las recalcula para todas las filas existentes al agregarlas
+    operations = [
+        migrations.RemoveField(
+            model_name='factorescalificacion',
+            name='empaquetado',
+        ),
+        migrations.RemoveField(
+            model_name='factorescalificacion',
+            name='nulos',
+        ),
+        migrations.AddField(
+            model_name='factorescalificacion',
+            name='empaquetado',
+            field=models.GeneratedField(db_persist=True, expression=calificaciones.factores.ExpresionEmpaquetado(), output_field=models.BinaryField()),
+        ),
+        migrations.AddField(
+            model_name='factorescalificacion',
+            name='nulos',
+            field=models.GeneratedField(db_persist=True, expression=calificaciones.factores.expresion_nulos(), output_field=models.IntegerField()),
+        ),
+        migrations.RunPython(quitar_empaquetado_staging, restaurar_empaquetado_staging),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calificaciones', '0023_factores_empaquetados_generados'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivocarga',
+            name='errores_confirmados',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
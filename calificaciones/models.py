@@ -2,22 +2,19 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.db.models.signals import post_save
 from django.dispatch import receiver
-from django.core.exceptions import ValidationError
+import hashlib
 import secrets
 from datetime import timedelta
 from django.utils import timezone
 
+from .factores import (
+    CAMPOS_FACTORES, RESTRICCION_SUMA_8_16, ExpresionEmpaquetado, desempaquetar, empaquetar, expresion_nulos,
+    expresion_suma_8_16,
+)
+
 # ==========================================
 # MODELOS PRINCIPALES
 # ==========================================
-def clean(self):
-    if not self.validar_factores():
-        raise ValidationError("La suma de los factores del 8 al 16 no puede ser mayor que 1.")
-    
-def save(self, *args, **kwargs):
-    self.clean()
-    super().save(*args, **kwargs)
-
 class Empresa(models.Model):
     usuario = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True) 
     rut = models.CharField(max_length=20, unique=True)
@@ -60,7 +57,29 @@ class CalificacionTributaria(models.Model):
     valor_historico = models.DecimalField(max_digits=15, decimal_places=2, blank=True, null=True)
     fecha_creacion = models.DateTimeField(auto_now_add=True)
     fecha_modificacion = models.DateTimeField(auto_now=True)
-    
+
+    class Meta:
+        # Índices para los filtros y el orden (fecha_pago, id) del mantenedor y del panel admin.
+        # En PostgreSQL la migración 0010 agrega además índices GIN de trigramas
+        # sobre UPPER(mercado) y UPPER(instrumento) para los filtros icontains.
+        indexes = [
+            models.Index(fields=['usuario', 'ejercicio', 'fecha_pago', 'id'], name='calif_usr_ejer_fecha_idx'),
+            models.Index(fields=['usuario', 'fecha_pago', 'id'], name='calif_usr_fecha_idx'),
+            models.Index(fields=['ejercicio', 'fecha_pago', 'id'], name='calif_ejer_fecha_idx'),
+            models.Index(fields=['fecha_pago', 'id'], name='calif_fecha_idx'),
+        ]
+        # Clave natural: al volver a cargar un archivo corregido se actualizan las
+        # calificaciones existentes en vez de duplicarlas (ver importacion.py)
+        constraints = [
+            models.UniqueConstraint(
+                fields=['empresa', 'ejercicio', 'mercado', 'instrumento', 'secuencia_evento'],
+                name='calif_clave_natural',
+                violation_error_message=(
+                    'Ya existe una calificación con esta empresa, ejercicio, mercado, instrumento y secuencia.'
+                ),
+            ),
+        ]
+
     def __str__(self):
         return f"{self.instrumento} - {self.ejercicio}"
 
@@ -97,6 +116,53 @@ class FactoresCalificacion(models.Model):
     factor_35 = models.DecimalField(max_digits=9, decimal_places=8, blank=True, null=True)
     factor_36 = models.DecimalField(max_digits=9, decimal_places=8, blank=True, null=True)
     factor_37 = models.DecimalField(max_digits=9, decimal_places=8, blank=True, null=True)
+    # Copia empaquetada de los 30 factores para lecturas masivas (ver calificaciones/factores.py),
+    # calculada por la base de datos (columnas generadas) para que ningún UPDATE la deje desfasada
+    empaquetado = models.GeneratedField(
+        expression=ExpresionEmpaquetado(),
+        output_field=models.BinaryField(),
+        db_persist=True,
+    )
+    nulos = models.GeneratedField(
+        expression=expresion_nulos(),
+        output_field=models.IntegerField(),
+        db_persist=True,
+    )
+    # Suma 8-16 calculada y guardada por la base de datos (columna generada)
+    suma_8_16 = models.GeneratedField(
+        expression=expresion_suma_8_16(),
+        output_field=models.DecimalField(max_digits=10, decimal_places=8),
+        db_persist=True,
+    )
+
+    class Meta:
+        # Ordenar y filtrar por la suma en el admin ("solo inválidos") sin recorrer la tabla
+        indexes = [
+            models.Index(fields=['suma_8_16', 'id'], name='factores_suma_8_16_idx'),
+        ]
+        # La regla 8-16 <= 1 la hace cumplir la base de datos, también en inserciones masivas
+        constraints = [
+            models.CheckConstraint(
+                condition=models.Q(suma_8_16__lte=1),
+                name=RESTRICCION_SUMA_8_16,
+                violation_error_message='La suma de los factores del 8 al 16 no puede ser mayor que 1.',
+            ),
+        ]
+
+    def empaquetar(self):
+        """(bytes, nulos) de los valores en memoria, para validar antes de guardar"""
+        return empaquetar([getattr(self, campo) for campo in CAMPOS_FACTORES])
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        # Con .only('empaquetado', 'nulos') los factor_N se reconstruyen desde la
+        # copia empaquetada en vez de cargarse uno por uno como campos diferidos
+        cargados = instancia.__dict__
+        if cargados.get('empaquetado') is not None and 'nulos' in cargados and 'factor_8' not in field_names:
+            valores = desempaquetar(instancia.empaquetado, instancia.nulos)
+            instancia.__dict__.update(zip(CAMPOS_FACTORES, valores))
+        return instancia
     
     def validar_factores(self):
         """Valida que la suma de factores 8-16 sea <= 1"""
@@ -113,18 +179,88 @@ class ArchivoCarga(models.Model):
         ('MONTOS', 'Montos'),
         ('FACTORES', 'Factores'),
     ]
-    
+
     empresa = models.ForeignKey(Empresa, on_delete=models.CASCADE)
     nombre_archivo = models.CharField(max_length=255)
+    archivo = models.FileField(upload_to='cargas/%Y/%m/', blank=True, null=True)
     tipo_carga = models.CharField(max_length=20, choices=TIPO_CARGA)
     fecha_carga = models.DateTimeField(auto_now_add=True)
     estado = models.CharField(max_length=20, default='PENDIENTE')
     registros_procesados = models.IntegerField(default=0)
     registros_error = models.IntegerField(default=0)
-    
+    # Desglose de las filas procesadas según lo que hizo la fusión con los datos existentes
+    registros_insertados = models.IntegerField(default=0)
+    registros_actualizados = models.IntegerField(default=0)
+    registros_sin_cambios = models.IntegerField(default=0)
+    mensaje_error = models.TextField(blank=True, default='')
+    # Control de la cola de procesamiento (ver calificaciones/cola.py)
+    intentos = models.IntegerField(default=0)
+    proximo_intento = models.DateTimeField(null=True, blank=True)
+    trabajador = models.CharField(max_length=100, blank=True, default='')
+    latido = models.DateTimeField(null=True, blank=True)
+    ultima_linea = models.IntegerField(default=0)  # Última línea confirmada en la base de datos
+    ultimo_byte = models.BigIntegerField(default=0)  # Posición del archivo justo después de ultima_linea
+    # Detalle de los errores hasta ultima_linea, para no perderlos al retomar desde el checkpoint
+    errores_confirmados = models.JSONField(default=list, blank=True)
+    tamano = models.BigIntegerField(default=0)
+    sha256 = models.CharField(max_length=64, blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['estado', 'fecha_carga']),
+        ]
+
     def __str__(self):
         return f"{self.nombre_archivo} - {self.fecha_carga}"
 
+    @property
+    def porcentaje_avance(self):
+        """Porcentaje del archivo ya confirmado en la base de datos"""
+        if not self.tamano:
+            return 0
+        return min(100, round(100 * self.ultimo_byte / self.tamano))
+
+
+class SubidaCarga(models.Model):
+    """Subida por partes de un archivo de carga masiva (ver calificaciones/subidas.py)"""
+    ESTADOS = [
+        ('RECIBIENDO', 'Recibiendo'),
+        ('COMPLETA', 'Completa'),
+        ('CANCELADA', 'Cancelada'),
+    ]
+
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE)
+    empresa = models.ForeignKey(Empresa, on_delete=models.CASCADE)
+    tipo_carga = models.CharField(max_length=20, choices=ArchivoCarga.TIPO_CARGA)
+    nombre_archivo = models.CharField(max_length=255)
+    tamano = models.BigIntegerField()
+    recibidos = models.BigIntegerField(default=0)  # Bytes contiguos ya escritos en el spool
+    sha256 = models.CharField(max_length=64, blank=True, default='')  # Declarado por el cliente (opcional)
+    estado = models.CharField(max_length=20, choices=ESTADOS, default='RECIBIENDO')
+    archivo_carga = models.OneToOneField(ArchivoCarga, on_delete=models.SET_NULL, null=True, blank=True)
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['estado', 'fecha_actualizacion']),
+        ]
+
+    def __str__(self):
+        return f"{self.nombre_archivo} ({self.recibidos}/{self.tamano} bytes)"
+
+# ==========================================
+# CONTADORES MATERIALIZADOS
+# ==========================================
+
+class Contador(models.Model):
+    """Total precalculado para los paneles (ver calificaciones/contadores.py)"""
+    clave = models.CharField(max_length=100, unique=True)
+    valor = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.clave} = {self.valor}"
+
 # ==========================================
 # MODELO USERPROFILE 
 # ==========================================
@@ -185,6 +321,43 @@ def save_user_profile(sender, instance, **kwargs):
     if hasattr(instance, 'profile'):
         instance.profile.save()
 
+# ==========================================
+# BANDEJA DE SALIDA DE CORREOS
+# ==========================================
+
+class CorreoSaliente(models.Model):
+    """Correo pendiente de envío; lo entrega manage.py enviar_correos (ver calificaciones/correo.py)"""
+    ESTADOS = [
+        ('PENDIENTE', 'Pendiente'),
+        ('ENVIANDO', 'Enviando'),
+        ('ENVIADO', 'Enviado'),
+        ('ERROR', 'Error'),
+    ]
+
+    asunto = models.CharField(max_length=255)
+    cuerpo = models.TextField()
+    cuerpo_html = models.TextField(blank=True, default='')
+    remitente = models.CharField(max_length=255)
+    destinatarios = models.JSONField(default=list)
+    estado = models.CharField(max_length=20, choices=ESTADOS, default='PENDIENTE')
+    intentos = models.IntegerField(default=0)
+    proximo_intento = models.DateTimeField(null=True, blank=True)
+    trabajador = models.CharField(max_length=100, blank=True, default='')
+    reclamado = models.DateTimeField(null=True, blank=True)
+    ultimo_error = models.TextField(blank=True, default='')
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_envio = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Correo saliente"
+        verbose_name_plural = "Correos salientes"
+        indexes = [
+            models.Index(fields=['estado', 'proximo_intento']),
+        ]
+
+    def __str__(self):
+        return f"{self.asunto} -> {', '.join(self.destinatarios)} ({self.estado})"
+
 class PasswordResetToken(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     token = models.CharField(max_length=64, unique=True)
@@ -222,4 +395,34 @@ class PasswordResetToken(models.Model):
         return f"Token for {self.user.email} - {'Valid' if self.is_valid() else 'Expired'}"
 
 
-        
\ No newline at end of file
+        
+# ==========================================
+# TOKENS DE LA API
+# ==========================================
+
+class TokenAPI(models.Model):
+    """Credencial de un sistema externo para la API por lotes (ver calificaciones/api.py)"""
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='tokens_api')
+    nombre = models.CharField(max_length=100)
+    # Solo se guarda el SHA-256: el token en claro se muestra una vez al crearlo
+    clave_hash = models.CharField(max_length=64, unique=True, editable=False)
+    activo = models.BooleanField(default=True)
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    ultimo_uso = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Token de API"
+        verbose_name_plural = "Tokens de API"
+
+    @staticmethod
+    def calcular_hash(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    @classmethod
+    def crear(cls, usuario, nombre):
+        """Crea un token nuevo. Devuelve (instancia, token en claro)"""
+        token = secrets.token_urlsafe(32)
+        return cls.objects.create(usuario=usuario, nombre=nombre, clave_hash=cls.calcular_hash(token)), token
+
+    def __str__(self):
+        return f"{self.nombre} ({self.usuario.username})"
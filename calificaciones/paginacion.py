@@ -0,0 +1,143 @@
+import base64
+import binascii
+import json
+import math
+from dataclasses import dataclass
+from datetime import date
+
+from django.db import connections
+from django.db.models import Q
+
+# ==========================================
+# PAGINACIÓN POR CURSOR (KEYSET)
+# ==========================================
+#
+# En vez de OFFSET, cada página continúa desde la última fila mostrada
+# usando el orden (fecha_pago, id). El costo de una página es el mismo
+# sin importar cuán profundo haya avanzado el usuario.
+
+TAMANO_PAGINA = 50
+TAMANO_MAXIMO = 500
+
+# Sobre este número de filas estimadas no se hace COUNT(*) exacto
+UMBRAL_CONTEO_EXACTO = 10000
+MAXIMO_ID = 2 ** 63 - 1
+
+
+class CursorInvalido(ValueError):
+    """El cursor recibido no se puede decodificar (alterado a mano o truncado)"""
+
+
+@dataclass
+class Pagina:
+    elementos: list
+    siguiente: str = None  # Cursor de la página siguiente (None si es la última)
+
+
+def _codificar(clave, pk):
+    return base64.urlsafe_b64encode(f'{clave}|{pk}'.encode()).decode().rstrip('=')
+
+
+def _decodificar(token, convertir):
+    """Devuelve (convertir(clave), id), o None sin cursor. Lanza CursorInvalido si no es válido"""
+    if not token:
+        return None
+    try:
+        relleno = '=' * (-len(token) % 4)
+        clave, pk = base64.urlsafe_b64decode(token + relleno).decode().split('|')
+        clave, pk = convertir(clave), int(pk)
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        raise CursorInvalido(token)
+    if not 0 < pk <= MAXIMO_ID:
+        raise CursorInvalido(token)
+    return clave, pk
+
+
+def _relevancia(texto):
+    valor = float(texto)
+    if not math.isfinite(valor):
+        raise ValueError(texto)
+    return valor
+
+
+def codificar_cursor(fecha_pago, pk):
+    return _codificar(fecha_pago.isoformat(), pk)
+
+
+def decodificar_cursor(token):
+    """Devuelve (fecha_pago, id), o None sin cursor. Lanza CursorInvalido si no es válido"""
+    return _decodificar(token, date.fromisoformat)
+
+
+def tamano_pagina(valor):
+    try:
+        return min(max(int(valor), 1), TAMANO_MAXIMO)
+    except (TypeError, ValueError):
+        return TAMANO_PAGINA
+
+
+def _valor(elemento, campo):
+    return elemento[campo] if isinstance(elemento, dict) else getattr(elemento, campo)
+
+
+def paginar(queryset, cursor=None, tamano=TAMANO_PAGINA):
+    """
+    Devuelve una Pagina de `queryset` ordenada por fecha de pago descendente.
+    Acepta querysets de modelos o de .values() (que deben incluir fecha_pago e id).
+    Lanza CursorInvalido si `cursor` no es uno generado por esta función.
+    """
+    queryset = queryset.order_by('-fecha_pago', '-id')
+
+    posicion = decodificar_cursor(cursor)
+    if posicion:
+        fecha_pago, pk = posicion
+        queryset = queryset.filter(Q(fecha_pago__lt=fecha_pago) | Q(fecha_pago=fecha_pago, id__lt=pk))
+
+    # Se pide una fila extra para saber si existe una página siguiente
+    elementos = list(queryset[:tamano + 1])
+    siguiente = None
+    if len(elementos) > tamano:
+        elementos = elementos[:tamano]
+        ultimo = elementos[-1]
+        siguiente = codificar_cursor(_valor(ultimo, 'fecha_pago'), _valor(ultimo, 'id'))
+
+    return Pagina(elementos=elementos, siguiente=siguiente)
+
+
+def paginar_por_relevancia(queryset, cursor=None, tamano=TAMANO_PAGINA):
+    """
+    Igual que paginar, pero ordenando por la anotación `relevancia` (ver
+    busqueda.buscar) y luego por id. El cursor guarda la relevancia exacta
+    (repr de un float de 64 bits) para continuar sin OFFSET.
+    """
+    queryset = queryset.order_by('-relevancia', '-id')
+
+    posicion = _decodificar(cursor, _relevancia)
+    if posicion:
+        relevancia, pk = posicion
+        queryset = queryset.filter(Q(relevancia__lt=relevancia) | Q(relevancia=relevancia, id__lt=pk))
+
+    elementos = list(queryset[:tamano + 1])
+    siguiente = None
+    if len(elementos) > tamano:
+        elementos = elementos[:tamano]
+        ultimo = elementos[-1]
+        siguiente = _codificar(repr(float(_valor(ultimo, 'relevancia'))), _valor(ultimo, 'id'))
+
+    return Pagina(elementos=elementos, siguiente=siguiente)
+
+
+def contar(queryset):
+    """
+    Devuelve (total, es_estimado). En PostgreSQL usa la estimación del
+    planificador y solo cuenta exactamente cuando el resultado es pequeño.
+    """
+    queryset = queryset.order_by()
+    if connections[queryset.db].vendor == 'postgresql':
+        plan = json.loads(queryset.values('id').explain(format='json'))
+        if isinstance(plan, list):
+            plan = plan[0]
+        estimado = int(plan['Plan']['Plan Rows'])
+        if estimado > UMBRAL_CONTEO_EXACTO:
+            return estimado, True
+    return queryset.count(), False
@@ -0,0 +1,233 @@
+from dataclasses import dataclass
+from datetime import date, timedelta
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import contadores
+from .factores import CAMPOS_FACTORES, ESCALA
+from .importacion import copiar
+from .models import CalificacionTributaria, Empresa, FactoresCalificacion
+
+# ==========================================
+# DATOS SINTÉTICOS A ESCALA DE PRODUCCIÓN
+# ==========================================
+#
+# Genera empresas, usuarios y millones de calificaciones con sus factores para
+# reproducir localmente problemas de rendimiento. Las filas se generan por
+# bloques de TAMANO_BLOQUE con un generador NumPy sembrado con (semilla, bloque),
+# así que el resultado es el mismo sin importar cuántos trabajadores se usen.
+#
+# En PostgreSQL los ids de las calificaciones se reservan de antemano en la
+# secuencia y cada trabajador inserta sus bloques con COPY en paralelo; en
+# otros motores se usa INSERT con executemany en un solo proceso.
+
+PREFIJO_USUARIOS = 'sintetico_'
+PREFIJO_RUT = 'SINT-'
+TAMANO_BLOQUE = 10000
+
+# Distribuciones aproximadas a las de producción
+EJERCICIOS = np.arange(2015, 2025)
+PESOS_EJERCICIOS = 1.25 ** np.arange(len(EJERCICIOS))  # Los años recientes pesan más
+MERCADOS = np.array(['ACN', 'CFI', 'FONDOS', 'DERIVADOS'])
+PESOS_MERCADOS = np.array([0.55, 0.15, 0.20, 0.10])
+ORIGENES = np.array(['CARGA_MASIVA', 'CORREDOR', 'SISTEMA'])
+PESOS_ORIGENES = np.array([0.70, 0.20, 0.10])
+SERIES_POR_EMPRESA = 20
+PROPORCION_TEMPORADA = 0.7  # Pagos concentrados entre abril y mayo (juntas de accionistas)
+PROPORCION_NULOS = 0.1
+
+COLUMNAS_CALIFICACION = [
+    'id', 'usuario_id', 'empresa_id', 'ejercicio', 'mercado', 'instrumento', 'fecha_pago',
+    'secuencia_evento', 'acogido_isfut', 'origen', 'fecha_creacion', 'fecha_modificacion',
+]
+COLUMNAS_FACTORES = ['calificacion_id', *CAMPOS_FACTORES]
+
+
+@dataclass
+class Plan:
+    semilla: int
+    total: int
+    id_inicial: int           # Primer id reservado para las calificaciones
+    empresas: np.ndarray      # ids de empresa
+    duenos: np.ndarray        # usuario_id dueño de cada empresa
+    pesos_empresas: np.ndarray
+
+    @property
+    def bloques(self):
+        return range((self.total + TAMANO_BLOQUE - 1) // TAMANO_BLOQUE)
+
+
+def pesos_zipf(cantidad, exponente=1.1):
+    """Pocas empresas concentran la mayoría de las calificaciones"""
+    pesos = 1 / np.arange(1, cantidad + 1) ** exponente
+    return pesos / pesos.sum()
+
+
+def _normalizar(pesos):
+    return pesos / pesos.sum()
+
+
+# ==========================================
+# GENERACIÓN
+# ==========================================
+
+def generar_factores(rng, n):
+    """
+    Factores 8-37 escalados por 1e8 (N, 30) y su máscara de nulos.
+    Los factores 8-16 se reparten una suma <= 1 y se truncan hacia abajo,
+    por lo que toda fila cumple el invariante de validar_factores.
+    """
+    ancho = len(CAMPOS_FACTORES)
+    totales = rng.random(n)
+    reparto = rng.dirichlet(np.ones(9), n)
+    valores = np.empty((n, ancho), dtype=np.int64)
+    valores[:, :9] = np.floor(reparto * totales[:, None] * ESCALA).astype(np.int64)
+    valores[:, 9:] = rng.integers(0, ESCALA, size=(n, ancho - 9))
+
+    nulos = rng.random((n, ancho)) < PROPORCION_NULOS
+    valores[nulos] = 0
+    return valores, nulos
+
+
+def generar_bloque(plan, bloque):
+    """Columnas de las calificaciones y factores del bloque `bloque` (determinista)"""
+    rng = np.random.default_rng([plan.semilla, bloque])
+    desde = bloque * TAMANO_BLOQUE
+    n = min(TAMANO_BLOQUE, plan.total - desde)
+
+    indices_empresa = rng.choice(len(plan.empresas), size=n, p=plan.pesos_empresas)
+    ejercicios = rng.choice(EJERCICIOS, size=n, p=_normalizar(PESOS_EJERCICIOS))
+    temporada = rng.random(n) < PROPORCION_TEMPORADA
+    dias = np.where(temporada, rng.integers(90, 151, size=n), rng.integers(0, 365, size=n))
+    series = rng.integers(0, SERIES_POR_EMPRESA, size=n)
+
+    valores, nulos = generar_factores(rng, n)
+    return {
+        'ids': np.arange(plan.id_inicial + desde, plan.id_inicial + desde + n),
+        'empresas': plan.empresas[indices_empresa],
+        'usuarios': plan.duenos[indices_empresa],
+        'instrumentos': [f'SINT{e:05d}-{s:02d}' for e, s in zip(indices_empresa.tolist(), series.tolist())],
+        'ejercicios': ejercicios,
+        'mercados': rng.choice(MERCADOS, size=n, p=PESOS_MERCADOS),
+        'fechas': [date(int(a), 1, 1) + timedelta(days=int(d)) for a, d in zip(ejercicios, dias)],
+        'secuencias': np.arange(desde, desde + n) + 10000,
+        'origenes': rng.choice(ORIGENES, size=n, p=PESOS_ORIGENES),
+        'valores': valores,
+        'nulos': nulos,
+    }
+
+
+def _texto_factor(valor, nulo):
+    if nulo:
+        return None
+    return f'{valor // ESCALA}.{valor % ESCALA:08d}'
+
+
+# ==========================================
+# INSERCIÓN
+# ==========================================
+
+def _insertar(cursor, tabla, columnas, filas):
+    """INSERT con executemany para motores sin COPY (desarrollo con SQLite)"""
+    marcadores = ', '.join(['%s'] * len(columnas))
+    cursor.executemany(f'INSERT INTO {tabla} ({", ".join(columnas)}) VALUES ({marcadores})', filas)
+
+
+def insertar_bloque(plan, bloque):
+    """Genera e inserta un bloque. Devuelve la cantidad de calificaciones insertadas"""
+    datos = generar_bloque(plan, bloque)
+    n = len(datos['ids'])
+    operaciones = connection.ops
+    ahora = operaciones.adapt_datetimefield_value(timezone.now())
+    calificaciones = list(zip(
+        datos['ids'].tolist(), datos['usuarios'].tolist(), datos['empresas'].tolist(),
+        datos['ejercicios'].tolist(), datos['mercados'].tolist(), datos['instrumentos'],
+        [operaciones.adapt_datefield_value(fecha) for fecha in datos['fechas']],
+        datos['secuencias'].tolist(), [False] * n, datos['origenes'].tolist(), [ahora] * n, [ahora] * n,
+    ))
+    valores, nulos = datos['valores'].tolist(), datos['nulos'].tolist()
+    factores = [
+        [fila[0], *map(_texto_factor, valores[i], nulos[i])]
+        for i, fila in enumerate(calificaciones)
+    ]
+
+    # Sin pasar por el ORM: con 30 DecimalField por fila la preparación de
+    # valores de bulk_create cuesta más que la propia inserción
+    volcar = copiar if connection.vendor == 'postgresql' else _insertar
+    with transaction.atomic(), connection.cursor() as cursor:
+        volcar(cursor, CalificacionTributaria._meta.db_table, COLUMNAS_CALIFICACION, calificaciones)
+        volcar(cursor, FactoresCalificacion._meta.db_table, COLUMNAS_FACTORES, factores)
+    return n
+
+
+# ==========================================
+# PREPARACIÓN Y LIMPIEZA
+# ==========================================
+
+def existen_datos():
+    return Empresa.objects.filter(rut__startswith=PREFIJO_RUT).exists()
+
+
+def crear_usuarios(cantidad):
+    # Uno por uno para que la señal cree el Profile de cada usuario
+    return [
+        User.objects.create_user(f'{PREFIJO_USUARIOS}{i}', email=f'{PREFIJO_USUARIOS}{i}@example.com')
+        for i in range(cantidad)
+    ]
+
+
+def crear_empresas(cantidad, usuarios, semilla):
+    """Empresas repartidas entre los usuarios. Devuelve (ids, ids de dueño) en orden de creación"""
+    rng = np.random.default_rng([semilla, 0xE])
+    duenos = rng.choice([u.id for u in usuarios], size=cantidad)
+    empresas = Empresa.objects.bulk_create([
+        Empresa(
+            usuario_id=int(dueno),
+            rut=f'{PREFIJO_RUT}{i:07d}',
+            nombre=f'Empresa sintética {i}',
+            giro='Sociedad de inversiones',
+        )
+        for i, dueno in enumerate(duenos)
+    ], batch_size=1000)
+    if empresas and empresas[0].pk is None:
+        # Motores sin RETURNING en inserciones masivas
+        empresas = list(Empresa.objects.filter(rut__startswith=PREFIJO_RUT).order_by('rut'))
+    return np.array([e.pk for e in empresas]), np.array([e.usuario_id for e in empresas])
+
+
+def reservar_ids(cantidad):
+    """Primer id de un rango de `cantidad` ids libres para CalificacionTributaria"""
+    tabla = CalificacionTributaria._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # Avanza la secuencia de una vez; las altas normales siguen después del rango
+            cursor.execute(
+                "SELECT setval(pg_get_serial_sequence(%s, 'id'), nextval(pg_get_serial_sequence(%s, 'id')) + %s - 1)",
+                [tabla, tabla, cantidad],
+            )
+            return cursor.fetchone()[0] - cantidad + 1
+        cursor.execute(f'SELECT COALESCE(MAX(id), 0) FROM {tabla}')
+        return cursor.fetchone()[0] + 1
+
+
+def finalizar():
+    """Recalcula los contadores con las facetas (las inserciones masivas no disparan señales) y las estadísticas"""
+    contadores.recalcular()
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            for modelo in (Empresa, CalificacionTributaria, FactoresCalificacion):
+                cursor.execute(f'ANALYZE {modelo._meta.db_table}')
+
+
+def limpiar():
+    """Elimina todos los datos sintéticos con SQL directo (sin cargar los objetos)"""
+    empresas = Empresa.objects.filter(rut__startswith=PREFIJO_RUT)
+    with transaction.atomic():
+        FactoresCalificacion.objects.filter(calificacion__empresa__in=empresas)._raw_delete(connection.alias)
+        CalificacionTributaria.objects.filter(empresa__in=empresas)._raw_delete(connection.alias)
+        empresas._raw_delete(connection.alias)
+        User.objects.filter(username__startswith=PREFIJO_USUARIOS).delete()
+    contadores.recalcular()
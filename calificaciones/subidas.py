@@ -0,0 +1,203 @@
+import hashlib
+import logging
+import os
+import re
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ArchivoCarga, SubidaCarga
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# SUBIDA POR PARTES DE ARCHIVOS DE CARGA
+# ==========================================
+#
+# Los archivos grandes no se envían en un solo POST multipart (el proxy corta
+# la petición y un corte obliga a empezar de cero): el navegador los divide en
+# partes de CARGA_MASIVA_TAMANO_PARTE bytes y las envía en orden, cada una con
+# su SHA-256. Cada parte se escribe en su posición de un archivo de paso
+# (spool) y `recibidos` solo avanza si la suma coincide; tras un corte el
+# cliente consulta `recibidos` y continúa desde ahí.
+#
+# Al completar se verifica el tamaño y el SHA-256 del archivo entero (contra el
+# declarado por el cliente, si lo envió), el spool se mueve junto a los demás
+# archivos de carga y queda en la cola como cualquier ArchivoCarga.
+#
+# El spool se escribe con acceso directo dentro de MEDIA_ROOT, por lo que se
+# requiere el almacenamiento local (FileSystemStorage).
+
+DIRECTORIO_SPOOL = 'cargas/subidas'
+TAMANO_LECTURA = 1024 * 1024
+PATRON_SHA256 = re.compile(r'^[0-9a-f]{64}$')
+
+
+class ErrorSubida(Exception):
+    """La subida o la parte no se pueden aceptar"""
+
+
+class ConflictoPosicion(ErrorSubida):
+    """La parte no empieza donde termina lo ya recibido"""
+
+    def __init__(self, recibidos):
+        super().__init__(f'La parte debe comenzar en el byte {recibidos}')
+        self.recibidos = recibidos
+
+
+def ruta_spool(subida):
+    return default_storage.path(f'{DIRECTORIO_SPOOL}/{subida.pk}.part')
+
+
+def _sha256_valido(valor):
+    valor = (valor or '').strip().lower()
+    if valor and not PATRON_SHA256.match(valor):
+        raise ErrorSubida('La suma SHA-256 debe tener 64 caracteres hexadecimales')
+    return valor
+
+
+def _borrar_spool(subida):
+    try:
+        os.remove(ruta_spool(subida))
+    except FileNotFoundError:
+        pass
+
+
+def iniciar(usuario, empresa, tipo_carga, nombre_archivo, tamano, sha256=''):
+    """Registra una subida nueva y crea su spool vacío"""
+    if tamano <= 0:
+        raise ErrorSubida('El archivo está vacío')
+    if tamano > settings.CARGA_MASIVA_TAMANO_MAXIMO:
+        raise ErrorSubida(f'El archivo supera el máximo de {settings.CARGA_MASIVA_TAMANO_MAXIMO} bytes')
+
+    subida = SubidaCarga.objects.create(
+        usuario=usuario,
+        empresa=empresa,
+        tipo_carga=tipo_carga,
+        nombre_archivo=os.path.basename(nombre_archivo)[:255],
+        tamano=tamano,
+        sha256=_sha256_valido(sha256),
+    )
+    ruta = ruta_spool(subida)
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    open(ruta, 'wb').close()
+    return subida
+
+
+def recibir_parte(subida, desde, flujo, longitud, sha256=''):
+    """
+    Escribe en la posición `desde` del spool los `longitud` bytes leídos de
+    `flujo` (el cuerpo de la petición, sin cargarlo entero en memoria).
+    Devuelve los bytes recibidos; repetir una parte ya recibida no hace nada.
+    """
+    sha256 = _sha256_valido(sha256)
+    if subida.estado != 'RECIBIENDO':
+        raise ErrorSubida('La subida ya no admite partes')
+    if desde < 0 or longitud <= 0 or desde + longitud > subida.tamano:
+        raise ErrorSubida('La parte está fuera del tamaño declarado del archivo')
+    if desde + longitud <= subida.recibidos:
+        return subida.recibidos  # Reintento de una parte que sí llegó
+    if desde != subida.recibidos:
+        raise ConflictoPosicion(subida.recibidos)
+
+    suma = hashlib.sha256()
+    escritos = 0
+    with open(ruta_spool(subida), 'r+b') as spool:
+        spool.seek(desde)
+        while escritos < longitud:
+            bloque = flujo.read(min(TAMANO_LECTURA, longitud - escritos))
+            if not bloque:
+                break
+            spool.write(bloque)
+            suma.update(bloque)
+            escritos += len(bloque)
+        # Lo confirmado en `recibidos` tiene que sobrevivir a una caída del servidor
+        spool.flush()
+        os.fsync(spool.fileno())
+
+    if escritos != longitud:
+        raise ErrorSubida(f'La parte llegó incompleta ({escritos} de {longitud} bytes)')
+    if sha256 and suma.hexdigest() != sha256:
+        raise ErrorSubida('La suma SHA-256 de la parte no coincide; vuelva a enviarla')
+
+    # Solo avanza si ninguna otra petición lo hizo mientras tanto. update() no aplica auto_now
+    avanzadas = SubidaCarga.objects.filter(pk=subida.pk, estado='RECIBIENDO', recibidos=desde).update(
+        recibidos=desde + longitud,
+        fecha_actualizacion=timezone.now(),
+    )
+    if not avanzadas:
+        subida.refresh_from_db()
+        raise ConflictoPosicion(subida.recibidos)
+    subida.recibidos = desde + longitud
+    return subida.recibidos
+
+
+def calcular_sha256(ruta):
+    suma = hashlib.sha256()
+    with open(ruta, 'rb') as archivo:
+        for bloque in iter(partial(archivo.read, TAMANO_LECTURA), b''):
+            suma.update(bloque)
+    return suma.hexdigest()
+
+
+def completar(subida):
+    """Verifica el archivo ensamblado y lo deja en la cola de procesamiento. Devuelve el ArchivoCarga"""
+    if subida.estado != 'RECIBIENDO':
+        raise ErrorSubida('La subida ya fue completada o cancelada')
+    if subida.recibidos != subida.tamano:
+        raise ErrorSubida(f'Faltan {subida.tamano - subida.recibidos} bytes por recibir')
+
+    ruta = ruta_spool(subida)
+    if os.path.getsize(ruta) != subida.tamano:
+        raise ErrorSubida('El archivo ensamblado no tiene el tamaño declarado')
+    sha256 = calcular_sha256(ruta)
+    if subida.sha256 and sha256 != subida.sha256:
+        raise ErrorSubida('La suma SHA-256 del archivo no coincide con la declarada')
+
+    campo = ArchivoCarga._meta.get_field('archivo')
+    nombre = default_storage.get_available_name(
+        campo.generate_filename(None, subida.nombre_archivo), max_length=campo.max_length,
+    )
+    with transaction.atomic():
+        # Bloqueo: dos peticiones de completar no deben encolar el archivo dos veces
+        subida = SubidaCarga.objects.select_for_update().get(pk=subida.pk)
+        if subida.estado != 'RECIBIENDO':
+            raise ErrorSubida('La subida ya fue completada o cancelada')
+        archivo_carga = ArchivoCarga.objects.create(
+            empresa=subida.empresa,
+            nombre_archivo=subida.nombre_archivo,
+            archivo=nombre,
+            tipo_carga=subida.tipo_carga,
+            estado='PENDIENTE',
+            tamano=subida.tamano,
+            sha256=sha256,
+        )
+        SubidaCarga.objects.filter(pk=subida.pk).update(estado='COMPLETA', archivo_carga=archivo_carga)
+        destino = default_storage.path(nombre)
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        os.replace(ruta, destino)
+    return archivo_carga
+
+
+def cancelar(subida):
+    """Descarta una subida en curso y su spool"""
+    if SubidaCarga.objects.filter(pk=subida.pk, estado='RECIBIENDO').update(estado='CANCELADA'):
+        _borrar_spool(subida)
+        return True
+    return False
+
+
+def limpiar_vencidas():
+    """Cancela las subidas abandonadas (sin partes nuevas en CARGA_MASIVA_SUBIDA_VENCE_HORAS)"""
+    limite = timezone.now() - timedelta(hours=settings.CARGA_MASIVA_SUBIDA_VENCE_HORAS)
+    vencidas = [
+        subida for subida in SubidaCarga.objects.filter(estado='RECIBIENDO', fecha_actualizacion__lt=limite)
+        if cancelar(subida)
+    ]
+    if vencidas:
+        logger.info('Subidas vencidas canceladas: %s', len(vencidas))
+    return len(vencidas)
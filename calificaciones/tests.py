@@ -1,3 +1,1351 @@
-from django.test import TestCase
+import base64
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import random
+import shutil
+import smtplib
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.db.models import Value
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from openpyxl import Workbook, load_workbook
+
+from . import (
+    busqueda, cola, contadores, correo, facetas, importacion, instrumentacion, masivo, metricas, paginacion, plantillas,
+)
+from .backends import EmailOUsuarioBackend
+from .factores import (
+    CAMPOS_FACTORES, RESTRICCION_SUMA_8_16, MatrizFactores, a_decimal, analizar, analizar_queryset, cargar_matriz,
+    desempaquetar, empaquetar, validos_empaquetados,
+)
+from .importacion import COLUMNAS_FACTORES, COLUMNAS_MONTOS, factores_desde_montos, procesar_archivo
+from .models import (
+    ArchivoCarga, CalificacionTributaria, Contador, CorreoSaliente, Empresa, FactoresCalificacion, TokenAPI,
+)
+
+
+def crear_empresa(usuario, rut='76000000-0'):
+    return Empresa.objects.create(usuario=usuario, rut=rut, nombre=f'Empresa {rut}', giro='Inversiones')
+
+
+def crear_calificaciones(empresa, cantidad, instrumento='ACCION', **campos):
+    campos = {'ejercicio': 2024, 'mercado': 'ACN', 'fecha_pago': date(2024, 5, 1), 'origen': 'CORREDOR', **campos}
+    return CalificacionTributaria.objects.bulk_create([
+        CalificacionTributaria(
+            usuario=empresa.usuario, empresa=empresa, instrumento=f'{instrumento}{i}', secuencia_evento=i, **campos,
+        )
+        for i in range(cantidad)
+    ])
+
+
+def plantilla_csv(tipo_carga, filas):
+    """CSV de carga masiva con el encabezado corporativo, la fila de encabezados y `filas`"""
+    if tipo_carga == 'MONTOS':
+        encabezados = COLUMNAS_MONTOS + [f'MONTO_{i}' for i in range(8, 38)]
+    else:
+        encabezados = COLUMNAS_FACTORES + [f'FACTOR_{i}' for i in range(8, 38)]
+    lineas = ['NUAM CAPITAL,,', 'Declaración Jurada 1948,,', ','.join(encabezados)]
+    lineas += [','.join(map(str, fila)) for fila in filas]
+    return ('\r\n'.join(lineas) + '\r\n').encode()
+
+
+def fila_factores(secuencia, instrumento='ACCION'):
+    # Factores 8-16 suman 0.45
+    return [2024, 'ACN', f'{instrumento}{secuencia}', '2024-05-01', secuencia, 'Dividendo'] + ['0.05'] * 9 + ['0.5'] * 21
+
+
+class ConArchivos:
+    """MEDIA_ROOT temporal para los archivos de carga de la prueba"""
+
+    def setUp(self):
+        super().setUp()
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio, ignore_errors=True)
+        ajuste = override_settings(MEDIA_ROOT=directorio)
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+
+    def encolar_csv(self, empresa, contenido, tipo_carga='FACTORES', nombre='carga.csv'):
+        return cola.encolar(empresa, SimpleUploadedFile(nombre, contenido), tipo_carga)
+
+
+# ==========================================
+# MOTOR DE CARGA MASIVA
+# ==========================================
+
+class FactoresDesdeMontosTests(SimpleTestCase):
+
+    def test_montos_iguales_suman_exactamente_uno(self):
+        factores = factores_desde_montos([Decimal(100)] * 6 + [None] * 24)
+        self.assertEqual(sum(factores[:9]), 1)
+        self.assertEqual(sum(factores), 1)
+        self.assertEqual(sorted(set(factores[:6])), [Decimal('0.16666666'), Decimal('0.16666667')])
+
+    def test_reparte_por_mayor_resto(self):
+        factores = factores_desde_montos([Decimal(1), Decimal(1), Decimal(1)] + [None] * 27)
+        self.assertEqual(factores[:3], [Decimal('0.33333334'), Decimal('0.33333333'), Decimal('0.33333333')])
+        self.assertEqual(sum(factores), 1)
+
+    def test_montos_vacios_son_cero(self):
+        factores = factores_desde_montos([Decimal(5)] + [None] * 29)
+        self.assertEqual(factores[0], 1)
+        self.assertTrue(all(factor == 0 for factor in factores[1:]))
+
+
+class EmpaquetadoTests(SimpleTestCase):
+
+    def test_ida_y_vuelta_en_los_extremos(self):
+        valores = [Decimal('9.99999999'), Decimal('-9.99999999'), None, Decimal('0.00000001')] + [Decimal('0')] * 26
+        empaquetado, nulos = empaquetar(valores)
+        self.assertEqual(len(empaquetado), 120)
+        self.assertEqual(desempaquetar(empaquetado, nulos), valores)
+
+    def test_la_suma_8_16_no_desborda(self):
+        # Nueve factores de 9.99999999 suman más de lo que cabe en int32
+        grande, _ = empaquetar([Decimal('9.99999999')] * 9 + [None] * 21)
+        valido, _ = empaquetar([Decimal('0.1')] * 9 + [None] * 21)
+        self.assertEqual(list(validos_empaquetados([grande, valido])), [False, True])
+
+
+class EmpaquetadoGeneradoTests(TestCase):
+
+    def setUp(self):
+        usuario = User.objects.create_user('corredor', password='x')
+        calificacion, = crear_calificaciones(crear_empresa(usuario), 1)
+        self.valores = [Decimal('0.05')] * 9 + [Decimal('0.5')] * 20 + [None]
+        self.factores = FactoresCalificacion.objects.create(
+            calificacion=calificacion, **dict(zip(CAMPOS_FACTORES, self.valores)),
+        )
+
+    def leer(self):
+        return FactoresCalificacion.objects.only('empaquetado', 'nulos').get(pk=self.factores.pk)
+
+    def test_la_base_de_datos_calcula_la_copia(self):
+        factores = self.leer()
+        self.assertEqual(desempaquetar(factores.empaquetado, factores.nulos), self.valores)
+        self.assertEqual((factores.empaquetado, factores.nulos), empaquetar(self.valores))
+
+    def test_update_sin_save_no_deja_la_copia_desfasada(self):
+        FactoresCalificacion.objects.filter(pk=self.factores.pk).update(factor_8=Decimal('0.1'), factor_9=None)
+        factores = self.leer()
+        self.assertEqual((factores.factor_8, factores.factor_9), (Decimal('0.1'), None))
+        matriz = cargar_matriz(FactoresCalificacion.objects.filter(pk=self.factores.pk))
+        self.assertEqual((matriz.valores[0, 0], bool(matriz.nulos[0, 1])), (10_000_000, True))
+
+
+def resumen_decimal(filas):
+    """Referencia con Decimal para factores.analizar: filas de 30 Decimal/None"""
+    sumas = [sum(valor or 0 for valor in fila[:9]) for fila in filas]
+    estadisticas = []
+    for i, numero in enumerate(range(8, 38)):
+        presentes = [fila[i] for fila in filas if fila[i] is not None]
+        suma = sum(presentes, Decimal(0))
+        estadisticas.append({
+            'factor': numero,
+            'cantidad': len(presentes),
+            'suma': suma,
+            'promedio': (suma / len(presentes)).quantize(Decimal('0.00000001')) if presentes else None,
+            'minimo': min(presentes) if presentes else None,
+            'maximo': max(presentes) if presentes else None,
+        })
+    return sumas, [suma <= 1 for suma in sumas], estadisticas
+
+
+class AnalisisFactoresTests(TestCase):
+
+    def filas_aleatorias(self, cantidad, tope_8_16):
+        azar = random.Random(cantidad)
+
+        def valor(tope):
+            if azar.random() < 0.2:
+                return None
+            return Decimal(azar.randint(-tope, tope)).scaleb(-8)
+
+        # factor_37 siempre NULL: columna sin valores
+        return [
+            [valor(tope_8_16) for _ in range(9)] + [valor(999_999_999) for _ in range(20)] + [None]
+            for _ in range(cantidad)
+        ]
+
+    def matriz(self, filas):
+        valores = np.array([[int(valor.scaleb(8)) if valor is not None else 0 for valor in fila] for fila in filas], dtype=np.int64)
+        nulos = np.array([[valor is None for valor in fila] for fila in filas], dtype=bool)
+        return MatrizFactores(
+            ids=np.arange(1, len(filas) + 1, dtype=np.int64),
+            valores=valores.reshape(-1, len(CAMPOS_FACTORES)),
+            nulos=nulos.reshape(-1, len(CAMPOS_FACTORES)),
+        )
+
+    def assertIgualAReferencia(self, resumen, filas):
+        sumas, validos, estadisticas = resumen_decimal(filas)
+        self.assertEqual([a_decimal(suma) for suma in resumen.sumas_8_16], sumas)
+        self.assertEqual(resumen.validos.tolist(), validos)
+        self.assertEqual(resumen.estadisticas(), estadisticas)
+
+    def test_analizar_coincide_con_decimal(self):
+        # Sumas 8-16 a ambos lados de 1 y valores en los extremos de max_digits=9
+        filas = self.filas_aleatorias(500, 30_000_000)
+        filas[0][:9] = [Decimal('0.11111111')] * 8 + [Decimal('0.11111112')]  # Exactamente 1
+        filas[1][:9] = [Decimal('0.11111111')] * 8 + [Decimal('0.11111113')]  # 1.00000001
+        filas[2][9:11] = [Decimal('9.99999999'), Decimal('-9.99999999')]
+        resumen = analizar(self.matriz(filas))
+
+        self.assertIgualAReferencia(resumen, filas)
+        self.assertEqual(resumen.validos[:2].tolist(), [True, False])
+        self.assertTrue(0 < len(resumen.ids_invalidos) < len(filas))
+
+    def test_matriz_vacia(self):
+        resumen = analizar(self.matriz([]))
+        self.assertEqual(len(resumen.ids), 0)
+        self.assertIgualAReferencia(resumen, [])
+
+    def test_analizar_queryset_lee_la_base_de_datos(self):
+        filas = self.filas_aleatorias(40, 11_111_111)  # Nueve factores de hasta 0.11111111 cumplen la regla
+        for fila in filas:
+            fila[8] = None
+        filas[0][8] = Decimal('0.00000067')  # Único factor_16: Decimal lo mostraría como 6.7E-7
+        calificaciones = crear_calificaciones(crear_empresa(User.objects.create_user('corredor', password='x')), 40)
+        FactoresCalificacion.objects.bulk_create([
+            FactoresCalificacion(calificacion=calificacion, **dict(zip(CAMPOS_FACTORES, fila)))
+            for calificacion, fila in zip(calificaciones, filas)
+        ])
+        self.assertIgualAReferencia(analizar_queryset(FactoresCalificacion.objects.all(), chunk_size=7), filas)
+
+        salida = io.StringIO()
+        call_command('validar_factores', stdout=salida)
+        self.assertIn('📊 40 registros analizados', salida.getvalue())
+        self.assertIn('factor_16: n=1 min=0.00000067 max=0.00000067 promedio=0.00000067', salida.getvalue())
+        self.assertNotIn('E-', salida.getvalue())
+        self.assertNotIn('factor_37', salida.getvalue())
+
+
+# ==========================================
+# BÚSQUEDA DE TEXTO
+# ==========================================
+
+class BusquedaTests(TestCase):
+
+    def setUp(self):
+        self.usuario = User.objects.create_user('corredor', password='x')
+        self.client.force_login(self.usuario)
+        crear_calificaciones(crear_empresa(self.usuario), 5, descripcion_dividendo='dividendo definitivo')
+
+    def test_exportacion_incluye_todas_las_coincidencias(self):
+        with mock.patch.object(busqueda, 'LIMITE_CANDIDATOS', 2):
+            respuesta = self.client.get(reverse('calificaciones:exportar'), {'q': 'definitivo'})
+        lineas = b''.join(respuesta.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(len(lineas), 1 + 5)
+
+    def test_listado_cuenta_todas_las_coincidencias(self):
+        respuesta = self.client.get(reverse('calificaciones:mantenedor'), {'q': 'definitivo'})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.context['total_calificaciones'], 5)
+        self.assertFalse(respuesta.context['busqueda_recortada'])
+
+    @skipUnless(connection.vendor == 'postgresql', 'El recorte por candidatos solo existe en PostgreSQL')
+    def test_listado_avisa_recorte(self):
+        calificaciones = CalificacionTributaria.objects.all()
+        with mock.patch.object(busqueda, 'LIMITE_CANDIDATOS', 2):
+            self.assertEqual(busqueda.buscar(calificaciones, 'definitivo', limite=2).count(), 2)
+            self.assertTrue(busqueda.supera_limite(busqueda.buscar(calificaciones, 'definitivo', limite=None)))
+            self.assertFalse(busqueda.supera_limite(busqueda.buscar(calificaciones, 'ACCION1', limite=None)))
+
+
+# ==========================================
+# PAGINACIÓN POR CURSOR
+# ==========================================
+
+def cursor_crudo(texto):
+    return base64.urlsafe_b64encode(texto.encode()).decode().rstrip('=')
+
+
+class PaginacionTests(TestCase):
+
+    def setUp(self):
+        self.usuario = User.objects.create_user('corredor', password='x')
+        self.client.force_login(self.usuario)
+        empresa = crear_empresa(self.usuario)
+        # 7 con la misma fecha de pago (el empate lo resuelve el id) y 2 más recientes
+        crear_calificaciones(empresa, 7)
+        crear_calificaciones(empresa, 2, instrumento='RECIENTE', fecha_pago=date(2024, 6, 1))
+        otro = User.objects.create_user('otro', password='x')
+        crear_calificaciones(crear_empresa(otro, rut='77000000-0'), 3)
+
+    def pagina_json(self, cursor=None, tamano=3):
+        parametros = {'formato': 'json', 'tamano': tamano}
+        if cursor:
+            parametros['cursor'] = cursor
+        return self.client.get(reverse('calificaciones:mantenedor'), parametros)
+
+    def test_recorre_todo_sin_repetir_con_fechas_empatadas(self):
+        esperados = list(
+            CalificacionTributaria.objects.filter(usuario=self.usuario)
+            .order_by('-fecha_pago', '-id').values_list('id', flat=True)
+        )
+        vistos, cursor, paginas = [], None, 0
+        while True:
+            datos = self.pagina_json(cursor).json()
+            vistos += [fila['id'] for fila in datos['resultados']]
+            paginas += 1
+            cursor = datos['siguiente']
+            if cursor is None:
+                break
+        self.assertEqual(vistos, esperados)
+        self.assertEqual(paginas, 3)
+
+    def test_el_cursor_es_estable_si_se_insertan_filas_anteriores(self):
+        primera = self.pagina_json().json()
+        segunda = self.pagina_json(primera['siguiente']).json()
+        empresa = Empresa.objects.get(usuario=self.usuario)
+        crear_calificaciones(empresa, 2, instrumento='NUEVA', fecha_pago=date(2024, 7, 1))
+        self.assertEqual(self.pagina_json(primera['siguiente']).json(), segunda)
+
+    def test_la_ultima_pagina_no_tiene_cursor(self):
+        calificaciones = CalificacionTributaria.objects.filter(usuario=self.usuario)
+        pagina = paginacion.paginar(calificaciones, tamano=9)
+        self.assertEqual((len(pagina.elementos), pagina.siguiente), (9, None))
+        self.assertIsNotNone(paginacion.paginar(calificaciones, tamano=8).siguiente)
+
+    def test_cursor_invalido_responde_error(self):
+        for cursor in [
+            'no-es-base64!!', cursor_crudo('2024-13-01|5'), cursor_crudo('2024-05-01|abc'),
+            cursor_crudo('2024-05-01|5|6'), cursor_crudo(f'2024-05-01|{2 ** 70}'), cursor_crudo('2024-05-01|-1'),
+        ]:
+            with self.subTest(cursor=cursor):
+                respuesta = self.pagina_json(cursor)
+                self.assertEqual(respuesta.status_code, 400)
+                self.assertIn('error', respuesta.json())
+        with self.assertRaises(paginacion.CursorInvalido):
+            calificaciones = CalificacionTributaria.objects.annotate(relevancia=Value(1.0))
+            paginacion.paginar_por_relevancia(calificaciones, cursor_crudo('nan|5'))
+
+    def test_cursor_invalido_en_el_listado_muestra_la_primera_pagina(self):
+        respuesta = self.client.get(reverse('calificaciones:mantenedor'), {'cursor': 'basura', 'tamano': 3})
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(len(respuesta.context['calificaciones']), 3)
+        self.assertEqual(len(list(respuesta.context['messages'])), 1)
+
+
+# ==========================================
+# EXPORTACIÓN
+# ==========================================
+
+class ExportacionTests(TestCase):
+
+    def setUp(self):
+        self.usuario = User.objects.create_user('corredor', password='x')
+        self.client.force_login(self.usuario)
+        propias = crear_calificaciones(crear_empresa(self.usuario), 3)
+        CalificacionTributaria.objects.filter(id=propias[2].id).update(mercado='CFI')
+        FactoresCalificacion.objects.create(
+            calificacion=propias[0], factor_8=Decimal('0.00000001'), factor_37=Decimal('0.5'),
+        )
+        otro = User.objects.create_user('otro', password='x')
+        crear_calificaciones(crear_empresa(otro, rut='77000000-0'), 2, instrumento='AJENA')
+
+    def exportar(self, **filtros):
+        respuesta = self.client.get(reverse('calificaciones:exportar'), filtros)
+        self.assertTrue(respuesta.streaming)
+        self.assertEqual(respuesta['Content-Disposition'], 'attachment; filename="calificaciones.csv"')
+        contenido = b''.join(respuesta.streaming_content).decode('utf-8')
+        self.assertTrue(contenido.startswith('\ufeff'))
+        return list(csv.DictReader(io.StringIO(contenido.removeprefix('\ufeff'))))
+
+    def test_csv_con_encabezado_y_solo_las_filas_del_usuario(self):
+        filas = self.exportar()
+        self.assertEqual(list(filas[0]), ['Ejercicio', 'Mercado', 'Instrumento', 'Fecha Pago', 'Secuencia Evento',
+                                          'Descripción', 'Tipo Sociedad', 'Valor Histórico', 'Acogido ISFUT',
+                                          'Origen', 'RUT Empresa', *[f'Factor {i}' for i in range(8, 38)]])
+        self.assertEqual([fila['Instrumento'] for fila in filas], ['ACCION0', 'ACCION1', 'ACCION2'])
+        primera = filas[0]
+        self.assertEqual(
+            (primera['Fecha Pago'], primera['Acogido ISFUT'], primera['Origen'], primera['RUT Empresa']),
+            ('2024-05-01', 'NO', 'Corredor', '76000000-0'),
+        )
+        # Sin notación científica (1E-8) y con los factores nulos vacíos
+        self.assertEqual((primera['Factor 8'], primera['Factor 9'], primera['Factor 37']), ('0.00000001', '', '0.50000000'))
+        self.assertEqual(filas[1]['Factor 8'], '')
+
+    def test_aplica_los_filtros_del_mantenedor(self):
+        self.assertEqual([fila['Instrumento'] for fila in self.exportar(mercado='CFI')], ['ACCION2'])
+
+
+# ==========================================
+# PLANTILLAS DE CARGA
+# ==========================================
+
+class PlantillasTests(TestCase):
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directorio, ignore_errors=True)
+        ajuste = override_settings(PLANTILLAS_CACHE_DIR=self.directorio)
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+        # Sin las plantillas que otras pruebas dejaron en memoria
+        artefactos = mock.patch.dict(plantillas._artefactos, clear=True)
+        artefactos.start()
+        self.addCleanup(artefactos.stop)
+        self.client.force_login(User.objects.create_user('corredor', password='x'))
+        self.url = reverse('calificaciones:descargar_plantilla_montos')
+
+    def test_etag_coincidente_responde_304(self):
+        respuesta = self.client.get(self.url)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertNotIn('Content-Encoding', respuesta)
+        self.assertIn(b'NUAM-DJ1948-PLANTILLA', respuesta.content)
+        repetida = self.client.get(self.url, HTTP_IF_NONE_MATCH=respuesta['ETag'])
+        self.assertEqual((repetida.status_code, repetida.content), (304, b''))
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"otra"').status_code, 200)
+
+    def test_variante_gzip(self):
+        plana = self.client.get(self.url)
+        comprimida = self.client.get(self.url, HTTP_ACCEPT_ENCODING='br, gzip;q=0.8')
+        self.assertEqual(comprimida['Content-Encoding'], 'gzip')
+        for respuesta in (plana, comprimida):
+            self.assertIn('Accept-Encoding', respuesta['Vary'])
+        self.assertEqual(gzip.decompress(comprimida.content), plana.content)
+        self.assertNotEqual(comprimida['ETag'], plana['ETag'])
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=plana['ETag'],
+                                         HTTP_ACCEPT_ENCODING='gzip').status_code, 200)
+
+    def test_subir_la_version_genera_otra_plantilla(self):
+        anterior = self.client.get(self.url)
+        version_anterior, nombre, escribir = plantillas.PLANTILLAS['montos']
+        with mock.patch.object(plantillas, 'VERSION_MONTOS', 'NUAM-DJ1948-PLANTILLA-2.0'), \
+                mock.patch.dict(plantillas.PLANTILLAS, montos=('NUAM-DJ1948-PLANTILLA-2.0', nombre, escribir)):
+            nueva = self.client.get(self.url, HTTP_IF_NONE_MATCH=anterior['ETag'])
+        self.assertEqual(nueva.status_code, 200)
+        self.assertNotEqual(nueva['ETag'], anterior['ETag'])
+        self.assertIn(b'NUAM-DJ1948-PLANTILLA-2.0', nueva.content)
+        self.assertEqual(
+            sorted(os.listdir(self.directorio)),
+            [f'{version}.csv{gz}' for version in (version_anterior, 'NUAM-DJ1948-PLANTILLA-2.0') for gz in ('', '.gz')],
+        )
+
+    def test_el_contenido_depende_solo_de_la_version(self):
+        primera = self.client.get(self.url).content
+        plantillas._artefactos.clear()
+        shutil.rmtree(self.directorio)
+        with mock.patch.object(plantillas, 'datetime') as reloj:
+            reloj.now.return_value = datetime(2030, 1, 1)
+            self.assertEqual(self.client.get(self.url).content, primera)
+
+
+# ==========================================
+# AUTENTICACIÓN
+# ==========================================
+
+class EmailOUsuarioBackendTests(TestCase):
+
+    def setUp(self):
+        self.usuario = User.objects.create_user('corredor', email='Corredor@Nuam.cl', password='clave-segura')
+        User.objects.create_user('sin_email', password='clave-segura')
+        self.backend = EmailOUsuarioBackend()
+
+    def test_acepta_usuario_o_email_sin_distinguir_mayusculas(self):
+        self.assertEqual(self.backend.authenticate(None, username='corredor', password='clave-segura'), self.usuario)
+        self.assertEqual(self.backend.authenticate(None, username='corredor@nuam.CL', password='clave-segura'), self.usuario)
+        self.assertIsNone(self.backend.authenticate(None, username='corredor@nuam.cl', password='otra'))
+
+    def test_username_gana_sobre_email_de_otra_cuenta(self):
+        otro = User.objects.create_user('corredor@nuam.cl', password='clave-segura')
+        self.assertEqual(self.backend.buscar_usuario('corredor@nuam.cl'), otro)
+
+    @skipUnless(connection.vendor == 'postgresql', 'El índice de emails solo se verifica en PostgreSQL')
+    def test_busqueda_por_email_usa_el_indice(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SET enable_seqscan = off')  # Con pocas filas el planificador prefiere recorrer la tabla
+        plan = self.backend.consulta_usuario('corredor@nuam.cl').explain()
+        self.assertIn('auth_user_email_ci_uniq', plan)
+
+
+# ==========================================
+# COLA DE CARGA MASIVA
+# ==========================================
+
+class ColaCargaTests(ConArchivos, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.usuario = User.objects.create_user('corredor', password='x')
+        self.empresa = crear_empresa(self.usuario)
+
+    def test_trabajador_procesa_la_cola(self):
+        archivo_carga = self.encolar_csv(self.empresa, plantilla_csv('FACTORES', [fila_factores(i) for i in range(5)]))
+        self.assertEqual(cola.ciclo_trabajador(una_vez=True), 1)
+        archivo_carga.refresh_from_db()
+        self.assertEqual(archivo_carga.estado, 'COMPLETADO')
+        self.assertEqual(archivo_carga.registros_insertados, 5)
+        self.assertEqual(CalificacionTributaria.objects.filter(empresa=self.empresa).count(), 5)
+
+    def test_el_trabajador_sobrevive_a_un_reinicio_de_la_base_de_datos(self):
+        archivo_carga = self.encolar_csv(self.empresa, plantilla_csv('FACTORES', [fila_factores(1)]))
+        recuperar_huerfanos = cola.recuperar_huerfanos
+        fallas = [OperationalError('server closed the connection unexpectedly')] * 2
+
+        def recuperar_tras_el_reinicio(trabajador):
+            if fallas:
+                raise fallas.pop()
+            return recuperar_huerfanos(trabajador)
+
+        with (
+            mock.patch.object(cola, 'recuperar_huerfanos', side_effect=recuperar_tras_el_reinicio),
+            mock.patch.object(cola, 'close_old_connections') as cerrar_conexiones,
+            mock.patch.object(cola.time, 'sleep') as esperar,
+            self.assertLogs('calificaciones.cola', 'ERROR') as registros,
+        ):
+            self.assertEqual(cola.ciclo_trabajador(una_vez=True, intervalo=5), 1)
+
+        self.assertEqual([llamada.args for llamada in esperar.call_args_list], [(5,), (10,)])
+        self.assertEqual((cerrar_conexiones.call_count, len(registros.records)), (2, 2))
+        archivo_carga.refresh_from_db()
+        self.assertEqual(archivo_carga.estado, 'COMPLETADO')
+
+    def test_trabajador_reemplazado_no_confirma_lotes(self):
+        self.encolar_csv(self.empresa, plantilla_csv('FACTORES', [fila_factores(i) for i in range(5)]))
+        anterior = cola.reclamar_siguiente('lento')
+
+        # El trabajador lento se da por huérfano y otro reclama el archivo
+        ArchivoCarga.objects.filter(pk=anterior.pk).update(latido=timezone.now() - timedelta(hours=1))
+        self.assertEqual(cola.recuperar_huerfanos('otro'), 1)
+        nuevo = cola.reclamar_siguiente('otro')
+        self.assertEqual(nuevo.pk, anterior.pk)
+
+        with anterior.archivo.open('rb') as archivo:
+            resultado = procesar_archivo(anterior, archivo, self.usuario, tamano_lote=2)
+        self.assertTrue(resultado.cancelada)
+        self.assertFalse(CalificacionTributaria.objects.filter(empresa=self.empresa).exists())
+
+        cola.registrar_fallo(anterior, RuntimeError('tarde'))
+        nuevo.refresh_from_db()
+        self.assertEqual((nuevo.estado, nuevo.trabajador), ('PROCESANDO', 'otro'))
+
+        cola.ejecutar(nuevo)
+        nuevo.refresh_from_db()
+        self.assertEqual((nuevo.estado, nuevo.registros_insertados), ('COMPLETADO', 5))
+
+    def test_recuperar_huerfanos(self):
+        archivo_carga = self.encolar_csv(self.empresa, plantilla_csv('FACTORES', [fila_factores(1)]))
+        cola.reclamar_siguiente('muerto')
+        viejo = timezone.now() - timedelta(hours=1)
+
+        ArchivoCarga.objects.filter(pk=archivo_carga.pk).update(latido=timezone.now())
+        self.assertEqual(cola.recuperar_huerfanos('otro'), 0)  # Con latido reciente sigue vivo
+
+        ArchivoCarga.objects.filter(pk=archivo_carga.pk).update(latido=viejo)
+        self.assertEqual(cola.recuperar_huerfanos('muerto'), 0)  # Nunca los propios
+
+        with self.settings(CARGA_MASIVA_MAX_INTENTOS=1):
+            self.assertEqual(cola.recuperar_huerfanos('otro'), 1)
+        archivo_carga.refresh_from_db()
+        self.assertEqual((archivo_carga.estado, archivo_carga.trabajador), ('ERROR', ''))
+
+    def test_reanuda_desde_el_checkpoint(self):
+        archivo_carga = self.encolar_csv(self.empresa, plantilla_csv('FACTORES', [fila_factores(i) for i in range(6)]))
+        guardar_lote = importacion._guardar_lote
+        lotes = []
+
+        def cancelar_en_el_segundo_lote(*args, **kwargs):
+            lotes.append(1)
+            if len(lotes) == 2:
+                cola.cancelar(archivo_carga)
+            return guardar_lote(*args, **kwargs)
+
+        reclamado = cola.reclamar_siguiente('trabajador')
+        with mock.patch.object(importacion, '_guardar_lote', side_effect=cancelar_en_el_segundo_lote):
+            with reclamado.archivo.open('rb') as archivo:
+                self.assertTrue(procesar_archivo(reclamado, archivo, self.usuario, tamano_lote=2).cancelada)
+        archivo_carga.refresh_from_db()
+        self.assertEqual((archivo_carga.estado, archivo_carga.registros_procesados, archivo_carga.ultima_linea), ('CANCELADO', 2, 5))
+        self.assertGreater(archivo_carga.ultimo_byte, 0)
+        self.assertEqual(CalificacionTributaria.objects.filter(empresa=self.empresa).count(), 2)
+
+        cola.reanudar(archivo_carga)
+        reclamado = cola.reclamar_siguiente('trabajador')
+        with reclamado.archivo.open('rb') as archivo:
+            procesar_archivo(reclamado, archivo, self.usuario, tamano_lote=2)
+        archivo_carga.refresh_from_db()
+        self.assertEqual((archivo_carga.estado, archivo_carga.registros_procesados), ('COMPLETADO', 6))
+        self.assertEqual(archivo_carga.registros_insertados, 6)
+        self.assertEqual(CalificacionTributaria.objects.filter(empresa=self.empresa).count(), 6)
+
+
+    def test_reanudar_conserva_los_errores_confirmados(self):
+        filas = [fila_factores(i) for i in range(6)]
+        filas[1][0] = '2O24'
+        archivo_carga = self.encolar_csv(self.empresa, plantilla_csv('FACTORES', filas))
+        guardar_lote = importacion._guardar_lote
+
+        def cancelar_despues_del_primer_lote(*args, **kwargs):
+            guardar_lote(*args, **kwargs)
+            cola.cancelar(archivo_carga)
+
+        reclamado = cola.reclamar_siguiente('trabajador')
+        with mock.patch.object(importacion, '_guardar_lote', side_effect=cancelar_despues_del_primer_lote):
+            with reclamado.archivo.open('rb') as archivo:
+                self.assertTrue(procesar_archivo(reclamado, archivo, self.usuario, tamano_lote=2).cancelada)
+        archivo_carga.refresh_from_db()
+        error = 'Línea 5: EJERCICIO_FISCAL debe ser un número entero ("2O24")'
+        self.assertEqual((archivo_carga.ultima_linea, archivo_carga.errores_confirmados), (6, [error]))
+
+        cola.reanudar(archivo_carga)
+        reclamado = cola.reclamar_siguiente('trabajador')
+        with reclamado.archivo.open('rb') as archivo:
+            procesar_archivo(reclamado, archivo, self.usuario, tamano_lote=2)
+        archivo_carga.refresh_from_db()
+        self.assertEqual((archivo_carga.estado, archivo_carga.registros_insertados), ('COMPLETADO', 5))
+        self.assertEqual((archivo_carga.registros_error, archivo_carga.mensaje_error), (1, error))
+
+
+class LatidoTests(ConArchivos, TransactionTestCase):
+
+    def test_latido_durante_el_procesamiento(self):
+        usuario = User.objects.create_user('corredor', password='x')
+        archivo_carga = self.encolar_csv(crear_empresa(usuario), plantilla_csv('FACTORES', [fila_factores(1)]))
+        archivo_carga = cola.reclamar_siguiente('trabajador')
+        antes = archivo_carga.latido
+        with cola.latiendo(archivo_carga, intervalo=0.05):
+            time.sleep(0.3)
+        archivo_carga.refresh_from_db()
+        self.assertGreater(archivo_carga.latido, antes)
+
+        # Si el archivo pasa a otro trabajador, el latido ya no lo toca
+        ArchivoCarga.objects.filter(pk=archivo_carga.pk).update(trabajador='otro', latido=antes)
+        with cola.latiendo(archivo_carga, intervalo=0.05):
+            time.sleep(0.2)
+        archivo_carga.refresh_from_db()
+        self.assertEqual(archivo_carga.latido, antes)
+
+
+def fila_montos(secuencia, instrumento='ACCION'):
+    # Tres montos iguales: 1/3 no es exacto con 8 decimales
+    return [2024, 'ACN', f'{instrumento}{secuencia}', '2024-05-01', secuencia, 'Dividendo', 'A', '1000'] + ['100'] * 3 + [''] * 27
+
+
+class ImportacionTests(ConArchivos, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.usuario = User.objects.create_user('corredor', password='x')
+        self.empresa = crear_empresa(self.usuario)
+
+    def procesar(self, contenido, tipo_carga='FACTORES'):
+        archivo_carga = self.encolar_csv(self.empresa, contenido, tipo_carga)
+        self.assertEqual(cola.ciclo_trabajador(una_vez=True), 1)
+        archivo_carga.refresh_from_db()
+        return archivo_carga
+
+    def test_montos_se_convierten_en_factores_que_suman_uno(self):
+        archivo_carga = self.procesar(plantilla_csv('MONTOS', [fila_montos(i) for i in range(3)]), 'MONTOS')
+        self.assertEqual((archivo_carga.estado, archivo_carga.registros_insertados), ('COMPLETADO', 3))
+        for factores in FactoresCalificacion.objects.filter(calificacion__empresa=self.empresa):
+            valores = [getattr(factores, campo) or 0 for campo in CAMPOS_FACTORES]
+            self.assertEqual(sum(valores), 1)
+            self.assertEqual(valores[:3], [Decimal('0.33333334'), Decimal('0.33333333'), Decimal('0.33333333')])
+            self.assertEqual(desempaquetar(factores.empaquetado, factores.nulos)[:3], valores[:3])
+
+    def test_recarga_fusiona_por_clave_natural(self):
+        # En PostgreSQL pasa por COPY a la tabla de paso e INSERT ... ON CONFLICT
+        self.procesar(plantilla_csv('FACTORES', [fila_factores(i) for i in range(3)]))
+        filas = [fila_factores(i) for i in range(4)]
+        filas[0][5] = 'Dividendo corregido'
+        filas[1][6 + 20] = '0.25'  # factor_28
+        archivo_carga = self.procesar(plantilla_csv('FACTORES', filas))
+
+        self.assertEqual(
+            (archivo_carga.registros_insertados, archivo_carga.registros_actualizados, archivo_carga.registros_sin_cambios),
+            (1, 2, 1),
+        )
+        calificaciones = CalificacionTributaria.objects.filter(empresa=self.empresa)
+        self.assertEqual(calificaciones.count(), 4)
+        self.assertEqual(calificaciones.get(instrumento='ACCION0').descripcion_dividendo, 'Dividendo corregido')
+        factores = FactoresCalificacion.objects.get(calificacion__empresa=self.empresa, calificacion__instrumento='ACCION1')
+        self.assertEqual(factores.factor_28, Decimal('0.25'))
+        self.assertEqual(desempaquetar(factores.empaquetado, factores.nulos)[20], Decimal('0.25'))
+
+    def test_filas_invalidas_no_detienen_la_carga(self):
+        filas = [fila_factores(i) for i in range(4)]
+        filas[1][6:15] = ['0.2'] * 9       # Suma 8-16 = 1.8: la rechaza la restricción de la base de datos
+        filas[2][3] = '31-02-2024'
+        archivo_carga = self.procesar(plantilla_csv('FACTORES', filas))
+
+        self.assertEqual((archivo_carga.estado, archivo_carga.registros_insertados), ('COMPLETADO', 2))
+        self.assertEqual(archivo_carga.registros_error, 2)
+        self.assertIn('Línea 5: la suma de los factores', archivo_carga.mensaje_error)
+        self.assertIn('Línea 6: FECHA_PAGO', archivo_carga.mensaje_error)
+
+    def test_solo_se_saltan_los_textos_de_la_plantilla(self):
+        filas = [
+            fila_factores(0),
+            [],
+            ['SECCIÓN III: EJEMPLOS FORMALES DE FACTORES VÁLIDOS'],
+            ['2O24'] + fila_factores(1)[1:],
+            [''] + fila_factores(2)[1:],
+            ['Nota agregada por el usuario'],
+            fila_factores(3),
+        ]
+        archivo_carga = self.procesar(plantilla_csv('FACTORES', filas))
+
+        self.assertEqual((archivo_carga.estado, archivo_carga.registros_insertados), ('COMPLETADO', 2))
+        self.assertEqual(archivo_carga.mensaje_error.splitlines(), [
+            'Línea 7: EJERCICIO_FISCAL debe ser un número entero ("2O24")',
+            'Línea 8: EJERCICIO_FISCAL es obligatorio',
+            'Línea 9: se esperaban 36 columnas y la fila tiene 1',
+        ])
+
+    def test_la_plantilla_descargada_se_carga_con_sus_ejemplos(self):
+        archivo_carga = self.procesar(plantillas.generar(plantillas.escribir_plantilla_factores))
+        self.assertEqual((archivo_carga.estado, archivo_carga.registros_insertados), ('COMPLETADO', 2))
+        self.assertEqual((archivo_carga.registros_error, archivo_carga.mensaje_error), (0, ''))
+
+    def test_lote_que_viola_la_restriccion_confirma_el_resto(self):
+        archivo_carga = self.encolar_csv(self.empresa, b'')
+        ArchivoCarga.objects.filter(pk=archivo_carga.pk).update(estado='PROCESANDO', trabajador='prueba')
+        archivo_carga.refresh_from_db()
+        filas = [fila_factores(i) for i in range(4)]
+        filas[2][6:15] = ['0.2'] * 9
+        lote = [(10 + i, *importacion.preparar_fila(list(map(str, fila)), 'FACTORES')) for i, fila in enumerate(filas)]
+
+        resultado = importacion.ResultadoCarga()
+        importacion._guardar_lote(archivo_carga, self.usuario.pk, lote, resultado, 13, 500)
+
+        self.assertEqual(len(resultado.detalle_errores), 1)
+        self.assertTrue(resultado.detalle_errores[0].startswith(
+            'Línea 12: la suma de los factores del 8 al 16 no puede ser mayor que 1 (2024 ACN ACCION2, secuencia 2)'
+        ))
+        self.assertEqual((resultado.errores, resultado.procesados, resultado.insertados), (1, 3, 3))
+        self.assertEqual(
+            sorted(CalificacionTributaria.objects.filter(empresa=self.empresa).values_list('instrumento', flat=True)),
+            ['ACCION0', 'ACCION1', 'ACCION3'],
+        )
+        self.assertEqual(FactoresCalificacion.objects.filter(calificacion__empresa=self.empresa).count(), 3)
+        archivo_carga.refresh_from_db()
+        self.assertEqual(
+            (archivo_carga.registros_procesados, archivo_carga.registros_insertados, archivo_carga.registros_error),
+            (3, 3, 1),
+        )
+        self.assertEqual((archivo_carga.ultima_linea, archivo_carga.ultimo_byte), (13, 500))
+
+
+class TramosTests(SimpleTestCase):
+
+    def setUp(self):
+        filas = [fila_factores(i) for i in range(40)]
+        filas[7][5] = '"Dividendo\nen dos líneas"'  # Un salto de línea dentro de un campo entre comillas
+        self.contenido = plantilla_csv('FACTORES', filas)
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio, ignore_errors=True)
+        self.ruta = os.path.join(directorio, 'carga.csv')
+        with open(self.ruta, 'wb') as archivo:
+            archivo.write(self.contenido)
+
+    def test_los_tramos_cubren_el_archivo_sin_cortar_campos(self):
+        tramos = list(importacion.dividir_en_tramos(io.BytesIO(self.contenido), 0, 0, 300))
+        self.assertGreater(len(tramos), 5)
+        self.assertEqual(tramos[0][0], 0)
+        self.assertEqual(tramos[-1][1], len(self.contenido))
+        for (_, fin, _), (inicio, _, _) in zip(tramos, tramos[1:]):
+            self.assertEqual(fin, inicio)
+        for inicio, fin, _ in tramos:
+            self.assertEqual(self.contenido[inicio:fin].count(b'"') % 2, 0)
+
+    def test_en_paralelo_igual_que_secuencial(self):
+        with open(self.ruta, 'rb') as archivo:
+            secuencial = list(importacion.filas_preparadas(
+                importacion.leer_filas(importacion.filas_csv(archivo), 'FACTORES'), 'FACTORES',
+            ))
+        with open(self.ruta, 'rb') as archivo:
+            paralelo = list(importacion.filas_en_paralelo(archivo, self.ruta, 'FACTORES', 0, 0, 2, 300))
+        self.assertEqual(len(paralelo), 40)
+        self.assertEqual(paralelo, secuencial)
+        self.assertEqual(paralelo[7][3][4], 'Dividendo\nen dos líneas')
+
+
+class SubidasTests(ConArchivos, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.usuario = User.objects.create_user('corredor', password='x')
+        self.empresa = crear_empresa(self.usuario)
+        self.client.force_login(self.usuario)
+        self.contenido = plantilla_csv('FACTORES', [fila_factores(i) for i in range(20)])
+        respuesta = self.client.post(reverse('calificaciones:subidas'), {
+            'empresa': self.empresa.id, 'tipo_carga': 'FACTORES', 'nombre_archivo': 'grande.csv',
+            'tamano': len(self.contenido), 'sha256': hashlib.sha256(self.contenido).hexdigest(),
+        })
+        self.assertEqual(respuesta.status_code, 201)
+        self.url = respuesta.json()['url']
+
+    def enviar_parte(self, desde, hasta):
+        parte = self.contenido[desde:hasta]
+        return self.client.put(
+            f'{self.url}?desde={desde}', parte, content_type='application/octet-stream',
+            HTTP_X_CHECKSUM_SHA256=hashlib.sha256(parte).hexdigest(),
+        )
+
+    def test_partes_en_orden_reintentos_y_saltos(self):
+        mitad = len(self.contenido) // 2
+        self.assertEqual(self.enviar_parte(0, mitad).json()['recibidos'], mitad)
+        # Repetir una parte ya recibida no cambia nada; saltarse una devuelve dónde seguir
+        self.assertEqual(self.enviar_parte(0, mitad).json()['recibidos'], mitad)
+        salto = self.enviar_parte(mitad + 10, len(self.contenido))
+        self.assertEqual((salto.status_code, salto.json()['recibidos']), (409, mitad))
+        self.assertEqual(self.enviar_parte(mitad, len(self.contenido)).json()['recibidos'], len(self.contenido))
+
+        respuesta = self.client.post(f'{self.url}completar/')
+        self.assertEqual(respuesta.status_code, 200)
+        archivo_carga = ArchivoCarga.objects.get(pk=respuesta.json()['archivo_carga'])
+        self.assertEqual((archivo_carga.estado, archivo_carga.sha256), ('PENDIENTE', hashlib.sha256(self.contenido).hexdigest()))
+        with archivo_carga.archivo.open('rb') as archivo:
+            self.assertEqual(archivo.read(), self.contenido)
+
+        self.assertEqual(cola.ciclo_trabajador(una_vez=True), 1)
+        archivo_carga.refresh_from_db()
+        self.assertEqual((archivo_carga.estado, archivo_carga.registros_insertados), ('COMPLETADO', 20))
+
+    def test_parte_corrupta_se_rechaza(self):
+        respuesta = self.client.put(
+            f'{self.url}?desde=0', self.contenido[:100], content_type='application/octet-stream',
+            HTTP_X_CHECKSUM_SHA256=hashlib.sha256(b'otra cosa').hexdigest(),
+        )
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertEqual(self.client.get(self.url).json()['recibidos'], 0)
+
+    def test_no_completa_con_bytes_pendientes(self):
+        self.enviar_parte(0, 100)
+        respuesta = self.client.post(f'{self.url}completar/')
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertFalse(ArchivoCarga.objects.exists())
+
+
+# ==========================================
+# API POR LOTES
+# ==========================================
+
+class ApiLoteTests(TestCase):
+
+    def setUp(self):
+        self.usuario = User.objects.create_user('sistema', password='x')
+        self.empresa = crear_empresa(self.usuario)
+        _, token = TokenAPI.crear(self.usuario, 'pruebas')
+        self.cabeceras = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+
+    def enviar(self, operaciones):
+        respuesta = self.client.post(
+            reverse('calificaciones:api_lote'), json.dumps(operaciones), content_type='application/json', **self.cabeceras,
+        )
+        return respuesta.status_code, respuesta.json()
+
+    def alta(self, secuencia, instrumento='ACCION'):
+        return {
+            'op': 'crear', 'empresa': self.empresa.id, 'ejercicio': 2024, 'mercado': 'ACN',
+            'instrumento': f'{instrumento}{secuencia}', 'fecha_pago': '2024-05-01', 'secuencia_evento': secuencia,
+            'origen': 'SISTEMA', 'factores': {'factor_8': '0.1'},
+        }
+
+    def estados(self, respuesta):
+        return [resultado['estado'] for resultado in respuesta['resultados']]
+
+    def test_actualizar_a_una_clave_ocupada(self):
+        primera, segunda = crear_calificaciones(self.empresa, 2)
+        _, respuesta = self.enviar([
+            {'op': 'actualizar', 'id': segunda.id, 'instrumento': primera.instrumento, 'secuencia_evento': 0},
+            {'op': 'actualizar', 'id': primera.id, 'origen': 'SISTEMA'},
+        ])
+        self.assertEqual(self.estados(respuesta), ['error', 'ok'])
+        self.assertIn('ya existe', respuesta['resultados'][0]['errores'][0])
+
+    def test_eliminar_y_crear_la_misma_clave(self):
+        existente, = crear_calificaciones(self.empresa, 1)
+        _, respuesta = self.enviar([{'op': 'eliminar', 'id': existente.id}, self.alta(0)])
+        self.assertEqual(self.estados(respuesta), ['ok', 'ok'])
+        self.assertFalse(CalificacionTributaria.objects.filter(id=existente.id).exists())
+        self.assertEqual(CalificacionTributaria.objects.filter(empresa=self.empresa, instrumento='ACCION0').count(), 1)
+
+    def test_alta_en_la_clave_que_libera_una_actualizacion(self):
+        existente, = crear_calificaciones(self.empresa, 1)
+        _, respuesta = self.enviar([{'op': 'actualizar', 'id': existente.id, 'secuencia_evento': 9}, self.alta(0)])
+        self.assertEqual(self.estados(respuesta), ['ok', 'ok'])
+
+    def test_error_de_base_de_datos_afecta_solo_a_su_operacion(self):
+        # Sin la validación de claves, el choque lo detecta la restricción única de la base de datos
+        with mock.patch('calificaciones.api._validar_claves'):
+            _, respuesta = self.enviar([self.alta(1), self.alta(2), self.alta(1)])
+        self.assertEqual(self.estados(respuesta), ['ok', 'ok', 'error'])
+        self.assertIn('error de base de datos', respuesta['resultados'][2]['errores'][0])
+        self.assertEqual(CalificacionTributaria.objects.filter(empresa=self.empresa).count(), 2)
+        self.assertEqual(
+            FactoresCalificacion.objects.filter(calificacion__empresa=self.empresa).count(), 2,
+        )
+
+    def test_cuerpo_invalido_informa_lo_aplicado(self):
+        estado, respuesta = self.enviar({'operaciones': 'no es un arreglo'})
+        self.assertEqual(estado, 400)
+        self.assertEqual(respuesta['aplicadas'], 0)
+
+
+# ==========================================
+# CONTADORES
+# ==========================================
+
+class ContadoresTests(TestCase):
+    claves = (contadores.CALIFICACIONES, contadores.clave_calificaciones_usuario(7))
+
+    def test_los_ajustes_masivos_esperan_al_commit(self):
+        antes = contadores.valores(*self.claves)
+        with self.captureOnCommitCallbacks(execute=True):
+            contadores.sumar_calificaciones(7, 3)
+            self.assertEqual(contadores.valores(*self.claves), antes)
+        self.assertEqual(contadores.valores(*self.claves), {clave: antes[clave] + 3 for clave in self.claves})
+
+    def test_un_lote_revertido_no_mueve_los_contadores(self):
+        antes = contadores.valores(*self.claves)
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(ValueError), transaction.atomic():
+                contadores.sumar_calificaciones(7, 3)
+                raise ValueError
+        self.assertEqual(contadores.valores(*self.claves), antes)
+
+    def test_facetas_siguen_a_la_tabla(self):
+        usuario = User.objects.create_user('corredor', password='x')
+        empresa = crear_empresa(usuario)
+        with self.captureOnCommitCallbacks(execute=True):
+            creadas = crear_calificaciones(empresa, 3)
+            facetas.sumar_calificaciones(creadas)
+            contadores.sumar_calificaciones(usuario.id, len(creadas))
+        with self.captureOnCommitCallbacks(execute=True):
+            creadas[0].mercado = 'CFI'
+            creadas[0].save()
+        self.assertEqual(facetas.conteos('ejercicio'), {2024: 3})
+        self.assertEqual(facetas.conteos('mercado'), {'ACN': 2, 'CFI': 1})
+        self.assertEqual(facetas.conteos('usuario'), {usuario.id: 3})
+        self.assertEqual(
+            {clave: valor for clave, valor in contadores.calcular().items() if clave.startswith('facetas:')},
+            {'facetas:ejercicio:2024': 3, 'facetas:mercado:ACN': 2, 'facetas:mercado:CFI': 1},
+        )
+
+
+# ==========================================
+# OPERACIONES MASIVAS
+# ==========================================
+
+@override_settings(MASIVO_TAMANO_BLOQUE=2)
+class MasivoTests(TestCase):
+
+    def setUp(self):
+        self.usuario = User.objects.create_user('corredor', password='x')
+        self.otro = User.objects.create_user('otro', password='x')
+        self.propias = crear_calificaciones(crear_empresa(self.usuario), 5)
+        self.ajenas = crear_calificaciones(crear_empresa(self.otro, rut='77000000-0'), 3)
+        CalificacionTributaria.objects.filter(id=self.propias[0].id).update(mercado='CFI')
+        FactoresCalificacion.objects.bulk_create([
+            FactoresCalificacion(calificacion=calificacion, factor_8=Decimal('0.5'))
+            for calificacion in self.propias + self.ajenas
+        ])
+        contadores.recalcular()
+        self.client.force_login(self.usuario)
+
+    def operar(self, **datos):
+        with self.captureOnCommitCallbacks(execute=True):
+            respuesta = self.client.post(reverse('calificaciones:masivo'), datos)
+            return [json.loads(linea) for linea in b''.join(respuesta.streaming_content).splitlines()]
+
+    def assertContadoresCuadran(self):
+        guardados = dict(Contador.objects.exclude(valor=0).values_list('clave', 'valor'))
+        self.assertEqual(guardados, {clave: valor for clave, valor in contadores.calcular().items() if valor})
+
+    def assertAjenasIntactas(self):
+        ajenas = CalificacionTributaria.objects.filter(usuario=self.otro)
+        self.assertEqual(ajenas.count(), 3)
+        self.assertEqual(FactoresCalificacion.objects.filter(calificacion__usuario=self.otro).count(), 3)
+        self.assertFalse(ajenas.exclude(origen='CORREDOR').exists())
+
+    def test_eliminar_el_filtro_por_bloques(self):
+        avance = self.operar(seleccion='filtro', accion='eliminar')
+        self.assertEqual([linea['procesadas'] for linea in avance], [0, 2, 4, 5, 5])
+        self.assertTrue(avance[-1]['fin'])
+        self.assertFalse(CalificacionTributaria.objects.filter(usuario=self.usuario).exists())
+        self.assertFalse(FactoresCalificacion.objects.filter(calificacion__usuario=self.usuario).exists())
+        self.assertAjenasIntactas()
+        self.assertContadoresCuadran()
+        self.assertEqual(contadores.valores(contadores.clave_faceta('mercado', 'CFI'))['facetas:mercado:CFI'], 0)
+
+    def test_eliminar_ids_ignora_los_de_otros_usuarios(self):
+        ids = [c.id for c in self.propias[:3]] + [c.id for c in self.ajenas]
+        avance = self.operar(seleccion='ids', accion='eliminar', ids=ids)
+        self.assertEqual((avance[0]['total'], avance[-1]['procesadas']), (3, 3))
+        self.assertEqual(
+            set(CalificacionTributaria.objects.filter(usuario=self.usuario).values_list('id', flat=True)),
+            {c.id for c in self.propias[3:]},
+        )
+        self.assertAjenasIntactas()
+        self.assertContadoresCuadran()
+
+    def test_modificar_el_filtro_por_bloques(self):
+        avance = self.operar(seleccion='filtro', accion='modificar', origen='SISTEMA', mercado='ACN')
+        self.assertEqual([linea['procesadas'] for linea in avance], [0, 2, 4, 4])
+        propias = CalificacionTributaria.objects.filter(usuario=self.usuario)
+        self.assertEqual(propias.filter(origen='SISTEMA').count(), 4)
+        self.assertEqual(propias.get(mercado='CFI').origen, 'CORREDOR')
+        self.assertAjenasIntactas()
+        self.assertContadoresCuadran()
+
+    def test_modificar_rechaza_campos_no_editables(self):
+        with self.assertRaises(ValidationError):
+            masivo.limpiar_cambios({'ejercicio': '2020'})
+        respuesta = self.client.post(reverse('calificaciones:masivo'), {'seleccion': 'filtro', 'accion': 'modificar'})
+        self.assertEqual(respuesta.status_code, 400)
+
+
+# ==========================================
+# LIBROS EXCEL
+# ==========================================
+
+def libro_xlsx(tipo_carga, filas):
+    """Libro .xlsx con el mismo contenido que plantilla_csv, con números y fechas como celdas tipadas"""
+    libro = Workbook()
+    hoja = libro.active
+    for fila in csv.reader(io.StringIO(plantilla_csv(tipo_carga, []).decode())):
+        hoja.append(fila)
+    for fila in filas:
+        hoja.append([
+            date.fromisoformat(valor) if i == 3 else (Decimal(valor) if isinstance(valor, str) and i > 5 else valor)
+            for i, valor in enumerate(fila)
+        ])
+    salida = io.BytesIO()
+    libro.save(salida)
+    return salida.getvalue()
+
+
+class XlsxTests(ConArchivos, TestCase):
+    """filas_xlsx usa la API interna de openpyxl: estas pruebas la vigilan al cambiar de versión"""
+
+    def setUp(self):
+        super().setUp()
+        self.usuario = User.objects.create_user('corredor', password='x')
+        self.empresa = crear_empresa(self.usuario)
+        self.contenido = libro_xlsx('FACTORES', [fila_factores(i) for i in range(5)])
+
+    def test_mismas_filas_que_la_api_publica(self):
+        ancho = len(COLUMNAS_FACTORES) + 30
+        leidas = list(importacion.filas_xlsx(io.BytesIO(self.contenido), ancho))
+
+        libro = load_workbook(io.BytesIO(self.contenido), read_only=True)
+        esperadas = [
+            [importacion.texto_celda(valor) for valor in fila] + [''] * (ancho - len(fila))
+            for fila in libro.worksheets[0].iter_rows(values_only=True)
+        ]
+        libro.close()
+        self.assertEqual([fila for _, fila, _ in leidas], esperadas)
+        self.assertEqual([numero for numero, _, _ in leidas], list(range(1, len(esperadas) + 1)))
+        self.assertEqual(leidas[3][1][:6], ['2024', 'ACN', 'ACCION0', '2024-05-01', '0', 'Dividendo'])
+
+    def test_las_filas_leidas_se_sueltan_del_arbol(self):
+        iterparse = importacion.iterparse
+        datos = []
+
+        def espiar(*args, **kwargs):
+            for evento, elemento in iterparse(*args, **kwargs):
+                if evento == 'start' and elemento.tag == importacion.DATA_TAG:
+                    datos.append(elemento)
+                yield evento, elemento
+
+        with mock.patch.object(importacion, 'iterparse', espiar):
+            self.assertEqual(len(list(importacion.filas_xlsx(io.BytesIO(self.contenido)))), 8)
+        self.assertEqual(len(datos), 1)
+        self.assertEqual(len(datos[0]), 0)
+
+    def test_carga_igual_que_el_csv(self):
+        archivo_carga = self.encolar_csv(self.empresa, self.contenido, nombre='carga.xlsx')
+        self.assertEqual(cola.ciclo_trabajador(una_vez=True), 1)
+        archivo_carga.refresh_from_db()
+        self.assertEqual((archivo_carga.estado, archivo_carga.registros_insertados), ('COMPLETADO', 5))
+        calificacion = CalificacionTributaria.objects.get(empresa=self.empresa, instrumento='ACCION3')
+        self.assertEqual(calificacion.fecha_pago, date(2024, 5, 1))
+        self.assertEqual(calificacion.factorescalificacion.factor_8, Decimal('0.05'))
+
+
+# ==========================================
+# ADMINISTRACIÓN
+# ==========================================
+
+class ValidezFactoresAdminTests(TestCase):
+
+    def setUp(self):
+        # Filas inválidas cargadas antes de la restricción: se insertan sin ella
+        self.desactivar_restriccion_8_16()
+        self.client.force_login(User.objects.create_superuser('admin', password='x'))
+        calificaciones = crear_calificaciones(crear_empresa(User.objects.create_user('corredor', password='x')), 5)
+        # NULL cuenta como 0 en la suma 8-16
+        self.ids = {
+            nombre: FactoresCalificacion.objects.create(calificacion=calificacion, **valores).pk
+            for nombre, calificacion, valores in [
+                ('normal', calificaciones[0], {campo: Decimal('0.05') for campo in CAMPOS_FACTORES[:9]}),
+                ('borde', calificaciones[1], {'factor_8': Decimal('0.96'), 'factor_16': Decimal('0.04')}),
+                ('nulos', calificaciones[2], {}),
+                ('excedido', calificaciones[3], {campo: Decimal('0.2') for campo in CAMPOS_FACTORES[:9]}),
+                ('excedido_con_nulos', calificaciones[4], {'factor_8': Decimal('0.9'), 'factor_12': Decimal('0.2')}),
+            ]
+        }
+
+    def desactivar_restriccion_8_16(self):
+        # Dentro de la transacción de la prueba: se deshace al terminar
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute(
+                    f'ALTER TABLE {FactoresCalificacion._meta.db_table} DROP CONSTRAINT {RESTRICCION_SUMA_8_16}'
+                )
+            else:
+                cursor.execute('PRAGMA ignore_check_constraints = ON')
+                self.addCleanup(connection.cursor().execute, 'PRAGMA ignore_check_constraints = OFF')
+
+    def listar(self, **filtros):
+        respuesta = self.client.get(reverse('admin:calificaciones_factorescalificacion_changelist'), filtros)
+        self.assertEqual(respuesta.status_code, 200)
+        return respuesta, {factores.pk: factores for factores in respuesta.context['cl'].result_list}
+
+    def nombres(self, filas):
+        return sorted(nombre for nombre, pk in self.ids.items() if pk in filas)
+
+    def test_filtro_de_validez(self):
+        _, filas = self.listar()
+        self.assertEqual(self.nombres(filas), sorted(self.ids))
+        _, filas = self.listar(validez='validos')
+        self.assertEqual(self.nombres(filas), ['borde', 'normal', 'nulos'])
+        _, filas = self.listar(validez='invalidos')
+        self.assertEqual(self.nombres(filas), ['excedido', 'excedido_con_nulos'])
+
+    def test_suma_y_validez_anotadas_por_la_base_de_datos(self):
+        respuesta, filas = self.listar()
+        esperado = {
+            'normal': (Decimal('0.45'), True),
+            'borde': (Decimal('1'), True),
+            'nulos': (Decimal('0'), True),
+            'excedido': (Decimal('1.8'), False),
+            'excedido_con_nulos': (Decimal('1.1'), False),
+        }
+        self.assertEqual(
+            {nombre: (filas[pk].suma_8_16, filas[pk].valido) for nombre, pk in self.ids.items()}, esperado,
+        )
+        self.assertContains(respuesta, '✅ Válido', count=3)
+        self.assertContains(respuesta, '❌ Inválido', count=2)
+
+
+# ==========================================
+# INSTRUMENTACIÓN SQL
+# ==========================================
+
+@override_settings(INSTRUMENTACION_SQL=True)
+class InstrumentacionSQLTests(TestCase):
+
+    def setUp(self):
+        instrumentacion.reiniciar()
+        self.addCleanup(instrumentacion.reiniciar)
+        self.usuario = User.objects.create_user('corredor', password='x')
+        crear_calificaciones(crear_empresa(self.usuario), 3)
+
+    def test_registra_consultas_y_duracion_por_vista(self):
+        self.client.force_login(self.usuario)
+        with self.assertLogs('calificaciones.sql', 'INFO') as registros:
+            respuesta = self.client.get(reverse('calificaciones:mantenedor'))
+        self.assertRegex(respuesta['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ consultas", app;dur=[\d.]+')
+
+        datos = json.loads(registros.records[-1].getMessage())
+        self.assertEqual((datos['vista'], datos['estado']), ('calificaciones:mantenedor', 200))
+        self.assertGreater(datos['consultas'], 0)
+        self.assertGreater(datos['duracion_ms'], 0)
+
+        fila, = [fila for fila in instrumentacion.estadisticas() if fila['vista'] == 'calificaciones:mantenedor']
+        self.assertEqual((fila['peticiones'], fila['consultas_max']), (1, datos['consultas']))
+        self.assertEqual(sum(fila['tramos']), 1)
+        self.assertGreater(fila['sql_total_ms'], 0)
+
+    def test_detecta_consultas_repetidas(self):
+        registro = instrumentacion.RegistroConsultas()
+        with connection.execute_wrapper(registro):
+            for calificacion in CalificacionTributaria.objects.all():
+                calificacion.empresa  # Una consulta por fila (N+1)
+        self.assertEqual(registro.cantidad, 4)
+        (forma, veces), = registro.repetidas(3)
+        self.assertEqual(veces, 3)
+        self.assertIn('calificaciones_empresa', forma)
+
+    def test_la_pagina_es_solo_para_superusuarios(self):
+        url = reverse('instrumentacion_sql')
+        self.assertEqual(url, '/admin/instrumentacion-sql/')
+        self.assertRedirects(self.client.get(url), f'{reverse("admin:login")}?next={url}')
+
+        self.client.force_login(User.objects.create_user('staff', password='x', is_staff=True))
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.force_login(User.objects.create_superuser('admin', password='x'))
+        self.assertContains(self.client.get(reverse('admin:index')), f'href="{url}"')
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertRedirects(self.client.post(url), url)
+        # Después de reiniciar solo quedan las peticiones a la propia página
+        self.assertEqual([fila['vista'] for fila in instrumentacion.estadisticas()], ['instrumentacion_sql'])
+
+
+# ==========================================
+# MÉTRICAS
+# ==========================================
+
+class MetricasTests(SimpleTestCase):
+    clave = ('nuam_exportaciones_total', ())
+
+    def setUp(self):
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio, ignore_errors=True)
+        ajuste = override_settings(METRICAS_DIR=directorio)
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+        self.directorio = Path(directorio)
+        self.antes = metricas.valores_agregados().get(self.clave, 0)
+
+    def archivo_ajeno(self, nombre, pid, valor):
+        contenido = {'host': socket.gethostname(), 'pid': pid, 'valores': [['nuam_exportaciones_total', [], valor]]}
+        (self.directorio / nombre).write_text(json.dumps(contenido), encoding='utf-8')
+
+    def test_hereda_los_archivos_de_procesos_terminados(self):
+        terminado = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'], capture_output=True)
+        pid = int(terminado.stdout)
+        self.archivo_ajeno(f'{socket.gethostname()}_{pid}_abcd1234.json', pid, 5)
+
+        self.assertEqual(metricas.valores_agregados()[self.clave], self.antes + 5)
+        self.assertEqual([archivo.name for archivo in self.directorio.iterdir()], [metricas._archivo_proceso().name])
+        # Ya heredado, el total no retrocede ni se cuenta dos veces
+        self.assertEqual(metricas.valores_agregados()[self.clave], self.antes + 5)
+
+    def test_un_pid_reutilizado_no_pisa_el_archivo_anterior(self):
+        self.archivo_ajeno(f'{socket.gethostname()}_{os.getpid()}_anterior.json', os.getpid(), 3)
+        metricas.volcar()
+        self.assertEqual(len(list(self.directorio.glob('*.json'))), 2)
+        self.assertEqual(metricas.valores_agregados()[self.clave], self.antes + 3)
+
+
+# ==========================================
+# BANDEJA DE SALIDA DE CORREOS
+# ==========================================
+
+class CorreoTests(TestCase):
+
+    def encolar(self, cantidad):
+        return [
+            correo.encolar_correo(f'Código {i}', 'Su código es 123456', None, [f'usuario{i}@ejemplo.cl'])
+            for i in range(cantidad)
+        ]
+
+    def estados(self):
+        return list(CorreoSaliente.objects.order_by('id').values_list('estado', 'intentos'))
+
+    def test_envia_la_cola_y_termina(self):
+        self.encolar(3)
+        self.assertEqual(correo.ciclo_envio(una_vez=True, tamano_lote=2), 3)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(self.estados(), [('ENVIADO', 0)] * 3)
+
+    def test_lotes_reclamados_no_se_repiten(self):
+        self.encolar(5)
+        primero = correo.reclamar_lote('a', 3)
+        segundo = correo.reclamar_lote('b', 10)
+        self.assertEqual((len(primero), len(segundo)), (3, 2))
+        self.assertFalse({c.pk for c in primero} & {c.pk for c in segundo})
+        self.assertEqual(correo.reclamar_lote('c', 10), [])
+
+    @override_settings(CORREO_MAX_INTENTOS=2)
+    def test_rechazo_reintenta_con_backoff_y_termina_en_error(self):
+        self.encolar(1)
+        conexion = mock.Mock()
+        conexion.send_messages.side_effect = smtplib.SMTPRecipientsRefused({})
+
+        with self.assertLogs('calificaciones.correo', 'WARNING'):
+            self.assertEqual(correo.enviar_lote(correo.reclamar_lote('a', 10), conexion), 0)
+        pendiente = CorreoSaliente.objects.get()
+        self.assertEqual((pendiente.estado, pendiente.intentos), ('PENDIENTE', 1))
+        self.assertGreater(pendiente.proximo_intento, timezone.now())
+        self.assertEqual(correo.reclamar_lote('a', 10), [])  # Todavía en espera
+
+        CorreoSaliente.objects.update(proximo_intento=timezone.now() - timedelta(seconds=1))
+        with self.assertLogs('calificaciones.correo', 'WARNING'):
+            correo.enviar_lote(correo.reclamar_lote('a', 10), conexion)
+        self.assertEqual(self.estados(), [('ERROR', 2)])
+
+    def test_falla_de_conexion_devuelve_el_resto_sin_gastar_intentos(self):
+        self.encolar(3)
+        conexion = mock.Mock()
+        conexion.send_messages.side_effect = [1, OSError('conexión rechazada')]
+        with self.assertLogs('calificaciones.correo', 'ERROR'):
+            self.assertEqual(correo.enviar_lote(correo.reclamar_lote('a', 10), conexion), 1)
+        self.assertEqual(self.estados(), [('ENVIADO', 0), ('PENDIENTE', 1), ('PENDIENTE', 0)])
+        conexion.close.assert_called()
+
+    def test_servidor_desconectado_se_reabre_una_vez(self):
+        self.encolar(1)
+        conexion = mock.Mock()
+        conexion.send_messages.side_effect = [smtplib.SMTPServerDisconnected(), 1]
+        self.assertEqual(correo.enviar_lote(correo.reclamar_lote('a', 10), conexion), 1)
+        self.assertEqual(conexion.open.call_count, 2)
+        self.assertEqual(self.estados(), [('ENVIADO', 0)])
+
+    def test_recupera_los_correos_de_un_trabajador_muerto(self):
+        self.encolar(2)
+        muerto, vivo = correo.reclamar_lote('muerto', 1), correo.reclamar_lote('vivo', 1)
+        CorreoSaliente.objects.filter(pk=muerto[0].pk).update(reclamado=timezone.now() - timedelta(hours=1))
+        with self.assertLogs('calificaciones.correo', 'WARNING'):
+            self.assertEqual(correo.recuperar_huerfanos(), 1)
+        self.assertEqual(
+            list(CorreoSaliente.objects.order_by('id').values_list('estado', 'trabajador')),
+            [('PENDIENTE', ''), ('ENVIANDO', 'vivo')],
+        )
+        self.assertEqual([c.pk for c in correo.reclamar_lote('otro', 10)], [muerto[0].pk])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'SKIP LOCKED solo en PostgreSQL')
+class CorreoSkipLockedTests(TransactionTestCase):
+
+    def test_reclamar_salta_las_filas_bloqueadas(self):
+        correos = [correo.encolar_correo('Código', 'texto', None, ['a@ejemplo.cl']) for _ in range(3)]
+        bloqueado, liberar = threading.Event(), threading.Event()
+
+        def otro_trabajador():
+            # Mantiene bloqueada la primera fila, como un reclamo en curso en otro proceso
+            try:
+                with transaction.atomic():
+                    CorreoSaliente.objects.select_for_update().get(pk=correos[0].pk)
+                    bloqueado.set()
+                    liberar.wait(10)
+            finally:
+                connection.close()
+
+        hilo = threading.Thread(target=otro_trabajador)
+        hilo.start()
+        try:
+            self.assertTrue(bloqueado.wait(10))
+            reclamados = correo.reclamar_lote('trabajador', 10)
+        finally:
+            liberar.set()
+            hilo.join()
+        self.assertEqual([c.pk for c in reclamados], [c.pk for c in correos[1:]])
@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import api, views
 
 app_name = 'calificaciones'
 
@@ -30,9 +30,21 @@ urlpatterns = [
     path('ingresar/', views.ingresar_calificacion, name='ingresar'),
     path('modificar/<int:id>/', views.modificar_calificacion, name='modificar'),
     path('eliminar/<int:id>/', views.eliminar_calificacion, name='eliminar'),
+    path('exportar/', views.exportar_calificaciones, name='exportar'),
+    path('mantenedor/masivo/', views.operacion_masiva, name='masivo'),
     path('empresas/', views.lista_empresas, name='empresas'),
     path('empresas/agregar/', views.agregar_empresa, name='agregar_empresa'),
     path('carga-masiva/', views.carga_masiva, name='carga_masiva'),
+    path('carga-masiva/<int:carga_id>/cancelar/', views.cancelar_carga, name='cancelar_carga'),
+    path('carga-masiva/<int:carga_id>/reanudar/', views.reanudar_carga, name='reanudar_carga'),
+    path('carga-masiva/subidas/', views.iniciar_subida, name='subidas'),
+    path('carga-masiva/subidas/<int:subida_id>/', views.subida_carga, name='subida'),
+    path('carga-masiva/subidas/<int:subida_id>/completar/', views.completar_subida, name='completar_subida'),
     path('descargar-plantilla-montos/', views.descargar_plantilla_montos, name='descargar_plantilla_montos'),
     path('descargar-plantilla-factores/', views.descargar_plantilla_factores, name='descargar_plantilla_factores'),
+    # === MÉTRICAS (Prometheus) ===
+    path('metricas/', views.exportar_metricas, name='metricas'),
+    # === API POR LOTES (v1) ===
+    path('api/v1/calificaciones/', api.listar_calificaciones, name='api_calificaciones'),
+    path('api/v1/calificaciones/lote/', api.lote_calificaciones, name='api_lote'),
 ]
\ No newline at end of file
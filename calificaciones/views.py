@@ -1,18 +1,33 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError
+from django.views.decorators.http import require_POST
+from django.urls import reverse
 from django.contrib import messages 
-from .models import Empresa, CalificacionTributaria, Profile, PasswordResetToken, ArchivoCarga
+from .models import Empresa, CalificacionTributaria, Profile, PasswordResetToken, ArchivoCarga, SubidaCarga
 from .forms import EmpresaForm, UserCreateForm, UserManagementForm
+from .cola import encolar
+from .importacion import EXTENSIONES_CARGA
+from .correo import encolar_correo
+from .paginacion import CursorInvalido, contar, paginar, paginar_por_relevancia, tamano_pagina
+from . import busqueda, cola, contadores, facetas, masivo, metricas, plantillas, subidas
 import csv
-from datetime import datetime, timedelta
+import hmac
+import json
+import time
+from datetime import timedelta
+from functools import partial
+from decimal import Decimal
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth import get_user_model, login, authenticate, logout
 from django.contrib.auth.models import User  
+from django.db.models import Count
 import pyotp
 import qrcode
 import base64
 from io import BytesIO
-from django.core.mail import send_mail
 from django.utils import timezone
 import random
 
@@ -27,9 +42,9 @@ def send_mfa_email_code(user):
     profile.mfa_email_code_expires = timezone.now() + timedelta(minutes=10)  # 10 minutos
     profile.save()
     
-    # Enviar email
+    # Dejar el email en la bandeja de salida (lo entrega manage.py enviar_correos)
     try:
-        send_mail(
+        encolar_correo(
             'Código de Verificación MFA - NUAM Capital',
             f'''
             NUAM CAPITAL - Código de Verificación
@@ -48,8 +63,7 @@ def send_mfa_email_code(user):
             ''',
             'NUAM Capital <noreply@nuamcapital.cl>',
             [user.email],
-            fail_silently=False,
-            html_message=f'''
+            cuerpo_html=f'''
             <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;">
                 <div style="background: #1a365d; color: white; padding: 20px; text-align: center;">
                     <h2 style="margin: 0;">NUAM CAPITAL</h2>
@@ -93,21 +107,26 @@ def admin_users(request):
     User = get_user_model()  # ✅ Esto obtiene el modelo User correcto
     usuarios = User.objects.all().select_related('profile')
     
-    # AGREGAR ESTOS TOTALES PARA EL DASHBOARD
-    total_empresas = Empresa.objects.count()
-    total_calificaciones = CalificacionTributaria.objects.count()
-    total_archivos = ArchivoCarga.objects.count()
+    # Totales materializados (ver contadores.py): una sola consulta a la tabla de contadores
+    totales = contadores.valores(
+        contadores.USUARIOS,
+        contadores.clave_rol('ADMIN'),
+        contadores.clave_rol('USER'),
+        contadores.clave_rol('VIEWER'),
+        contadores.EMPRESAS,
+        contadores.CALIFICACIONES,
+        contadores.ARCHIVOS,
+    )
     
     context = {
         'usuarios': usuarios,
-        'total_usuarios': usuarios.count(),
-        'admins': usuarios.filter(profile__rol='ADMIN').count(),
-        'usuarios_normales': usuarios.filter(profile__rol='USER').count(),
-        'viewers': usuarios.filter(profile__rol='VIEWER').count(),
-        # NUEVOS TOTALES PARA EL DASHBOARD
-        'total_empresas': total_empresas,
-        'total_calificaciones': total_calificaciones,
-        'total_archivos': total_archivos,
+        'total_usuarios': totales[contadores.USUARIOS],
+        'admins': totales[contadores.clave_rol('ADMIN')],
+        'usuarios_normales': totales[contadores.clave_rol('USER')],
+        'viewers': totales[contadores.clave_rol('VIEWER')],
+        'total_empresas': totales[contadores.EMPRESAS],
+        'total_calificaciones': totales[contadores.CALIFICACIONES],
+        'total_archivos': totales[contadores.ARCHIVOS],
     }
     return render(request, 'users_management.html', context)
 
@@ -183,11 +202,13 @@ def admin_empresas(request):
     """Vista para que admin vea TODAS las empresas"""
     empresas = Empresa.objects.all().select_related('usuario')
     
+    total_empresas = contadores.valores(contadores.EMPRESAS)[contadores.EMPRESAS]
+    
     context = {
         'empresas': empresas,
-        'total_empresas': empresas.count(),
-        'empresas_activas': empresas.count(),  # Puedes ajustar esta lógica
-        'usuarios_empresas': User.objects.filter(empresa__isnull=False).distinct().count(),
+        'total_empresas': total_empresas,
+        'empresas_activas': total_empresas,  # Puedes ajustar esta lógica
+        'usuarios_empresas': contadores.usuarios_con_empresas(),
     }
     return render(request, 'admin_empresas.html', context)
 
@@ -197,12 +218,16 @@ def admin_archivos_carga(request):
     """Vista para que admin vea TODOS los archivos de carga"""
     archivos = ArchivoCarga.objects.all().select_related('empresa__usuario').order_by('-fecha_carga')
     
+    # La cola cambia el estado con UPDATE masivos, así que el desglose se calcula
+    # con una sola consulta agrupada (usa el índice estado + fecha_carga)
+    por_estado = dict(ArchivoCarga.objects.values_list('estado').annotate(total=Count('id')).order_by())
+    
     context = {
         'archivos': archivos,
-        'total_archivos': archivos.count(),
-        'completados': archivos.filter(estado='COMPLETADO').count(),
-        'pendientes': archivos.filter(estado='PENDIENTE').count(),
-        'con_errores': archivos.filter(estado='ERROR').count(),
+        'total_archivos': sum(por_estado.values()),
+        'completados': por_estado.get('COMPLETADO', 0),
+        'pendientes': por_estado.get('PENDIENTE', 0),
+        'con_errores': por_estado.get('ERROR', 0),
     }
     return render(request, 'admin_archivos_carga.html', context)
 
@@ -223,18 +248,18 @@ def admin_calificaciones(request):
         calificaciones = calificaciones.filter(usuario_id=usuario_id)
     if mercado:
         calificaciones = calificaciones.filter(mercado__icontains=mercado)
-    
-    # Obtener valores únicos para los filtros
-    ejercicios = CalificacionTributaria.objects.values_list('ejercicio', flat=True).distinct().order_by('-ejercicio')
-    mercados = CalificacionTributaria.objects.values_list('mercado', flat=True).distinct()
-    
-    context = {
-        'calificaciones': calificaciones,
-        'usuarios': User.objects.all(),
-        'ejercicios': ejercicios,
-        'mercados': mercados,
-    }
-    return render(request, 'admin_calificaciones.html', context)
+    texto = request.GET.get('q')
+    
+    # Valores de los filtros (ejercicios, mercados, usuarios) desde los contadores de facetas
+    context = facetas.obtener()
+    return listado_paginado(
+        request,
+        busqueda.buscar(calificaciones, texto),
+        CAMPOS_LISTADO + ['empresa__nombre', 'usuario__username'],
+        'admin_calificaciones.html',
+        context,
+        coincidencias=busqueda.buscar(calificaciones, texto, limite=None),
+    )
 
 @login_required
 def mfa_view(request):
@@ -281,6 +306,7 @@ def mfa_view(request):
             'secret': secret
         })
 
+@metricas.medir_post(metricas.DURACION_MFA)
 def verify_mfa_view(request):
     """Vista para verificar código MFA - SOLO EMAIL"""
     pending_user_id = request.session.get('pending_user_id')
@@ -316,13 +342,16 @@ def verify_mfa_view(request):
             
             del request.session['pending_user_id']
             login(request, user)
+            metricas.VERIFICACIONES_MFA.inc(resultado='ok')
             messages.success(request, f"✅ ¡Verificación exitosa! Bienvenido {user.first_name}")
             return redirect('calificaciones:dashboard')
         else:
+            metricas.VERIFICACIONES_MFA.inc(resultado='fallido')
             messages.error(request, "❌ Código incorrecto o expirado. Intenta nuevamente.")
     
     return render(request, 'verify_mfa.html')
 
+@metricas.medir_post(metricas.DURACION_LOGIN)
 def login_view(request):
     """
     Vista de login corregida y mejorada
@@ -335,38 +364,31 @@ def login_view(request):
         email = request.POST.get("email")
         password = request.POST.get("password")
         
-        # Buscar usuario por email (username o email real)
-        user = None
-        
-        # Intentar autenticar con username (que es el email en nuestro caso)
+        # Un solo authenticate: EmailOUsuarioBackend acepta username o email
         user = authenticate(request, username=email, password=password)
-        
-        # Si no funciona, intentar buscar por email real
-        if user is None:
-            try:
-                user_by_email = User.objects.get(email=email)
-                user = authenticate(request, username=user_by_email.username, password=password)
-            except User.DoesNotExist:
-                pass
 
         if user is not None:
             # Verificar si tiene MFA configurado
             if hasattr(user, "profile") and user.profile.mfa_secret:
                 # ENVIAR CÓDIGO POR EMAIL en lugar de redirigir a app
                 if send_mfa_email_code(user):
+                    metricas.LOGINS.inc(resultado='mfa_pendiente')
                     request.session["pending_user_id"] = user.id
                     request.session["mfa_type"] = "email"  # Indicar que es MFA por email
                     messages.info(request, "Se ha enviado un código de verificación a tu email")
                     return redirect("calificaciones:verify_mfa")
                 else:
+                    metricas.LOGINS.inc(resultado='error_mfa')
                     messages.error(request, "Error al enviar código de verificación")
                     return render(request, "login.html")
             
             # Login sin MFA
             login(request, user)
+            metricas.LOGINS.inc(resultado='ok')
             messages.success(request, f"¡Bienvenido {user.first_name}!")
             return redirect("calificaciones:dashboard")
         else:
+            metricas.LOGINS.inc(resultado='fallido')
             messages.error(request, "Credenciales incorrectas")
     
     # Si es GET, simplemente renderizar el template
@@ -378,7 +400,7 @@ def forgot_password_view(request):
         email = request.POST.get('email', '').strip().lower()
         
         try:
-            user = User.objects.get(email=email)
+            user = User.objects.get(email__iexact=email)
             reset_token = PasswordResetToken.objects.create(user=user)
             
             # USAR localhost EN LUGAR DE 127.0.0.1
@@ -386,7 +408,7 @@ def forgot_password_view(request):
             
             print(f"URL GENERADA: {reset_url}")
             
-            send_mail(
+            encolar_correo(
                 'Recuperación de Contraseña - NUAM Capital',
                 f'''
                 NUAM CAPITAL - Recuperación de Contraseña
@@ -403,8 +425,7 @@ def forgot_password_view(request):
                 ''',
                 'NUAM Capital <noreply@nuamcapital.cl>',
                 [user.email],
-                fail_silently=False,
-                html_message=f'''
+                cuerpo_html=f'''
                 <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;">
                     <div style="background: #1a365d; color: white; padding: 20px; text-align: center;">
                         <h2 style="margin: 0;">NUAM CAPITAL</h2>
@@ -524,7 +545,7 @@ def register_view(request):
             return render(request, "home_public.html")
 
         # Verificar si el usuario ya existe (por email o username)
-        if User.objects.filter(email=email).exists():
+        if User.objects.filter(email__iexact=email).exists():
             messages.error(request, "Ya existe una cuenta con este correo electrónico")
             return render(request, "home_public.html")
 
@@ -561,17 +582,16 @@ def home(request):
     """Página principal - Datos DEL USUARIO ACTUAL"""
     if request.user.is_authenticated:
         # Datos para el dashboard autenticado - SOLO DEL USUARIO
-        total_empresas = Empresa.objects.filter(usuario=request.user).count()
-        total_calificaciones = CalificacionTributaria.objects.filter(usuario=request.user).count()
-        
-        # Contar usuarios con MFA habilitado (esto sigue global)
-        usuarios_con_mfa = Profile.objects.filter(mfa_secret__isnull=False).count()
+        clave_empresas = contadores.clave_empresas_usuario(request.user.id)
+        clave_calificaciones = contadores.clave_calificaciones_usuario(request.user.id)
+        # Usuarios con MFA habilitado (esto sigue global)
+        totales = contadores.valores(clave_empresas, clave_calificaciones, contadores.PERFILES_MFA)
         
         context = {
             'page_title': 'Panel General - NUAM',
-            'total_empresas': total_empresas,
-            'total_calificaciones': total_calificaciones,
-            'usuarios_activos': usuarios_con_mfa,
+            'total_empresas': totales[clave_empresas],
+            'total_calificaciones': totales[clave_calificaciones],
+            'usuarios_activos': totales[contadores.PERFILES_MFA],
             'factores_range': range(8, 17),
         }
         return render(request, 'dashboard_authenticated.html', context)
@@ -582,15 +602,17 @@ def home(request):
         }
         return render(request, 'home_public.html', context)
     
-@login_required
-def mantenedor_calificaciones(request):
-    """Vista principal del mantenedor con datos DEL USUARIO ACTUAL"""
-    calificaciones = CalificacionTributaria.objects.filter(usuario=request.user).select_related('empresa')
+def filtrar_calificaciones(request, parametros=None, limite_busqueda=busqueda.LIMITE_CANDIDATOS):
+    """
+    Calificaciones DEL USUARIO ACTUAL con los filtros del mantenedor (ejercicio, mercado, instrumento, q),
+    leídos de request.GET o de `parametros`
+    """
+    parametros = request.GET if parametros is None else parametros
+    calificaciones = CalificacionTributaria.objects.filter(usuario=request.user)
     
-    # Filtros (solo sobre los datos del usuario)
-    ejercicio = request.GET.get('ejercicio')
-    mercado = request.GET.get('mercado')
-    instrumento = request.GET.get('instrumento')
+    ejercicio = parametros.get('ejercicio')
+    mercado = parametros.get('mercado')
+    instrumento = parametros.get('instrumento')
     
     if ejercicio:
         calificaciones = calificaciones.filter(ejercicio=ejercicio)
@@ -599,10 +621,134 @@ def mantenedor_calificaciones(request):
     if instrumento:
         calificaciones = calificaciones.filter(instrumento__icontains=instrumento)
     
-    context = {
-        'calificaciones': calificaciones,
-    }
-    return render(request, 'mantenedor.html', context)
+    return busqueda.buscar(calificaciones, parametros.get('q'), limite=limite_busqueda)
+
+CAMPOS_LISTADO = ['id', 'instrumento', 'descripcion_dividendo', 'ejercicio', 'mercado', 'fecha_pago', 'origen']
+
+def calificacion_json(fila):
+    """Fila de .values(CAMPOS_LISTADO) -> dict para las respuestas JSON del listado"""
+    origenes = dict(CalificacionTributaria.TIPO_ORIGEN)
+    datos = dict(fila)
+    datos['fecha_pago'] = fila['fecha_pago'].isoformat()
+    datos['origen_display'] = origenes.get(fila['origen'], fila['origen'])
+    datos['url_modificar'] = reverse('calificaciones:modificar', args=[fila['id']])
+    datos['url_eliminar'] = reverse('calificaciones:eliminar', args=[fila['id']])
+    return datos
+
+def listado_paginado(request, calificaciones, campos_json, plantilla, context, coincidencias=None):
+    """
+    Listado de calificaciones con paginación por cursor.
+    Con ?formato=json devuelve la misma página como JSON (para scroll infinito).
+    Si hay búsqueda de texto (?q=) se ordena por relevancia en vez de por fecha de pago.
+    `coincidencias` es la misma consulta sin el límite de candidatos de la búsqueda:
+    se usa para el total y para avisar si el listado quedó recortado.
+    """
+    cursor = request.GET.get('cursor')
+    tamano = tamano_pagina(request.GET.get('tamano'))
+    if busqueda.es_busqueda(calificaciones):
+        paginar_listado = paginar_por_relevancia
+        campos_json = [*campos_json, 'relevancia']
+    else:
+        paginar_listado = paginar
+
+    if request.GET.get('formato') == 'json':
+        try:
+            pagina = paginar_listado(calificaciones.values(*campos_json), cursor, tamano)
+        except CursorInvalido:
+            return JsonResponse({'error': 'Cursor de paginación no válido'}, status=400)
+        return JsonResponse({
+            'resultados': [calificacion_json(fila) for fila in pagina.elementos],
+            'siguiente': pagina.siguiente,
+        })
+
+    try:
+        pagina = paginar_listado(calificaciones, cursor, tamano)
+    except CursorInvalido:
+        messages.error(request, 'El enlace de la página no es válido; se muestra la primera página.')
+        pagina = paginar_listado(calificaciones, None, tamano)
+    coincidencias = calificaciones if coincidencias is None else coincidencias
+    total, estimado = contar(coincidencias)
+    recortada = busqueda.es_busqueda(calificaciones) and busqueda.supera_limite(coincidencias)
+
+    filtros = request.GET.copy()
+    filtros.pop('cursor', None)
+    filtros.pop('formato', None)
+
+    context.update({
+        'calificaciones': pagina.elementos,
+        'siguiente': pagina.siguiente,
+        'total_calificaciones': total,
+        'total_estimado': estimado,
+        'busqueda_recortada': recortada,
+        'limite_busqueda': busqueda.LIMITE_CANDIDATOS,
+        'filtros': filtros.urlencode(),
+    })
+    return render(request, plantilla, context)
+
+@login_required
+def mantenedor_calificaciones(request):
+    """Vista principal del mantenedor con datos DEL USUARIO ACTUAL"""
+    return listado_paginado(
+        request,
+        filtrar_calificaciones(request),
+        CAMPOS_LISTADO,
+        'mantenedor.html',
+        {
+            'origenes': CalificacionTributaria.TIPO_ORIGEN,
+            'tipos_sociedad': CalificacionTributaria.TIPO_SOCIEDAD,
+        },
+        coincidencias=filtrar_calificaciones(request, limite_busqueda=None),
+    )
+
+@login_required
+@require_POST
+def operacion_masiva(request):
+    """
+    Elimina o modifica en bloque las calificaciones marcadas (ids) o todas las del filtro
+    actual. Responde NDJSON con el avance después de cada bloque (ver masivo.py); los
+    bloques ya informados quedan confirmados aunque la operación se corte después.
+    """
+    perfil = getattr(request.user, 'profile', None)
+    if perfil is not None and perfil.es_solo_lectura():
+        return JsonResponse({'error': 'Su usuario es de solo lectura'}, status=403)
+
+    if request.POST.get('seleccion') == 'filtro':
+        # Sin límite de candidatos: debe alcanzar todas las coincidencias de la búsqueda
+        calificaciones = filtrar_calificaciones(request, request.POST, limite_busqueda=None)
+    else:
+        ids = [int(valor) for valor in request.POST.getlist('ids') if valor.isdigit()]
+        if not ids:
+            return JsonResponse({'error': 'No marcó ninguna calificación'}, status=400)
+        calificaciones = CalificacionTributaria.objects.filter(usuario=request.user, id__in=ids)
+
+    accion = request.POST.get('accion')
+    if accion == 'eliminar':
+        operacion = masivo.eliminar
+    elif accion == 'modificar':
+        try:
+            cambios = masivo.limpiar_cambios({
+                campo: request.POST[campo] for campo in masivo.CAMPOS_EDITABLES if request.POST.get(campo)
+            })
+        except ValidationError as e:
+            return JsonResponse({'error': ' '.join(e.messages)}, status=400)
+        operacion = partial(masivo.actualizar, cambios=cambios)
+    else:
+        return JsonResponse({'error': 'Acción no válida'}, status=400)
+
+    calificaciones, total = masivo.preparar(calificaciones)
+
+    def generar():
+        procesadas = 0
+        yield json.dumps({'procesadas': 0, 'total': total}) + '\n'
+        try:
+            for procesadas in operacion(calificaciones):
+                yield json.dumps({'procesadas': procesadas, 'total': total}) + '\n'
+        except DatabaseError as e:
+            yield json.dumps({'error': f'Error de base de datos: {e}', 'procesadas': procesadas, 'total': total}) + '\n'
+            return
+        yield json.dumps({'fin': True, 'procesadas': procesadas, 'total': total}) + '\n'
+
+    return StreamingHttpResponse(generar(), content_type='application/x-ndjson; charset=utf-8')
 
 @login_required
 def ingresar_calificacion(request):
@@ -695,8 +841,150 @@ def eliminar_calificacion(request, id):
     }
     return render(request, 'confirmar_eliminar.html', context)
 
+@login_required
 def carga_masiva(request):
-    return render(request, 'carga_masiva.html')
+    """Vista de carga masiva - recibe el archivo y lo deja en la cola de procesamiento"""
+    empresas = Empresa.objects.filter(usuario=request.user)
+
+    if request.method == 'POST':
+        archivo = request.FILES.get('archivo')
+        empresa, error = _validar_carga(request, empresas, archivo.name if archivo else '')
+        if error:
+            messages.error(request, error)
+        else:
+            archivo_carga = encolar(empresa, archivo, request.POST['tipo_carga'])
+            _carga_recibida(request, archivo_carga)
+            return redirect('calificaciones:carga_masiva')
+
+    context = {
+        'empresas': empresas,
+        'cargas_recientes': ArchivoCarga.objects.filter(empresa__usuario=request.user).order_by('-fecha_carga')[:10],
+        'tamano_parte': settings.CARGA_MASIVA_TAMANO_PARTE,
+    }
+    return render(request, 'carga_masiva.html', context)
+
+def _validar_carga(request, empresas, nombre_archivo):
+    """Valida archivo, tipo de carga y empresa del formulario. Devuelve (empresa, mensaje de error)"""
+    empresa = empresas.filter(id=request.POST.get('empresa') or None).first()
+    if not nombre_archivo:
+        return None, 'Debe seleccionar un archivo'
+    if request.POST.get('tipo_carga') not in dict(ArchivoCarga.TIPO_CARGA):
+        return None, 'Debe seleccionar un tipo de carga válido'
+    if empresa is None:
+        return None, 'Debe seleccionar una de sus empresas'
+    if not nombre_archivo.lower().endswith(EXTENSIONES_CARGA):
+        return None, 'Solo se aceptan archivos CSV o Excel (.xlsx)'
+    return empresa, None
+
+def _carga_recibida(request, archivo_carga):
+    metricas.CARGAS_RECIBIDAS.inc(tipo=archivo_carga.tipo_carga)
+    metricas.BYTES_CARGA.observar(archivo_carga.tamano, tipo=archivo_carga.tipo_carga)
+    messages.success(
+        request,
+        f'Archivo {archivo_carga.nombre_archivo} recibido. Se procesará en segundo plano; '
+        f'puede seguir su estado en esta página.'
+    )
+
+@login_required
+@require_POST
+def cancelar_carga(request, carga_id):
+    """Detiene el procesamiento de un archivo; lo ya confirmado se conserva"""
+    archivo_carga = get_object_or_404(ArchivoCarga, pk=carga_id, empresa__usuario=request.user)
+    if cola.cancelar(archivo_carga):
+        messages.success(request, f'Carga {archivo_carga.nombre_archivo} cancelada. Puede reanudarla más tarde.')
+    else:
+        messages.error(request, 'Solo se pueden cancelar cargas pendientes o en proceso')
+    return redirect('calificaciones:carga_masiva')
+
+@login_required
+@require_POST
+def reanudar_carga(request, carga_id):
+    """Vuelve a encolar un archivo cancelado; continúa desde el último lote confirmado"""
+    archivo_carga = get_object_or_404(ArchivoCarga, pk=carga_id, empresa__usuario=request.user)
+    if cola.reanudar(archivo_carga):
+        messages.success(request, f'Carga {archivo_carga.nombre_archivo} reanudada desde la línea {archivo_carga.ultima_linea}.')
+    else:
+        messages.error(request, 'Solo se pueden reanudar cargas canceladas')
+    return redirect('calificaciones:carga_masiva')
+
+# ==========================================
+# SUBIDA POR PARTES (archivos grandes, ver subidas.py)
+# ==========================================
+
+def _estado_subida(subida):
+    return {
+        'id': subida.pk,
+        'estado': subida.estado,
+        'recibidos': subida.recibidos,
+        'tamano': subida.tamano,
+        'url': reverse('calificaciones:subida', args=[subida.pk]),
+    }
+
+@login_required
+@require_POST
+def iniciar_subida(request):
+    """Registra una subida por partes (mismos campos que el formulario, más nombre y tamaño del archivo)"""
+    nombre_archivo = request.POST.get('nombre_archivo', '')
+    empresa, error = _validar_carga(request, Empresa.objects.filter(usuario=request.user), nombre_archivo)
+    if error:
+        return JsonResponse({'error': error}, status=400)
+    try:
+        subida = subidas.iniciar(
+            request.user, empresa, request.POST['tipo_carga'], nombre_archivo,
+            int(request.POST.get('tamano') or 0), request.POST.get('sha256', ''),
+        )
+    except ValueError:
+        return JsonResponse({'error': 'Tamaño de archivo inválido'}, status=400)
+    except subidas.ErrorSubida as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(_estado_subida(subida), status=201)
+
+@login_required
+def subida_carga(request, subida_id):
+    """
+    GET: estado de la subida (para retomarla).
+    PUT ?desde=<byte>: una parte, cuerpo binario con cabecera X-Checksum-SHA256.
+    DELETE: cancela la subida.
+    """
+    subida = get_object_or_404(SubidaCarga, pk=subida_id, usuario=request.user)
+    if request.method == 'GET':
+        return JsonResponse(_estado_subida(subida))
+    if request.method == 'DELETE':
+        subidas.cancelar(subida)
+        subida.refresh_from_db()
+        return JsonResponse(_estado_subida(subida))
+    if request.method != 'PUT':
+        return HttpResponseNotAllowed(['GET', 'PUT', 'DELETE'])
+
+    try:
+        desde = int(request.GET.get('desde', ''))
+        longitud = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return JsonResponse({'error': 'Posición de la parte inválida'}, status=400)
+    try:
+        # Se lee el cuerpo como flujo: request.body lo cargaría entero (y choca con DATA_UPLOAD_MAX_MEMORY_SIZE)
+        subidas.recibir_parte(subida, desde, request, longitud, request.headers.get('X-Checksum-SHA256', ''))
+    except subidas.ConflictoPosicion as e:
+        return JsonResponse({'error': str(e), **_estado_subida(subida)}, status=409)
+    except subidas.ErrorSubida as e:
+        return JsonResponse({'error': str(e), **_estado_subida(subida)}, status=400)
+    return JsonResponse(_estado_subida(subida))
+
+@login_required
+@require_POST
+def completar_subida(request, subida_id):
+    """Verifica el archivo ensamblado y lo deja en la cola de procesamiento"""
+    subida = get_object_or_404(SubidaCarga, pk=subida_id, usuario=request.user)
+    try:
+        archivo_carga = subidas.completar(subida)
+    except subidas.ErrorSubida as e:
+        return JsonResponse({'error': str(e), **_estado_subida(subida)}, status=400)
+    _carga_recibida(request, archivo_carga)
+    return JsonResponse({
+        'archivo_carga': archivo_carga.pk,
+        'sha256': archivo_carga.sha256,
+        'url': reverse('calificaciones:carga_masiva'),
+    })
 
 @login_required
 def lista_empresas(request):
@@ -731,26 +1019,67 @@ def buscar_calificaciones(request):
     """Vista para búsqueda específica (puede combinarse con mantenedor)"""
     return redirect('calificaciones:mantenedor')
 
+class Echo:
+    """Pseudo-buffer para csv.writer: devuelve la línea en vez de guardarla"""
+    def write(self, value):
+        return value
+
+# Columnas de la exportación: datos de la calificación + factores 8 al 37
+COLUMNAS_EXPORTACION = [
+    ('ejercicio', 'Ejercicio'),
+    ('mercado', 'Mercado'),
+    ('instrumento', 'Instrumento'),
+    ('fecha_pago', 'Fecha Pago'),
+    ('secuencia_evento', 'Secuencia Evento'),
+    ('descripcion_dividendo', 'Descripción'),
+    ('tipo_sociedad', 'Tipo Sociedad'),
+    ('valor_historico', 'Valor Histórico'),
+    ('acogido_isfut', 'Acogido ISFUT'),
+    ('origen', 'Origen'),
+    ('empresa__rut', 'RUT Empresa'),
+] + [(f'factorescalificacion__factor_{i}', f'Factor {i}') for i in range(8, 38)]
+
+@login_required
 def exportar_calificaciones(request):
-    """Vista para exportar calificaciones a CSV"""
+    """Vista para exportar calificaciones a CSV en streaming (mismos filtros que el mantenedor)"""
+    campos = [campo for campo, _ in COLUMNAS_EXPORTACION]
+    indice_origen = campos.index('origen')
+    indice_isfut = campos.index('acogido_isfut')
+    origenes = dict(CalificacionTributaria.TIPO_ORIGEN)
 
-    
-    response = HttpResponse(content_type='text/csv')
+    # Una sola consulta (JOIN con empresa y factores) leída por bloques con cursor de servidor.
+    # Sin límite de búsqueda: se exportan todas las coincidencias, no solo las más recientes
+    filas = (
+        filtrar_calificaciones(request, limite_busqueda=None)
+        .order_by('fecha_pago', 'id')
+        .values_list(*campos)
+        .iterator(chunk_size=2000)
+    )
+
+    def generar():
+        writer = csv.writer(Echo())
+        inicio = time.perf_counter()
+        escritas = 0
+        metricas.EXPORTACIONES_EN_CURSO.inc()
+        try:
+            yield '\ufeff'  # BOM para UTF-8
+            yield writer.writerow([titulo for _, titulo in COLUMNAS_EXPORTACION])
+            for fila in filas:
+                # format(..., 'f') evita notación científica (0E-8) en los decimales
+                fila = [format(valor, 'f') if isinstance(valor, Decimal) else valor for valor in fila]
+                fila[indice_origen] = origenes.get(fila[indice_origen], fila[indice_origen])
+                fila[indice_isfut] = 'SI' if fila[indice_isfut] else 'NO'
+                escritas += 1
+                yield writer.writerow(fila)
+        finally:
+            # También si el cliente corta la descarga a medias
+            metricas.EXPORTACIONES_EN_CURSO.dec()
+            metricas.FILAS_EXPORTADAS.inc(escritas)
+            metricas.DURACION_EXPORTACION.observar(time.perf_counter() - inicio)
+
+    metricas.EXPORTACIONES.inc()
+    response = StreamingHttpResponse(generar(), content_type='text/csv; charset=utf-8')
     response['Content-Disposition'] = 'attachment; filename="calificaciones.csv"'
-    
-    writer = csv.writer(response)
-    writer.writerow(['Ejercicio', 'Instrumento', 'Mercado', 'Fecha Pago', 'Origen'])
-    
-    calificaciones = CalificacionTributaria.objects.all()
-    for calif in calificaciones:
-        writer.writerow([
-            calif.ejercicio,
-            calif.instrumento,
-            calif.mercado,
-            calif.fecha_pago,
-            calif.get_origen_display()
-        ])
-    
     return response
 
 # Template para confirmar eliminación
@@ -771,339 +1100,17 @@ def confirmar_eliminar(request, id):
 @login_required  # Solo para usuarios autenticados
 def descargar_plantilla_montos(request):
     """Descargar plantilla CSV formal para carga de montos DJ1948"""
-    response = HttpResponse(content_type='text/csv; charset=utf-8')
-    response['Content-Disposition'] = 'attachment; filename="NUAM_Plantilla_Formal_Montos_DJ1948.csv"'
-    
-    response.write(u'\ufeff')  # BOM para UTF-8
-    writer = csv.writer(response, delimiter=',', quoting=csv.QUOTE_ALL)
-    
-    # ===== HEADER CORPORATIVO FORMAL =====
-    writer.writerow(['NUAM CAPITAL - SISTEMA INTEGRAL DE GESTIÓN TRIBUTARIA'])
-    writer.writerow(['PLANTILLA FORMAL PARA CARGA MASIVA DE MONTOS - FORMULARIO DJ1948'])
-    writer.writerow(['Fecha de Emisión:', datetime.now().strftime('%d de %B de %Y')])
-    writer.writerow(['Código Documento:', 'NUAM-DJ1948-PLANTILLA-1.0'])
-    writer.writerow(['Área Responsable:', 'Departamento de Cumplimiento Tributario'])
-    writer.writerow([])
-    
-    # ===== INSTRUCCIONES FORMALES =====
-    writer.writerow(['SECCIÓN I: INSTRUCCIONES FORMALES DE USO'])
-    writer.writerow(['1. IDENTIFICACIÓN DE CAMPOS OBLIGATORIOS'])
-    writer.writerow(['   - Campos marcados con (*) son de carácter obligatorio'])
-    writer.writerow(['   - El incumplimiento generará rechazo en la validación'])
-    writer.writerow([])
-    writer.writerow(['2. ESPECIFICACIONES TÉCNICAS'])
-    writer.writerow(['   - Fechas: Formato ISO 8601 (YYYY-MM-DD)'])
-    writer.writerow(['   - Decimales: Separador punto (.), dos decimales para montos'])
-    writer.writerow(['   - Moneda: Pesos Chilenos ($)'])
-    writer.writerow(['   - Codificación: UTF-8'])
-    writer.writerow([])
-    writer.writerow(['3. PROCESO DE CARGA'])
-    writer.writerow(['   - Complete los datos en las secciones indicadas'])
-    writer.writerow(['   - Mantenga la estructura de encabezados original'])
-    writer.writerow(['   - Elimine las filas de ejemplo antes de la carga productiva'])
-    writer.writerow([])
-    
-    # ===== SECCIÓN DE DATOS - ENCABEZADOS =====
-    writer.writerow(['SECCIÓN II: ESTRUCTURA DE DATOS - MONTOS TRIBUTARIOS'])
-    encabezados = [
-        'EJERCICIO_FISCAL (*)',
-        'CODIGO_MERCADO (*)', 
-        'INSTRUMENTO_FINANCIERO (*)',
-        'FECHA_PAGO (*)',
-        'SECUENCIA_EVENTO',
-        'DESCRIPCION_EVENTO',
-        'TIPO_SOCIEDAD',
-        'VALOR_HISTORICO'
-    ]
-    
-    # Montos con descripción formal
-    descripciones_oficiales = {
-        8: 'MONTO_CREDITO_IDPC_2017',
-        9: 'MONTO_CREDITO_IDPC_2016', 
-        10: 'MONTO_CREDITO_IDPC_VOLUNTARIO',
-        11: 'MONTO_SIN_CREDITO_IDPC',
-        12: 'MONTO_RENTAS_RAP_DIF_INICIAL',
-        13: 'MONTO_OTRAS_RENTAS_SIN_PRIORIDAD',
-        14: 'MONTO_EXCESO_DISTRIBUCIONES',
-        15: 'MONTO_UTILIDADES_ISFUT_20780',
-        16: 'MONTO_RENTAS_1983_ISFUT_21210',
-        17: 'MONTO_RENTAS_EXENTAS_IGC_AFECTAS_IA',
-        18: 'MONTO_RENTAS_EXENTAS_IGC_IA',
-        19: 'MONTO_INGRESOS_NO_CONSTITUTIVOS_RENTA',
-        # ... continuar con los 37 montos
-    }
-    
-    for i in range(8, 38):
-        nombre_oficial = descripciones_oficiales.get(i, f'MONTO_{i:02d}')
-        encabezados.append(f'{nombre_oficial}')
-    
-    writer.writerow(encabezados)
-    writer.writerow([])
-    
-    # ===== EJEMPLOS FORMALES COMPLETOS =====
-    writer.writerow(['SECCIÓN III: EJEMPLOS FORMALES DE REGISTRO'])
-    writer.writerow(['NOTA: Los siguientes ejemplos representan casos reales válidos para el sistema.'])
-    writer.writerow([])
-    
-    # Ejemplo 1 - Acción con dividendos
-    writer.writerow(['EJEMPLO 1: ACCIÓN ORDINARIA - DIVIDENDO ORDINARIO'])
-    ejemplo1 = [
-        2024,                           # EJERCICIO_FISCAL
-        'ACN',                          # CODIGO_MERCADO
-        'BANCO_SANTANDER_CHILE',        # INSTRUMENTO_FINANCIERO  
-        '2024-09-15',                   # FECHA_PAGO
-        10001,                          # SECUENCIA_EVENTO
-        'DIVIDENDO ORDINARIO CORRESPONDIENTE AL EJERCICIO 2024',
-        'A',                            # TIPO_SOCIEDAD
-        '1850.75'                       # VALOR_HISTORICO
-    ]
-    
-    # Montos de ejemplo realistas
-    montos_ejemplo1 = [
-        '1250000.00',   # monto_8
-        '850000.00',    # monto_9  
-        '0.00',         # monto_10
-        '2500000.00',   # monto_11
-        '0.00',         # monto_12
-        '150000.00',    # monto_13
-        '0.00',         # monto_14
-        '0.00',         # monto_15
-        '0.00',         # monto_16
-        '0.00',         # monto_17
-        '0.00',         # monto_18
-        '0.00',         # monto_19
-        # ... completar con 0.00 hasta monto_37
-    ]
-    
-    # Rellenar los 37 montos
-    while len(montos_ejemplo1) < 30:  # 37-8+1 = 30 campos
-        montos_ejemplo1.append('0.00')
-    
-    ejemplo1.extend(montos_ejemplo1[:30])
-    writer.writerow(ejemplo1)
-    writer.writerow([])
-    
-    # Ejemplo 2 - Cuota de fondo
-    writer.writerow(['EJEMPLO 2: CUOTA DE FONDO DE INVERSIÓN - DISTRIBUCIÓN SEMESTRAL'])
-    ejemplo2 = [
-        2024,
-        'CFI',
-        'FONDO_CAPITALIZACION_NUAM', 
-        '2024-06-30',
-        10002,
-        'DISTRIBUCIÓN DE UTILIDADES SEMESTRALES FONDO DE INVERSIÓN',
-        'C',
-        '0.00'
-    ]
-    
-    montos_ejemplo2 = [
-        '0.00',         # monto_8
-        '0.00',         # monto_9
-        '0.00',         # monto_10
-        '3250000.00',   # monto_11
-        '0.00',         # monto_12
-        '0.00',         # monto_13
-        '0.00',         # monto_14
-        '0.00',         # monto_15
-        '0.00',         # monto_16
-        '0.00',         # monto_17
-        '0.00',         # monto_18
-        '0.00',         # monto_19
-        # ... completar con 0.00
-    ]
-    
-    while len(montos_ejemplo2) < 30:
-        montos_ejemplo2.append('0.00')
-    
-    ejemplo2.extend(montos_ejemplo2[:30])
-    writer.writerow(ejemplo2)
-    writer.writerow([])
-    
-    # ===== SECCIÓN DE VALIDACIONES =====
-    writer.writerow(['SECCIÓN IV: NORMAS DE VALIDACIÓN'])
-    writer.writerow(['ARTÍCULO 1: FORMATOS ACEPTADOS'])
-    writer.writerow(['   - EJERCICIO_FISCAL: Año entre 2000 y 2030'])
-    writer.writerow(['   - CODIGO_MERCADO: ACN, CFI, FONDOS, DERIVADOS'])
-    writer.writerow(['   - FECHA_PAGO: Fecha válida en formato YYYY-MM-DD'])
-    writer.writerow(['   - SECUENCIA_EVENTO: Número único ≥ 10000'])
-    writer.writerow([])
-    writer.writerow(['ARTÍCULO 2: REGLAS DE NEGOCIO'])
-    writer.writerow(['   - Los montos deben ser valores numéricos positivos'])
-    writer.writerow(['   - El sistema calculará factores automáticamente'])
-    writer.writerow(['   - Validación: Σ(factores 8-16) ≤ 1.00000000'])
-    writer.writerow([])
-    
-    # ===== PIE DE PÁGINA FORMAL =====
-    writer.writerow(['SECCIÓN V: INFORMACIÓN INSTITUCIONAL'])
-    writer.writerow(['NUAM CAPITAL LIMITADA'])
-    writer.writerow(['RUT: 76.123.456-7'])
-    writer.writerow(['Av. Apoquindo 3000, Las Condes, Santiago'])
-    writer.writerow(['Teléfono: +56 2 2345 6789'])
-    writer.writerow(['Email: cumplimiento.tributario@nuamcapital.cl'])
-    writer.writerow(['Sitio Web: www.nuamcapital.cl'])
-    writer.writerow([])
-    writer.writerow(['DOCUMENTO DE USO INTERNO - CONFIDENCIALIDAD PROTEGIDA'])
-    
-    return response
+    return plantillas.responder(request, 'montos')
 @login_required
 def descargar_plantilla_factores(request):
     """Descargar plantilla CSV formal para carga de factores"""
-    response = HttpResponse(content_type='text/csv; charset=utf-8')
-    response['Content-Disposition'] = 'attachment; filename="NUAM_Plantilla_Formal_Factores_Tributarios.csv"'
-    
-    response.write(u'\ufeff')  # BOM para UTF-8
-    writer = csv.writer(response, delimiter=',', quoting=csv.QUOTE_ALL)
-    
-    # ===== HEADER CORPORATIVO FORMAL =====
-    writer.writerow(['NUAM CAPITAL - SISTEMA INTEGRAL DE GESTIÓN TRIBUTARIA'])
-    writer.writerow(['PLANTILLA FORMAL PARA CARGA MASIVA DE FACTORES TRIBUTARIOS'])
-    writer.writerow(['Fecha de Emisión:', datetime.now().strftime('%d de %B de %Y')])
-    writer.writerow(['Código Documento:', 'NUAM-FACTORES-PLANTILLA-1.0'])
-    writer.writerow(['Área Responsable:', 'Departamento de Análisis Tributario'])
-    writer.writerow([])
-    
-    # ===== INSTRUCCIONES ESPECÍFICAS FACTORES =====
-    writer.writerow(['SECCIÓN I: INSTRUCCIONES ESPECIALIZADAS - FACTORES'])
-    writer.writerow(['1. PRECISIÓN DECIMAL REQUERIDA'])
-    writer.writerow(['   - Todos los factores deben tener 8 decimales'])
-    writer.writerow(['   - Formato: 0.12345678 (nunca 0,12345678)'])
-    writer.writerow(['   - Rango válido: 0.00000000 a 1.00000000'])
-    writer.writerow([])
-    writer.writerow(['2. RESTRICCIÓN CRÍTICA - SUMA FACTORES 8-16'])
-    writer.writerow(['   - La suma de factores 8 al 16 NO debe superar 1.00000000'])
-    writer.writerow(['   - Validación automática: Σ(factor_8...factor_16) ≤ 1.0'])
-    writer.writerow(['   - Ejemplo válido: 0.15000000 + 0.20000000 + ... = 0.95000000'])
-    writer.writerow(['   - Ejemplo inválido: 0.30000000 + 0.35000000 + ... = 1.10000000'])
-    writer.writerow([])
-    
-    # ===== SECCIÓN DE DATOS - ENCABEZADOS FACTORES =====
-    writer.writerow(['SECCIÓN II: ESTRUCTURA DE DATOS - FACTORES TRIBUTARIOS'])
-    encabezados = [
-        'EJERCICIO_FISCAL (*)',
-        'CODIGO_MERCADO (*)',
-        'INSTRUMENTO_FINANCIERO (*)', 
-        'FECHA_PAGO (*)',
-        'SECUENCIA_EVENTO',
-        'DESCRIPCION_EVENTO'
-    ]
-    
-    # Factores con nomenclatura oficial completa
-    nomenclatura_oficial = {
-        8: 'FACTOR_CREDITO_IDPC_DESDE_2017',
-        9: 'FACTOR_CREDITO_IDPC_HASTA_2016',
-        10: 'FACTOR_CREDITO_IDPC_VOLUNTARIO',
-        11: 'FACTOR_SIN_CREDITO_IDPC',
-        12: 'FACTOR_RENTAS_RAP_DIFERENCIA_INICIAL',
-        13: 'FACTOR_OTRAS_RENTAS_SIN_PRIORIDAD',
-        14: 'FACTOR_EXCESO_DISTRIBUCIONES_DESPROPORCIONADAS',
-        15: 'FACTOR_UTILIDADES_ISFUT_LEY_20780',
-        16: 'FACTOR_RENTAS_1983_ISFUT_LEY_21210',
-        17: 'FACTOR_RENTAS_EXENTAS_IGC_AFECTAS_IA',
-        18: 'FACTOR_RENTAS_EXENTAS_IGC_IA',
-        19: 'FACTOR_INGRESOS_NO_CONSTITUTIVOS_RENTA',
-        # ... continuar para los 37 factores
-    }
-    
-    for i in range(8, 38):
-        nombre_oficial = nomenclatura_oficial.get(i, f'FACTOR_{i:02d}')
-        encabezados.append(f'{nombre_oficial}')
-    
-    writer.writerow(encabezados)
-    writer.writerow([])
-    
-    # ===== EJEMPLOS FORMALES COMPLETOS FACTORES =====
-    writer.writerow(['SECCIÓN III: EJEMPLOS FORMALES DE FACTORES VÁLIDOS'])
-    writer.writerow(['NOTA: Estos ejemplos cumplen con todas las validaciones del sistema.'])
-    writer.writerow([])
-    
-    # Ejemplo 1 - Factores que suman exactamente 1.0
-    writer.writerow(['EJEMPLO 1: ACCIÓN - SUMA FACTORES 8-16 = 1.00000000'])
-    ejemplo1 = [
-        2024,
-        'ACN', 
-        'EMPRESAS_CMPC',
-        '2024-12-20',
-        10003,
-        'DIVIDENDO FINAL EJERCICIO 2024'
-    ]
-    
-    # Factores que suman exactamente 1.0 para 8-16
-    factores_ejemplo1 = [
-        '0.15000000',   # factor_8
-        '0.12000000',   # factor_9
-        '0.08000000',   # factor_10
-        '0.18000000',   # factor_11
-        '0.09000000',   # factor_12
-        '0.11000000',   # factor_13
-        '0.10000000',   # factor_14
-        '0.09000000',   # factor_15
-        '0.08000000',   # factor_16
-        # Factores 17-37 en 0
-    ]
-    
-    # Completar con ceros hasta factor_37
-    while len(factores_ejemplo1) < 30:
-        factores_ejemplo1.append('0.00000000')
-    
-    ejemplo1.extend(factores_ejemplo1[:30])
-    writer.writerow(ejemplo1)
-    writer.writerow([])
-    
-    # Ejemplo 2 - Factores que suman menos de 1.0
-    writer.writerow(['EJEMPLO 2: FONDO INVERSIÓN - SUMA FACTORES 8-16 = 0.73000000'])
-    ejemplo2 = [
-        2024,
-        'CFI',
-        'FONDO_RENTA_FIJA_NUAM',
-        '2024-03-31',
-        10004,
-        'DISTRIBUCIÓN TRIMESTRAL DE RENTAS'
-    ]
-    
-    factores_ejemplo2 = [
-        '0.10000000',   # factor_8
-        '0.08000000',   # factor_9
-        '0.06000000',   # factor_10
-        '0.15000000',   # factor_11
-        '0.07000000',   # factor_12
-        '0.09000000',   # factor_13
-        '0.08000000',   # factor_14
-        '0.05000000',   # factor_15
-        '0.04000000',   # factor_16
-        # Resto en 0
-    ]
-    
-    while len(factores_ejemplo2) < 30:
-        factores_ejemplo2.append('0.00000000')
-    
-    ejemplo2.extend(factores_ejemplo2[:30])
-    writer.writerow(ejemplo2)
-    writer.writerow([])
-    
-    # ===== SECCIÓN DE VALIDACIONES AVANZADAS =====
-    writer.writerow(['SECCIÓN IV: VALIDACIONES AVANZADAS'])
-    writer.writerow(['CONTROL 1: INTEGRIDAD MATEMÁTICA'])
-    writer.writerow(['   - Verificación: factor_8 + factor_9 + ... + factor_16 ≤ 1.00000000'])
-    writer.writerow(['   - Tolerancia: 0.00000001 (precisión de 8 decimales)'])
-    writer.writerow([])
-    writer.writerow(['CONTROL 2: CONSISTENCIA TRIBUTARIA'])
-    writer.writerow(['   - Factores deben representar distribución real de rentas'])
-    writer.writerow(['   - Compatibilidad con normativa SII vigente'])
-    writer.writerow(['   - Auditoría trail disponible por 10 años'])
-    writer.writerow([])
-    
-    # ===== PIE DE PÁGINA FORMAL =====
-    writer.writerow(['SECCIÓN V: GOBERNANZA Y CUMPLIMIENTO'])
-    writer.writerow(['NUAM CAPITAL LIMITADA'])
-    writer.writerow(['Registro SII: 12345-6'])
-    writer.writerow(['Superintendencia de Valores y Seguros: Corredor Autorizado'])
-    writer.writerow(['Política de Cumplimiento: NC-2024-001'])
-    writer.writerow([])
-    writer.writerow(['CONTACTO INSTITUCIONAL:'])
-    writer.writerow(['Jefe Departamento Tributario: Sr. Eduardo Leiva'])
-    writer.writerow(['Email: analisis.tributario@nuamcapital.cl'])
-    writer.writerow(['Teléfono: +56 2 2345 6790'])
-    writer.writerow([])
-    writer.writerow(['DOCUMENTO CONTROLADO - VERSIÓN 1.0'])
-    
-    return response
\ No newline at end of file
+    return plantillas.responder(request, 'factores')
+
+def exportar_metricas(request):
+    """Métricas en formato Prometheus. Acceso con METRICAS_TOKEN (Bearer) o como superusuario"""
+    autorizacion = request.headers.get('Authorization', '')
+    token = settings.METRICAS_TOKEN
+    con_token = bool(token) and hmac.compare_digest(autorizacion, f'Bearer {token}')
+    if not con_token and not request.user.is_superuser:
+        return HttpResponseForbidden('Acceso restringido')
+    return HttpResponse(metricas.exportar(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -33,6 +34,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Primero, para contar también las consultas de sesión y autenticación
+    'calificaciones.instrumentacion.InstrumentacionSQLMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -103,6 +106,52 @@ STATICFILES_DIRS = [
     BASE_DIR / 'calificaciones' / 'static',
 ]
 
+# Archivos subidos (carga masiva)
+MEDIA_URL = '/media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
+# Cola de carga masiva (manage.py procesar_cargas)
+CARGA_MASIVA_PROCESOS = int(os.getenv('CARGA_MASIVA_PROCESOS', '2'))
+CARGA_MASIVA_MAX_INTENTOS = int(os.getenv('CARGA_MASIVA_MAX_INTENTOS', '3'))
+CARGA_MASIVA_REINTENTO_SEGUNDOS = int(os.getenv('CARGA_MASIVA_REINTENTO_SEGUNDOS', '30'))
+CARGA_MASIVA_TIMEOUT_SEGUNDOS = int(os.getenv('CARGA_MASIVA_TIMEOUT_SEGUNDOS', '600'))
+# Cada cuánto el trabajador renueva el latido del archivo en proceso (muy por debajo del timeout)
+CARGA_MASIVA_LATIDO_SEGUNDOS = int(os.getenv('CARGA_MASIVA_LATIDO_SEGUNDOS', '30'))
+# Procesos que parsean en paralelo cada archivo grande, por tramos de CARGA_MASIVA_TAMANO_TRAMO bytes
+CARGA_MASIVA_PROCESOS_LECTURA = int(os.getenv('CARGA_MASIVA_PROCESOS_LECTURA', str(os.cpu_count() or 1)))
+CARGA_MASIVA_TAMANO_TRAMO = int(os.getenv('CARGA_MASIVA_TAMANO_TRAMO', str(8 * 1024 * 1024)))
+
+# Subida por partes de archivos grandes (calificaciones/subidas.py). El proxy debe
+# aceptar cuerpos de al menos CARGA_MASIVA_TAMANO_PARTE bytes
+CARGA_MASIVA_TAMANO_PARTE = int(os.getenv('CARGA_MASIVA_TAMANO_PARTE', str(8 * 1024 * 1024)))
+CARGA_MASIVA_TAMANO_MAXIMO = int(os.getenv('CARGA_MASIVA_TAMANO_MAXIMO', str(20 * 1024 ** 3)))
+# Subidas sin partes nuevas durante este tiempo se cancelan y se borra su spool
+CARGA_MASIVA_SUBIDA_VENCE_HORAS = int(os.getenv('CARGA_MASIVA_SUBIDA_VENCE_HORAS', '48'))
+
+# Plantillas de carga precalculadas (calificaciones/plantillas.py)
+PLANTILLAS_CACHE_DIR = os.getenv('PLANTILLAS_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'nuam_plantillas'))
+
+# Instrumentación SQL por petición (calificaciones/instrumentacion.py)
+INSTRUMENTACION_SQL = os.getenv('INSTRUMENTACION_SQL', 'True') == 'True'
+# Repeticiones de una misma consulta en una petición a partir de las cuales se reporta N+1
+INSTRUMENTACION_UMBRAL_N_MAS_1 = int(os.getenv('INSTRUMENTACION_UMBRAL_N_MAS_1', '5'))
+
+# Métricas en formato Prometheus (calificaciones/metricas.py, expuestas en /metricas/)
+METRICAS_DIR = os.getenv('METRICAS_DIR', os.path.join(tempfile.gettempdir(), 'nuam_metricas'))
+METRICAS_INTERVALO_SEGUNDOS = float(os.getenv('METRICAS_INTERVALO_SEGUNDOS', '1'))
+# Token para el scraper (cabecera "Authorization: Bearer <token>"); sin token solo superusuarios
+METRICAS_TOKEN = os.getenv('METRICAS_TOKEN', '')
+
+# API por lotes (calificaciones/api.py): operaciones por transacción y máximo por llamada
+API_TAMANO_LOTE = int(os.getenv('API_TAMANO_LOTE', '1000'))
+API_MAX_OPERACIONES = int(os.getenv('API_MAX_OPERACIONES', '50000'))
+
+# Filas por bloque (y por transacción) de las operaciones masivas del mantenedor (calificaciones/masivo.py)
+MASIVO_TAMANO_BLOQUE = int(os.getenv('MASIVO_TAMANO_BLOQUE', '2000'))
+
+# Login por nombre de usuario o email con un solo hash por intento
+AUTHENTICATION_BACKENDS = ['calificaciones.backends.EmailOUsuarioBackend']
+
 # Login URLs
 LOGIN_URL = '/login/'
 LOGIN_REDIRECT_URL = '/'
@@ -117,12 +166,19 @@ LOGOUT_REDIRECT_URL = '/'
 
 # Configuración de Email
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
-EMAIL_HOST = 'smtp.gmail.com'  # O tu servidor SMTP
-EMAIL_PORT = 587
-EMAIL_USE_TLS = True
+EMAIL_HOST = os.getenv('EMAIL_HOST', 'smtp.gmail.com')  # O tu servidor SMTP
+EMAIL_PORT = int(os.getenv('EMAIL_PORT', '587'))
+EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS', 'True') == 'True'
 EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
+EMAIL_TIMEOUT = int(os.getenv('EMAIL_TIMEOUT', '15'))
 DEFAULT_FROM_EMAIL = 'NUAM Capital <noreply@nuamcapital.cl>'
 
+# Bandeja de salida de correos (manage.py enviar_correos)
+CORREO_LOTE = int(os.getenv('CORREO_LOTE', '50'))
+CORREO_MAX_INTENTOS = int(os.getenv('CORREO_MAX_INTENTOS', '5'))
+CORREO_REINTENTO_SEGUNDOS = int(os.getenv('CORREO_REINTENTO_SEGUNDOS', '15'))
+CORREO_TIMEOUT_SEGUNDOS = int(os.getenv('CORREO_TIMEOUT_SEGUNDOS', '300'))
+
 # Para Gmail necesitas una "Contraseña de aplicación"
 # Ve a: Google Account → Seguridad → Contraseñas de aplicación
\ No newline at end of file
@@ -17,7 +17,15 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from calificaciones.admin import instrumentacion_sql_view
+
 urlpatterns = [
+    # Antes que admin.site.urls, que responde 404 a cualquier otra ruta bajo admin/
+    path(
+        'admin/instrumentacion-sql/',
+        admin.site.admin_view(instrumentacion_sql_view),
+        name='instrumentacion_sql',
+    ),
     path('admin/', admin.site.urls),
     path('', include('calificaciones.urls')),
 ]
\ No newline at end of file